@@ -6,7 +6,7 @@ if project_root not in sys.path:
 from pathlib import Path
 import uvicorn
 from utils.agent_menager import build_agent
-from google.adk.a2a.utils.agent_to_a2a import to_a2a
+from utils.a2a_streaming import build_a2a_app
 from fastapi.middleware.cors import CORSMiddleware
 from a2a.types import AgentCard
 from backend.utils.sqlite_functions import get_config_sqlite 
@@ -24,13 +24,13 @@ agent_card = AgentCard(name=agent_name,
     url=f"http://{IP}:{PORT}/",
     description= "Test agent from file",
     version="1.0.0",
-    capabilities= {},
+    capabilities= {"streaming": True},
     skills=[],
     defaultInputModes= ["text/plain"],
     defaultOutputModes= ["text/plain"],
     supportsAuthenticatedExtendedCard= False,
 )
-a2a_app = to_a2a(root_agent,agent_card=agent_card)
+a2a_app = build_a2a_app(root_agent, agent_card)
 
 a2a_app.add_middleware(
   CORSMiddleware,
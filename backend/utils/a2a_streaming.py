@@ -0,0 +1,101 @@
+"""A2A app that streams the agent's work instead of answering only at the end.
+Clients using message/stream receive, in order:
+  - the retrieval stages as they finish (data parts with a 'stage' key and
+    metadata 'retrieval_stage'), including the candidates found before the
+    reranker runs, so a slow rerank no longer hides every result;
+  - the model output token by token (metadata 'partial': true), followed by
+    the complete answer as the task artifact.
+"""
+import asyncio
+import uuid
+from datetime import datetime, timezone
+from a2a.server.apps import A2AStarletteApplication
+from a2a.server.request_handlers import DefaultRequestHandler
+from a2a.server.tasks import InMemoryTaskStore
+from a2a.types import DataPart, Message, Role, TaskState, TaskStatus, TaskStatusUpdateEvent
+from google.adk.a2a.converters.event_converter import convert_event_to_a2a_events
+from google.adk.a2a.converters.part_converter import (convert_a2a_part_to_genai_part,
+                                                      convert_genai_part_to_a2a_part)
+from google.adk.a2a.converters.request_converter import convert_a2a_request_to_agent_run_request
+from google.adk.a2a.executor.a2a_agent_executor import A2aAgentExecutor, A2aAgentExecutorConfig
+from google.adk.agents.run_config import StreamingMode
+from google.adk.artifacts.in_memory_artifact_service import InMemoryArtifactService
+from google.adk.auth.credential_service.in_memory_credential_service import InMemoryCredentialService
+from google.adk.memory.in_memory_memory_service import InMemoryMemoryService
+from google.adk.runners import Runner
+from google.adk.sessions.in_memory_session_service import InMemorySessionService
+from . import progress
+
+def streaming_request_converter(request, part_converter=convert_a2a_part_to_genai_part):
+  """Converts an A2A request into an ADK run that streams the model output."""
+  run_request = convert_a2a_request_to_agent_run_request(request, part_converter)
+  run_request.run_config.streaming_mode = StreamingMode.SSE
+  return run_request
+
+def streaming_event_converter(event, invocation_context, task_id=None, context_id=None,
+                              part_converter=convert_genai_part_to_a2a_part):
+  """Converts an ADK event, marking the token chunks of a streamed answer
+  so clients can append them and then replace them with the full text."""
+  a2a_events = convert_event_to_a2a_events(event, invocation_context, task_id,
+                                           context_id, part_converter)
+  if event.partial:
+    for a2a_event in a2a_events:
+      a2a_event.metadata = dict(a2a_event.metadata or {}, partial=True)
+  return a2a_events
+
+class StreamingA2aAgentExecutor(A2aAgentExecutor):
+  """A2aAgentExecutor that also publishes the retrieval progress of the run.
+  Stages reported through progress.report() while the request is executed
+  (from the event loop or from the tool's worker thread) become 'working'
+  status updates of the task.
+  """
+  def __init__(self, *, runner, config: A2aAgentExecutorConfig = None):
+    super().__init__(runner=runner, config=config or A2aAgentExecutorConfig(
+      request_converter=streaming_request_converter,
+      event_converter=streaming_event_converter))
+
+  async def execute(self, context, event_queue):
+    loop = asyncio.get_running_loop()
+
+    def publish(stage: str, details: dict):
+      event = TaskStatusUpdateEvent(
+        task_id=context.task_id,
+        context_id=context.context_id,
+        status=TaskStatus(
+          state=TaskState.working,
+          timestamp=datetime.now(timezone.utc).isoformat(),
+          message=Message(message_id=str(uuid.uuid4()),
+                          role=Role.agent,
+                          parts=[DataPart(data={"stage": stage, **details})]),
+        ),
+        metadata={"retrieval_stage": stage},
+        final=False,
+      )
+      try:
+        on_loop = asyncio.get_running_loop() is loop
+      except RuntimeError:
+        on_loop = False
+      if on_loop:
+        loop.create_task(event_queue.enqueue_event(event))
+      else:
+        asyncio.run_coroutine_threadsafe(event_queue.enqueue_event(event), loop)
+
+    with progress.listening(publish):
+      await super().execute(context, event_queue)
+
+def build_a2a_app(agent, agent_card):
+  """Starlette A2A app for the agent, streaming progress and tokens.
+  Same in-memory services as google.adk's to_a2a(), which does not let the
+  executor be configured.
+  """
+  runner = Runner(
+    app_name=agent.name or "adk_agent",
+    agent=agent,
+    artifact_service=InMemoryArtifactService(),
+    session_service=InMemorySessionService(),
+    memory_service=InMemoryMemoryService(),
+    credential_service=InMemoryCredentialService(),
+  )
+  request_handler = DefaultRequestHandler(agent_executor=StreamingA2aAgentExecutor(runner=runner),
+                                          task_store=InMemoryTaskStore())
+  return A2AStarletteApplication(agent_card=agent_card, http_handler=request_handler).build()
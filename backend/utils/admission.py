@@ -0,0 +1,72 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+class Saturated(RuntimeError):
+  """Raised when a task is refused or would finish after its deadline."""
+
+class BoundedPool():
+  """Thread pool with admission control for CPU-bound work.
+  At most 'workers' tasks run and 'queue_depth' wait; further tasks are
+  refused at once. A task is also refused when the expected wait, estimated
+  from the tasks ahead of it and a moving average of the service time,
+  would exceed its deadline, and abandoned if it is not done by then.
+  Args:
+    workers (int): Tasks run in parallel.
+    queue_depth (int): Tasks allowed to wait for a worker.
+    name (str): Thread name prefix.
+  """
+  smoothing = 0.2
+
+  def __init__(self, workers: int, queue_depth: int, name: str = "bounded"):
+    self.workers = workers
+    self.queue_depth = queue_depth
+    self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+    self.lock = threading.Lock()
+    self.pending = 0
+    self.service_time = None  # moving average, seconds
+
+  def expected_wait(self, pending: int) -> float:
+    """Seconds until a task submitted behind 'pending' others completes."""
+    if self.service_time is None:
+      return 0.0
+    return (pending // self.workers + 1) * self.service_time
+
+  def _run(self, function, args, kwargs):
+    start = time.perf_counter()
+    try:
+      return function(*args, **kwargs)
+    finally:
+      elapsed = time.perf_counter() - start
+      with self.lock:
+        self.pending -= 1
+        self.service_time = (elapsed if self.service_time is None else
+                             self.smoothing * elapsed + (1 - self.smoothing) * self.service_time)
+
+  def run(self, function, *args, deadline: float = None, **kwargs):
+    """Runs function in the pool and waits for its result.
+    Args:
+      deadline (float): Seconds the caller can wait, None to wait as long as needed.
+    Raises:
+      Saturated: The queue is full, the deadline would be missed or it was.
+    """
+    with self.lock:
+      if self.pending >= self.workers + self.queue_depth:
+        raise Saturated(f"{self.pending} tasks pending")
+      if deadline is not None and self.expected_wait(self.pending) > deadline:
+        raise Saturated(f"expected wait {self.expected_wait(self.pending):.3f}s "
+                        f"exceeds the {deadline:.3f}s deadline")
+      self.pending += 1
+    try:
+      future = self.executor.submit(self._run, function, args, kwargs)
+    except BaseException:
+      with self.lock:
+        self.pending -= 1
+      raise
+    try:
+      return future.result(timeout=deadline)
+    except FutureTimeout:
+      if future.cancel():
+        with self.lock:
+          self.pending -= 1
+      raise Saturated(f"not done within the {deadline:.3f}s deadline")
@@ -1,3 +1,6 @@
+import asyncio
+import functools
+import inspect
 from google.adk.agents import LlmAgent
 from google.adk.models.lite_llm import LiteLlm
 from google.adk.tools.mcp_tool.mcp_toolset import McpToolset, SseConnectionParams
@@ -34,6 +37,16 @@ def _resolve_rag_tool():
 
   raise ImportError(f"RAG tool '{name}' not found in retrieval module")
 
+def threaded_tool(tool):
+  """Async version of a blocking tool function, run in a worker thread so the
+  event loop keeps streaming (e.g. retrieval progress) while it works."""
+  if not callable(tool) or inspect.iscoroutinefunction(tool) or not hasattr(tool, "__name__"):
+    return tool
+  @functools.wraps(tool)
+  async def wrapper(*args, **kwargs):
+    return await asyncio.to_thread(tool, *args, **kwargs)
+  return wrapper
+
 def build_agent() -> LlmAgent:
   """Build the LlmAgent based on the current config.json."""
   model_name = sf.get_config_sqlite("model")
@@ -46,7 +59,7 @@ def build_agent() -> LlmAgent:
       McpToolset(connection_params=SseConnectionParams(url=tool["url"]))
       for tool in cache_tools
     ])
-  tools.append(_resolve_rag_tool())
+  tools.append(threaded_tool(_resolve_rag_tool()))
   
   if sf.get_prompt_sqlite() is None:
     return LlmAgent(
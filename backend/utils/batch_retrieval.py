@@ -0,0 +1,199 @@
+"""Offline retrieval of many stored questions against one collection.
+Instead of one embedding call and one Chroma request per question, queries
+are embedded in large batches, each batch is sent to Chroma as a single
+multi-query request, and the (query, chunk) pairs of the whole batch are
+reranked together. While one batch is reranked, the next one is already
+being embedded and searched. Results come back in the order of the queries,
+as the top_k / top_k_reranker dictionaries.
+
+Run from the repository root:
+  python -m backend.utils.batch_retrieval questions.txt manuals --k 5 --rerank --out answers.jsonl
+questions.txt holds one question per line, or JSON lines with a "query" key.
+"""
+import argparse
+import itertools
+import json
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from . import metrics
+from .retrieval import Retriever, get_embedder, get_fanout_pool
+
+BATCH_SIZE = 256  # queries embedded and sent to Chroma together
+RERANK_BATCH_SIZE = 512  # (query, chunk) pairs per reranker call
+
+class BatchStats():
+  """Progress of a batch run; 'rate' is the throughput in queries/s."""
+  def __init__(self):
+    self.queries = 0
+    self.batches = 0
+    self.started = time.perf_counter()
+
+  @property
+  def elapsed(self) -> float:
+    return time.perf_counter() - self.started
+
+  @property
+  def rate(self) -> float:
+    return self.queries / self.elapsed if self.elapsed > 0 else 0.0
+
+def iter_batches(items: Iterable, size: int) -> Iterator[list]:
+  """Consecutive lists of up to size items, reading the iterable lazily."""
+  iterator = iter(items)
+  while True:
+    batch = list(itertools.islice(iterator, size))
+    if not batch:
+      return
+    yield batch
+
+def _search(collection, queries: List[str], n_results: int,
+            where: Optional[Dict[str, Any]], where_document: Optional[Dict[str, Any]]) -> dict:
+  """One embedding call and one Chroma request for a whole batch."""
+  embeddings = get_embedder()(queries)
+  return collection.query(query_embeddings=list(embeddings),
+                          n_results=n_results,
+                          where=where,
+                          where_document=where_document,
+                          include=["documents", "distances"])
+
+def _rerank(retriever: Retriever, queries: List[str], documents: List[List[str]],
+            batch_size: int) -> List[List[float]]:
+  """Scores the candidates of every query, sending the pairs of different
+  queries to the reranker together. Offline jobs call the model directly
+  rather than through the reranker pool that protects interactive queries."""
+  pairs = [[q, d] for q, docs in zip(queries, documents) for d in docs]
+  scores = []
+  for start in range(0, len(pairs), batch_size):
+    chunk = retriever.get_reranker().compute_score(pairs[start:start + batch_size])
+    scores.extend(chunk if isinstance(chunk, list) else [chunk])
+  per_query, start = [], 0
+  for docs in documents:
+    per_query.append(scores[start:start + len(docs)])
+    start += len(docs)
+  return per_query
+
+def batch_retrieve(queries: Iterable[str],
+                   collection_name: str,
+                   k: int = 5,
+                   rerank: bool = False,
+                   high_k: int = 20,
+                   where: Optional[Dict[str, Any]] = None,
+                   where_document: Optional[Dict[str, Any]] = None,
+                   retriever: Optional[Retriever] = None,
+                   batch_size: int = BATCH_SIZE,
+                   rerank_batch_size: int = RERANK_BATCH_SIZE,
+                   stats: Optional[BatchStats] = None) -> Iterator[Dict[str, Any]]:
+  """Retrieves the top 'k' chunks for each query, streaming results in order.
+  Args:
+    queries: List or iterator of questions; iterators are read one batch
+      at a time, so the questions need not fit in memory.
+    collection_name (str): The name of an existing ChromaDB collection.
+    k (int): The number of documents returned per query.
+    rerank (bool): Whether to rerank 'high_k' candidates per query.
+    high_k (int): Candidates retrieved for reranking.
+    where (dict): Metadata filter applied to every query.
+    where_document (dict): Text filter applied to every query.
+    retriever (Retriever): Client, token budget and compression settings,
+      defaults to a new Retriever().
+    batch_size (int): Queries embedded and searched together.
+    rerank_batch_size (int): (query, chunk) pairs per reranker call.
+    stats (BatchStats): Updated after every batch, for progress reporting.
+  Yields:
+    Dict[str, Any]: One result per query, as returned by top_k (or by
+      top_k_reranker when rerank is set).
+  """
+  retriever = retriever if retriever is not None else Retriever()
+  stats = stats if stats is not None else BatchStats()
+  try:
+    collection = retriever.client.get_collection(name=collection_name)
+  except Exception as e:
+    raise ValueError(f"Collection '{collection_name}' not found: {e}")
+  n_results = high_k if rerank else k
+  strategy = "top_k_reranker" if rerank else "top_k"
+  parameters = {'high_k': high_k} if rerank else {'k': k}
+
+  def submit(batch):
+    return get_fanout_pool().submit(_search, collection, batch, n_results, where, where_document)
+
+  batches = iter_batches(queries, batch_size)
+  batch = next(batches, None)
+  future = submit(batch) if batch else None
+  while batch:
+    found = future.result()
+    following = next(batches, None)
+    if following:
+      future = submit(following)
+
+    if rerank:
+      all_scores = _rerank(retriever, batch, found["documents"], rerank_batch_size)
+    results = []
+    for q, query in enumerate(batch):
+      ids, documents = found["ids"][q], found["documents"][q]
+      if rerank:
+        scores = all_scores[q]
+        order = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)[:k]
+        ids, documents = [ids[i] for i in order], [documents[i] for i in order]
+        values, higher_is_better = [scores[i] for i in order], True
+      else:
+        values, higher_is_better = found["distances"][q], False
+      result = {
+        'query': query,
+        'collection': collection_name,
+        'ids': ids,
+        'content': documents,
+        'distances': values,
+        'parameters': dict(parameters),
+        'time': time.time()
+      }
+      results.append(retriever.pack(result, higher_is_better=higher_is_better))
+
+    stats.queries += len(batch)
+    stats.batches += 1
+    metrics.increment("batch_queries", len(batch), strategy=strategy, collection=collection_name)
+    metrics.observe("batch_queries_per_second", stats.rate, collection=collection_name)
+    yield from results
+    batch = following
+
+def read_queries(path: str) -> Iterator[str]:
+  """Questions of a file: plain lines, or JSON lines with a 'query' key."""
+  with open(path, encoding="utf-8") as file:
+    for line in file:
+      line = line.strip()
+      if not line:
+        continue
+      yield json.loads(line)["query"] if line.startswith("{") else line
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                   formatter_class=argparse.RawDescriptionHelpFormatter,
+                                   epilog="\n".join(__doc__.splitlines()[1:]))
+  parser.add_argument("questions", help="file with the questions")
+  parser.add_argument("collection")
+  parser.add_argument("--k", type=int, default=5)
+  parser.add_argument("--rerank", action="store_true")
+  parser.add_argument("--high-k", type=int, default=20)
+  parser.add_argument("--where", type=json.loads, help='metadata filter as JSON, e.g. \'{"page": {"$lte": 10}}\'')
+  parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+  parser.add_argument("--out", help="JSON lines output, stdout by default")
+  args = parser.parse_args()
+
+  stats = BatchStats()
+  results = batch_retrieve(read_queries(args.questions), args.collection, k=args.k,
+                           rerank=args.rerank, high_k=args.high_k, where=args.where,
+                           batch_size=args.batch_size, stats=stats)
+  out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+  try:
+    reported = 0
+    for result in results:
+      out.write(json.dumps(result, ensure_ascii=False) + "\n")
+      if stats.batches > reported:
+        reported = stats.batches
+        print(f"{stats.queries} queries, {stats.rate:.1f} queries/s", file=sys.stderr)
+  finally:
+    if out is not sys.stdout:
+      out.close()
+  print(f"Done: {stats.queries} queries in {stats.elapsed:.1f}s ({stats.rate:.1f} queries/s)",
+        file=sys.stderr)
+
+if __name__ == "__main__":
+  main()
@@ -2,16 +2,23 @@ import chromadb
 from dotenv import load_dotenv
 import os
 import json
+import difflib
+from . import lexical
+from .hashing import chunk_sha256
+from .sharding import ShardedClient, ShardedCollection
+from . import sqlite_functions as sq
 load_dotenv()
 
 def connect_chroma():
-    """Connects to ChromaDB using credentials from environment variables."""
+    """Connects to ChromaDB using credentials from environment variables.
+    Collections sharded in config.db are opened across their own endpoints.
+    """
     host = os.getenv('CHROMA_HOST')
     port = os.getenv('CHROMA_PORT')
     if not host or not port:
         raise ValueError("CHROMA_HOST and CHROMA_PORT must be set in your .env file")
     client = chromadb.HttpClient(host=host, port=port)
-    return client
+    return ShardedClient(client)
 
 def get_collection(client:chromadb.api.client.Client,
                   collection_name:str) -> chromadb.api.client.Collection:
@@ -19,34 +26,300 @@ def get_collection(client:chromadb.api.client.Client,
     collection = client.get_collection(name=collection_name)
     return collection
 
+HNSW_KEYS = ("space", "ef_construction", "ef_search", "max_neighbors")
+
 def create_collection(client:chromadb.api.client.Client,
-                      collection_name:str)->chromadb.api.client.Collection:
-  """Creates a new collection in ChromaDB."""
+                      collection_name:str,
+                      hnsw:dict = None)->chromadb.api.client.Collection:
+  """Creates a new collection in ChromaDB.
+  hnsw overrides Chroma's HNSW defaults (max_neighbors, i.e. M,
+  ef_construction, ef_search); without it, those saved for the collection
+  in config.db are used.
+  """
+  if hnsw is None:
+    hnsw = sq.get_hnsw_sqlite(collection_name)
   collection = client.create_collection(
     name=collection_name,
     configuration={
       "hnsw": {
-        "space": "cosine"
+        "space": "cosine",
+        **{k: v for k, v in hnsw.items() if k in HNSW_KEYS and v is not None}
       }
     }
   )
   return collection
 
+def hnsw_configuration(collection:chromadb.api.client.Collection) -> dict:
+    """Returns the HNSW settings of a collection, to recreate it identically."""
+    hnsw = (collection.configuration or {}).get("hnsw") or {}
+    return {k: hnsw[k] for k in HNSW_KEYS if hnsw.get(k) is not None} or {"space": "cosine"}
+
+def iter_collection(collection:chromadb.api.client.Collection,
+                    batch_size:int = 1000,
+                    include:list = ("documents", "metadatas", "embeddings")):
+    """Yields the content of a collection in batches, without loading it all."""
+    total = collection.count()
+    for offset in range(0, total, batch_size):
+        yield collection.get(include=list(include), limit=batch_size, offset=offset)
+
+REBUILD_MARKER = "rebuild_of"  # metadata of the collections a rebuild swaps
+
+def copy_collection(client:chromadb.api.client.Client,
+                    collection:chromadb.api.client.Collection,
+                    target_name:str,
+                    hnsw:dict = None,
+                    batch_size:int = 1000,
+                    metadata:dict = None) -> chromadb.api.client.Collection:
+    """Copies the live chunks of a collection, embeddings included, into a
+    new collection with the same HNSW settings, or these overridden by hnsw,
+    and the same metadata, or metadata. Raises ValueError if target_name
+    already exists."""
+    if _find_collection(client, target_name) is not None:
+        raise ValueError(f"Collection '{target_name}' already exists")
+    copy = client.create_collection(
+        name=target_name,
+        configuration={"hnsw": {**hnsw_configuration(collection), **(hnsw or {})}},
+        metadata=metadata or collection.metadata
+    )
+    for batch in iter_collection(collection, batch_size):
+        copy.add(
+            ids=batch["ids"],
+            embeddings=batch["embeddings"],
+            documents=batch["documents"],
+            metadatas=batch["metadatas"]
+        )
+    return copy
+
+def _find_collection(client:chromadb.api.client.Client, name:str):
+    """Returns a collection by name, None if it doesn't exist."""
+    try:
+        return client.get_collection(name=name)
+    except chromadb.errors.NotFoundError:
+        return None
+
+def _rebuild_leftover(client:chromadb.api.client.Client, name:str, collection_name:str):
+    """Returns the collection 'name' left by an interrupted rebuild of
+    collection_name, None if there is none. Raises ValueError if the name
+    is taken by a collection the rebuild did not create."""
+    leftover = _find_collection(client, name)
+    if leftover is not None and (leftover.metadata or {}).get(REBUILD_MARKER) != collection_name:
+        raise ValueError(f"Collection '{name}' already exists and was not left by a "
+                         f"rebuild of '{collection_name}'")
+    return leftover
+
+def rebuild_collection(client:chromadb.api.client.Client,
+                       collection_name:str,
+                       batch_size:int = 1000,
+                       hnsw:dict = None) -> chromadb.api.client.Collection:
+    """Rebuilds a collection's HNSW index without re-embedding.
+    Deleted chunks stay in the index as tombstones; copying the live
+    embeddings into a new collection drops them. The original collection
+    keeps serving queries until the copy is complete; it is then renamed
+    aside, the copy renamed into its place, and only then deleted. The
+    two collections carry REBUILD_MARKER while they are swapped, so a
+    rebuild interrupted halfway is cleaned up (or its original put back) by
+    the next one.
+    Sharded collections are rebuilt shard by shard. hnsw changes settings
+    that are fixed once the index exists, such as max_neighbors and
+    ef_construction.
+    """
+    copy_name, replaced_name = f"{collection_name}_rebuild", f"{collection_name}_replaced"
+    replaced = _rebuild_leftover(client, replaced_name, collection_name)
+    collection = _find_collection(client, collection_name)
+    if collection is None and replaced is not None:
+        replaced.modify(name=collection_name)
+        collection, replaced = replaced, None
+    elif collection is None:
+        raise ValueError(f"Collection '{collection_name}' does not exist")
+    if isinstance(collection, ShardedCollection):
+        for shard_client in collection.clients:
+            rebuild_collection(shard_client, collection_name, batch_size, hnsw)
+        return client.get_collection(name=collection_name)
+    if replaced is not None:
+        client.delete_collection(name=replaced_name)
+    if _rebuild_leftover(client, copy_name, collection_name) is not None:
+        client.delete_collection(name=copy_name)
+
+    original = collection.metadata or {}
+    marked = {**original, REBUILD_MARKER: collection_name}
+    rebuilt = copy_collection(client, collection, copy_name, hnsw, batch_size, marked)
+    collection.modify(name=replaced_name, metadata=marked)
+    rebuilt.modify(name=collection_name, metadata={**original, REBUILD_MARKER: None})
+    client.delete_collection(name=replaced_name)
+    return rebuilt
+
 def delete_collection(client:chromadb.api.client.Client, collection_name: str):
-    """Deletes a collection from ChromaDB."""
+    """Deletes a collection from ChromaDB and its lexical index."""
     client.delete_collection(name=collection_name)
+    lexical.delete_index(collection_name)
+
+def chunk_ids(source_name:str, hashes:list, taken=()) -> list:
+    """Content-derived chunk ids; repeated chunks get a numeric suffix."""
+    used = set(taken)
+    ids = []
+    for chunk_hash in hashes:
+        base = f"id_{source_name}_{chunk_hash[:16]}"
+        candidate, n = base, 1
+        while candidate in used:
+            candidate = f"{base}_{n}"
+            n += 1
+        used.add(candidate)
+        ids.append(candidate)
+    return ids
+
+def chunk_metadata(source_name:str, ordinal:int, chunk_hash:str, file_hash:str = None,
+                   document:str = None) -> dict:
+    """Metadata stored with every chunk; 'ordinal' is its position in the source.
+    Metadata found while splitting (page, section, date), carried by the
+    document as a Chunk, is stored too so queries can filter on it.
+    """
+    metadata = {k: v for k, v in (getattr(document, "metadata", None) or {}).items()
+                if v is not None}
+    metadata.update({"source": source_name, "ordinal": ordinal, "chunk_hash": chunk_hash})
+    if file_hash:
+        metadata["file_hash"] = file_hash
+    return metadata
+
+def _add_batches(collection, ids:list, documents:list, metadatas:list, batch_size:int,
+                 postings:lexical.Postings = None, progress=None):
+    """Adds chunks to Chroma and to the BM25 index, or to postings buffered
+    for it when given. progress(count) is called after each batch."""
+    for start in range(0, len(ids), batch_size):
+        end = start + batch_size
+        collection.add(
+            ids=ids[start:end],
+            documents=[str(d) for d in documents[start:end]],
+            metadatas=metadatas[start:end]
+        )
+        if progress:
+            progress(min(end, len(ids)))
+    if ids and postings is not None:
+        postings.add(ids, documents)
+    elif ids:
+        lexical.add_to_index(collection, ids, documents)
 
 def add_documents(collection:chromadb.api.client.Collection,
                   documents:list,
-                  source_name:str):
-    """Adds processed documents to a ChromaDB collection."""
-    current_count = collection.count()
-    ids = [f"id_{source_name}_{current_count + i}" for i, _ in enumerate(documents)]
-    metadatas = [{"source": source_name} for _ in documents]
-    
-    collection.add(
-        ids=ids,
-        documents=documents,
-        metadatas=metadatas
-    )
-    return True
\ No newline at end of file
+                  source_name:str,
+                  batch_size:int = 1000,
+                  file_hash:str = None):
+    """Adds processed documents to a ChromaDB collection.
+    Documents are sent in batches so large PDFs stay under Chroma's
+    maximum batch size, and are also added to the collection's BM25 index.
+    """
+    hashes = [chunk_sha256(d) for d in documents]
+    ids = chunk_ids(source_name, hashes)
+    metadatas = [chunk_metadata(source_name, i, h, file_hash, d)
+                 for i, (h, d) in enumerate(zip(hashes, documents))]
+    _add_batches(collection, ids, documents, metadatas, batch_size)
+    return True
+
+def stream_documents(collection:chromadb.api.client.Collection,
+                     chunks,
+                     source_name:str,
+                     batch_size:int = 256,
+                     file_hash:str = None,
+                     progress=None) -> int:
+    """Adds chunks from an iterator as they are produced and returns how many.
+    Each batch is written to Chroma as soon as it fills up, so indexing
+    starts before the whole document is split and only one batch is held in
+    memory. The BM25 postings of every batch are buffered and written once.
+    progress(count), if given, is called with the chunks written so far
+    after each batch.
+    """
+    taken, ordinal = set(), 0
+    ids, documents, metadatas = [], [], []
+    postings = lexical.Postings()
+    try:
+        for document in chunks:
+            chunk_hash = chunk_sha256(document)
+            chunk_id = chunk_ids(source_name, [chunk_hash], taken)[0]
+            taken.add(chunk_id)
+            ids.append(chunk_id)
+            documents.append(document)
+            metadatas.append(chunk_metadata(source_name, ordinal, chunk_hash, file_hash, document))
+            ordinal += 1
+            if len(ids) == batch_size:
+                _add_batches(collection, ids, documents, metadatas, batch_size, postings)
+                ids, documents, metadatas = [], [], []
+                if progress:
+                    progress(ordinal)
+        _add_batches(collection, ids, documents, metadatas, batch_size, postings)
+    finally:
+        if len(postings):
+            lexical.merge_into_index(collection, postings)
+    return ordinal
+
+def delete_source(collection:chromadb.api.client.Collection,
+                  source_name:str) -> int:
+    """Deletes every chunk of a source document and returns how many."""
+    ids = collection.get(where={"source": source_name}, include=[])["ids"]
+    if ids:
+        collection.delete(where={"source": source_name})
+        lexical.remove_from_index(collection.name, ids)
+    return len(ids)
+
+def get_source_chunks(collection:chromadb.api.client.Collection,
+                      source_name:str) -> list:
+    """Returns (id, metadata) of every chunk of a source, in document order."""
+    stored = collection.get(where={"source": source_name}, include=["metadatas"])
+    chunks = list(zip(stored["ids"], stored["metadatas"]))
+    return sorted(chunks, key=lambda c: c[1].get("ordinal", 0))
+
+def sync_document(collection:chromadb.api.client.Collection,
+                  documents:list,
+                  source_name:str,
+                  file_hash:str = None,
+                  batch_size:int = 1000,
+                  progress=None) -> dict:
+    """Adds a document, or re-indexes a changed one incrementally.
+    The stored and new chunk hashes are aligned; unchanged chunks keep their
+    ids and embeddings (only their ordinal is updated), chunks that no longer
+    exist are deleted and only new or edited chunks are embedded and added.
+    progress(count), if given, is called after each batch of added chunks.
+    Returns how many chunks were added, removed and kept.
+    """
+    existing = get_source_chunks(collection, source_name)
+    if not existing:
+        add_documents(collection, documents, source_name, batch_size, file_hash)
+        return {"added": len(documents), "removed": 0, "kept": 0}
+
+    old_ids = [i for i, _ in existing]
+    new_hashes = [chunk_sha256(d) for d in documents]
+    kept_ids = [None] * len(documents)
+    removed = []
+    if all("chunk_hash" in m for _, m in existing):
+        old_hashes = [m["chunk_hash"] for _, m in existing]
+        matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                kept_ids[j1:j2] = old_ids[i1:i2]
+            else:
+                removed.extend(old_ids[i1:i2])
+    else:
+        # Indexed before chunk hashes existed: replace everything
+        removed = old_ids
+
+    for start in range(0, len(removed), batch_size):
+        collection.delete(ids=removed[start:start + batch_size])
+    if removed:
+        lexical.remove_from_index(collection.name, removed)
+
+    old_metadata = dict(existing)
+    updates = [(i, chunk_metadata(source_name, j, new_hashes[j], file_hash, documents[j]))
+               for j, i in enumerate(kept_ids) if i is not None]
+    updates = [(i, m) for i, m in updates if old_metadata[i] != m]
+    for start in range(0, len(updates), batch_size):
+        batch = updates[start:start + batch_size]
+        collection.update(ids=[i for i, _ in batch], metadatas=[m for _, m in batch])
+
+    positions = [j for j, i in enumerate(kept_ids) if i is None]
+    new_ids = chunk_ids(source_name, [new_hashes[j] for j in positions], taken=old_ids)
+    _add_batches(collection,
+                 new_ids,
+                 [documents[j] for j in positions],
+                 [chunk_metadata(source_name, j, new_hashes[j], file_hash, documents[j])
+                  for j in positions],
+                 batch_size,
+                 progress=progress)
+    return {"added": len(positions), "removed": len(removed), "kept": len(documents) - len(positions)}
\ No newline at end of file
@@ -0,0 +1,104 @@
+import copy
+import functools
+import inspect
+import threading
+from . import metrics
+from . import progress
+
+class _Flight():
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+    self.waiters = 0
+    self.lock = threading.Lock()
+    self.events = []
+    self.listeners = []
+
+  def listen(self, listener):
+    """Replays the progress reported so far to listener, then sends it the rest."""
+    if listener is None:
+      return
+    with self.lock:
+      for stage, details in self.events:
+        listener(stage, details)
+      self.listeners.append(listener)
+
+  def publish(self, stage: str, details: dict):
+    with self.lock:
+      self.events.append((stage, details))
+      for listener in self.listeners:
+        listener(stage, details)
+
+class SingleFlight():
+  """Runs at most one computation per key at a time.
+  Callers arriving while a computation for the same key is in flight wait
+  for it and receive (a copy of) its result or exception instead of running
+  it again. The progress it reports goes to the listener of every caller,
+  replayed from the start for those who join late.
+  """
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._flights = {}
+
+  def do(self, key, function, *args, **kwargs) -> tuple:
+    """Returns (result, shared), where shared tells if the call was coalesced."""
+    with self._lock:
+      flight = self._flights.get(key)
+      leader = flight is None
+      if leader:
+        flight = self._flights[key] = _Flight()
+      else:
+        flight.waiters += 1
+    flight.listen(progress.current_listener())
+    if not leader:
+      flight.done.wait()
+      if flight.error is not None:
+        raise flight.error
+      # Each caller gets its own copy, so one cannot change another's result
+      return copy.deepcopy(flight.result), True
+
+    result = None
+    try:
+      with progress.listening(flight.publish):
+        result = function(*args, **kwargs)
+      return result, False
+    except BaseException as e:
+      flight.error = e
+      raise
+    finally:
+      with self._lock:
+        del self._flights[key]
+      if flight.waiters and flight.error is None:
+        flight.result = copy.deepcopy(result)
+      flight.done.set()
+
+flights = SingleFlight()
+
+def _freeze(value):
+  """Hashable form of an argument value (lists and dicts included)."""
+  if isinstance(value, dict):
+    return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+  if isinstance(value, (list, tuple, set)):
+    return tuple(_freeze(v) for v in value)
+  return value
+
+def coalesced(method):
+  """Shares one in-flight call among concurrent identical calls of a method.
+  Calls are identical when they are made on the same object with the same
+  arguments (defaults applied); coalesced calls are counted in the
+  'coalesced_calls' metric.
+  """
+  signature = inspect.signature(method)
+  @functools.wraps(method)
+  def wrapper(self, *args, **kwargs):
+    bound = signature.bind(self, *args, **kwargs)
+    bound.apply_defaults()
+    arguments = tuple((name, _freeze(value)) for name, value in bound.arguments.items()
+                      if name != "self")
+    key = (id(self), method.__name__, arguments)
+    result, shared = flights.do(key, method, self, *args, **kwargs)
+    if shared:
+      metrics.increment("coalesced_calls", strategy=method.__name__)
+    return result
+  return wrapper
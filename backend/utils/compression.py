@@ -0,0 +1,84 @@
+import re
+from typing import Dict, List, Any, Callable
+import numpy as np
+import nltk
+
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+GAP = "..."
+
+def split_sentences(text: str) -> List[str]:
+  """Splits a chunk into sentences with NLTK, or on punctuation without punkt."""
+  try:
+    return nltk.tokenize.sent_tokenize(text)
+  except LookupError:
+    return [s for s in SENTENCE_RE.split(text) if s.strip()]
+
+def compress_result(result: Dict[str, Any],
+                    embed: Callable[[List[str]], list],
+                    threshold: float,
+                    n_neighbors: int = 0) -> Dict[str, Any]:
+  """Keeps only the sentences of each chunk that are relevant to the query.
+  Every sentence of the result and the query are embedded in one call and
+  scored with a single matrix product. Sentences with a cosine similarity of
+  at least 'threshold' are kept together with 'n_neighbors' sentences on
+  each side; a chunk with no sentence above it keeps its best one, so every
+  id keeps some content. Dropped stretches are marked with '...'.
+  Args:
+    result (dict): Output of a Retriever strategy.
+    embed: Embedding function taking a list of texts.
+    threshold (float): Minimum cosine similarity to the query.
+    n_neighbors (int): Sentences kept around each relevant one.
+  Returns:
+    dict: The same result with compressed 'content' and a 'compression'
+      entry with the sentences and characters kept.
+  """
+  chunks = [split_sentences(c) for c in result["content"]]
+  sentences = [s for chunk in chunks for s in chunk]
+  total_chars = sum(len(c) for c in result["content"])
+  if not sentences:
+    result["compression"] = {"threshold": threshold, "sentences_kept": 0,
+                             "sentences_total": 0, "ratio": 1.0, "chars_ratio": 1.0}
+    return result
+
+  vectors = np.asarray(embed([result["query"]] + sentences), dtype=np.float32)
+  vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+  similarities = vectors[1:] @ vectors[0]
+
+  content, kept = [], 0
+  start = 0
+  for chunk in chunks:
+    scores = similarities[start:start + len(chunk)]
+    start += len(chunk)
+    if not chunk:
+      content.append("")
+      continue
+    relevant = scores >= threshold
+    if not relevant.any():
+      relevant[int(np.argmax(scores))] = True
+    # Widen every relevant sentence by n_neighbors on each side
+    mask = relevant.copy()
+    for shift in range(1, n_neighbors + 1):
+      mask[shift:] |= relevant[:-shift]
+      mask[:-shift] |= relevant[shift:]
+    parts, previous = [], -1
+    for i in np.flatnonzero(mask):
+      if previous >= 0 and i != previous + 1:
+        parts.append(GAP)
+      parts.append(chunk[i])
+      previous = i
+    if not mask[0]:
+      parts.insert(0, GAP)
+    if not mask[-1]:
+      parts.append(GAP)
+    content.append(" ".join(parts))
+    kept += int(mask.sum())
+
+  result["content"] = content
+  result["compression"] = {
+    "threshold": threshold,
+    "sentences_kept": kept,
+    "sentences_total": len(sentences),
+    "ratio": round(kept / len(sentences), 4),
+    "chars_ratio": round(sum(len(c) for c in content) / max(total_chars, 1), 4),
+  }
+  return result
@@ -0,0 +1,21 @@
+import hashlib
+import os
+
+def file_sha256(file, block_size: int = 1 << 20) -> str:
+  """Returns the SHA-256 of a file's content, read in blocks.
+  file is a path or a binary file object, such as an upload, which is read
+  from the start and rewound afterwards.
+  """
+  if isinstance(file, (str, os.PathLike)):
+    with open(file, "rb") as opened:
+      return file_sha256(opened, block_size)
+  digest = hashlib.sha256()
+  file.seek(0)
+  for block in iter(lambda: file.read(block_size), b""):
+    digest.update(block)
+  file.seek(0)
+  return digest.hexdigest()
+
+def chunk_sha256(text: str) -> str:
+  """Returns the SHA-256 of a chunk's text."""
+  return hashlib.sha256(text.encode("utf-8")).hexdigest()
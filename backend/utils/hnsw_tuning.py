@@ -0,0 +1,205 @@
+"""Tunes a collection's HNSW index against its own data.
+Sweeps ef_search, and optionally max_neighbors (M), over a sample of
+queries, measuring recall@k against an exact search over every stored
+embedding and the latency of each query, then applies the cheapest setting
+that reaches the target recall. Each M is measured on one temporary copy of
+the collection, kept in a local directory rather than on the server, whose
+ef_search is changed between measurements. Chroma only picks up a new
+ef_search when it loads the index again, so the copy is reopened after each
+change, and applying a setting rebuilds the collection (without
+re-embedding). Latencies are in-process, without the network round trip.
+The chosen values are saved in the collection's 'hnsw' entry in config.db.
+
+Queries are a random sample of the stored chunks or, with --queries-file,
+real questions (one per line, or JSON lines with a "query" key). Stored
+chunks give optimistic recall, since each one is its own nearest neighbour.
+
+Run from the repository root:
+  python -m backend.utils.hnsw_tuning manuals --target-recall 0.95
+  python -m backend.utils.hnsw_tuning manuals --max-neighbors 8 16 32 --queries-file questions.txt --apply
+"""
+import argparse
+import contextlib
+import json
+import random
+import tempfile
+import time
+import numpy as np
+from chromadb.api.client import Client
+from chromadb.config import Settings, System
+from . import chroma_functions as cf
+from . import sqlite_functions as sq
+from .model_server import query_embedder
+from .sharding import ShardedCollection
+
+DEFAULT_EF_SEARCH = (10, 20, 40, 80, 160, 320)
+CHROMA_DEFAULTS = {"max_neighbors": 16, "ef_construction": 100, "ef_search": 100}
+
+def sample_queries(collection, n: int, seed: int = 0) -> np.ndarray:
+  """Embeddings of n chunks picked at random from the collection."""
+  total = collection.count()
+  offsets = sorted(random.Random(seed).sample(range(total), min(n, total)))
+  vectors = [collection.get(limit=1, offset=o, include=["embeddings"])["embeddings"][0]
+             for o in offsets]
+  return np.asarray(vectors, dtype=np.float32)
+
+def read_queries(path: str) -> list[str]:
+  """Questions of a file: plain lines, or JSON lines with a 'query' key."""
+  with open(path, encoding="utf-8") as file:
+    lines = [line.strip() for line in file if line.strip()]
+  return [json.loads(l)["query"] if l.startswith("{") else l for l in lines]
+
+def _distances(queries: np.ndarray, vectors: np.ndarray, space: str) -> np.ndarray:
+  """Chroma's distance from every query to every vector."""
+  if space == "cosine":
+    q = queries / np.linalg.norm(queries, axis=1, keepdims=True).clip(min=1e-12)
+    v = vectors / np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+    return 1 - q @ v.T
+  if space == "ip":
+    return 1 - queries @ vectors.T
+  return ((queries ** 2).sum(1)[:, None] - 2 * queries @ vectors.T
+          + (vectors ** 2).sum(1)[None, :])
+
+def exact_neighbors(collection, queries: np.ndarray, k: int, space: str,
+                    batch_size: int = 5000) -> list[set]:
+  """Ids of the true k nearest chunks of each query, by brute force.
+  The collection is read in batches, keeping only the best k so far."""
+  best_distances = np.full((len(queries), 0), np.inf, dtype=np.float32)
+  best_ids = np.empty((len(queries), 0), dtype=object)
+  for batch in cf.iter_collection(collection, batch_size, include=["embeddings"]):
+    if not batch["ids"]:
+      continue
+    distances = _distances(queries, np.asarray(batch["embeddings"], dtype=np.float32), space)
+    ids = np.broadcast_to(np.asarray(batch["ids"], dtype=object), distances.shape)
+    distances = np.concatenate([best_distances, distances], axis=1)
+    ids = np.concatenate([best_ids, ids], axis=1)
+    keep = np.argsort(distances, axis=1)[:, :k]
+    best_distances = np.take_along_axis(distances, keep, axis=1)
+    best_ids = np.take_along_axis(ids, keep, axis=1)
+  return [set(row) for row in best_ids]
+
+def measure(collection, queries: np.ndarray, truth: list[set], k: int) -> dict:
+  """recall@k and per-query latency of the collection's current index."""
+  collection.query(query_embeddings=[queries[0]], n_results=k, include=[])  # warm-up
+  recalls, latencies = [], []
+  for query, relevant in zip(queries, truth):
+    start = time.perf_counter()
+    found = collection.query(query_embeddings=[query], n_results=k, include=[])["ids"][0]
+    latencies.append((time.perf_counter() - start) * 1000)
+    recalls.append(len(relevant.intersection(found)) / max(len(relevant), 1))
+  latencies.sort()
+  return {"recall": round(float(np.mean(recalls)), 4),
+          "p50_ms": round(latencies[len(latencies) // 2], 3),
+          "p95_ms": round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 3)}
+
+class LocalCopy():
+  """A copy of a collection in a local directory, built once and reopened
+  after each ef_search change so that Chroma loads its index again."""
+  NAME = "hnsw_tune"
+
+  def __init__(self, path: str):
+    self.path = path
+    self.system = None
+    self.collection = None
+
+  def _open(self) -> Client:
+    if self.system is not None:
+      self.system.stop()
+    self.system = System(Settings(is_persistent=True, persist_directory=self.path,
+                                  anonymized_telemetry=False))
+    self.system.start()
+    return Client.from_system(self.system)
+
+  def build(self, collection, hnsw: dict):
+    self.collection = cf.copy_collection(self._open(), collection, self.NAME, hnsw)
+
+  def set_ef_search(self, ef_search: int):
+    self.collection.modify(configuration={"hnsw": {"ef_search": ef_search}})
+    self.collection = self._open().get_collection(name=self.NAME)
+
+  def close(self):
+    if self.system is not None:
+      self.system.stop()
+      self.system = None
+
+@contextlib.contextmanager
+def local_copy(collection, hnsw: dict):
+  """LocalCopy of the collection with the given HNSW settings, removed on exit."""
+  with tempfile.TemporaryDirectory(prefix="hnsw_tune_") as path:
+    copy = LocalCopy(path)
+    try:
+      copy.build(collection, hnsw)
+      yield copy
+    finally:
+      copy.close()
+
+def sweep(client, collection_name: str, queries: np.ndarray, k: int = 10,
+          ef_search: tuple = DEFAULT_EF_SEARCH, max_neighbors: tuple = ()) -> list[dict]:
+  """Measures every (max_neighbors, ef_search) pair, building one local
+  copy per max_neighbors value and changing its ef_search in turn."""
+  collection = client.get_collection(name=collection_name)
+  if isinstance(collection, ShardedCollection):
+    raise ValueError("Sharded collections are tuned on each shard's server")
+  current = {**CHROMA_DEFAULTS, **cf.hnsw_configuration(collection)}
+  truth = exact_neighbors(collection, queries, k, current.get("space", "l2"))
+  rows = []
+  for m in sorted(set(max_neighbors) | {current["max_neighbors"]}):
+    with local_copy(collection, {"max_neighbors": m}) as trial:
+      for ef in ef_search:
+        trial.set_ef_search(ef)
+        rows.append({"max_neighbors": m, "ef_search": ef,
+                     **measure(trial.collection, queries, truth, k)})
+        print(f"  M={m} ef_search={ef}: recall@{k}={rows[-1]['recall']} "
+              f"p50={rows[-1]['p50_ms']}ms p95={rows[-1]['p95_ms']}ms")
+  return rows
+
+def cheapest(rows: list[dict], target_recall: float):
+  """Fastest setting reaching the target recall, the smaller index on ties."""
+  passing = [r for r in rows if r["recall"] >= target_recall]
+  if not passing:
+    return None
+  return min(passing, key=lambda r: (r["p50_ms"], r["max_neighbors"], r["ef_search"]))
+
+def apply_setting(client, collection_name: str, setting: dict):
+  """Rebuilds the collection with a swept setting and saves it in config.db."""
+  hnsw = {"max_neighbors": setting["max_neighbors"], "ef_search": setting["ef_search"]}
+  cf.rebuild_collection(client, collection_name, hnsw=hnsw)
+  sq.update_hnsw_sqlite(collection_name, hnsw)
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                   formatter_class=argparse.RawDescriptionHelpFormatter,
+                                   epilog="\n".join(__doc__.splitlines()[1:]))
+  parser.add_argument("collection")
+  parser.add_argument("--k", type=int, default=10, help="neighbours whose recall is measured")
+  parser.add_argument("--sample", type=int, default=200, help="queries sampled from the chunks")
+  parser.add_argument("--queries-file", help="real questions to use instead")
+  parser.add_argument("--ef-search", type=int, nargs="+", default=list(DEFAULT_EF_SEARCH))
+  parser.add_argument("--max-neighbors", type=int, nargs="+", default=[],
+                      help="M values to try besides the current one")
+  parser.add_argument("--target-recall", type=float, default=0.95)
+  parser.add_argument("--apply", action="store_true", help="apply the chosen setting")
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+
+  client = cf.connect_chroma()
+  collection = client.get_collection(name=args.collection)
+  if args.queries_file:
+    queries = np.asarray(query_embedder()(read_queries(args.queries_file)), dtype=np.float32)
+  else:
+    queries = sample_queries(collection, args.sample, args.seed)
+  if not len(queries):
+    raise SystemExit(f"Collection '{args.collection}' is empty, nothing to tune.")
+  print(f"Tuning '{args.collection}' ({collection.count()} chunks) with {len(queries)} queries")
+  rows = sweep(client, args.collection, queries, args.k, args.ef_search, args.max_neighbors)
+  best = cheapest(rows, args.target_recall)
+  if best is None:
+    raise SystemExit(f"No setting reaches recall@{args.k} >= {args.target_recall}; "
+                     "try larger --ef-search or --max-neighbors values.")
+  print(f"Cheapest with recall@{args.k} >= {args.target_recall}: {json.dumps(best)}")
+  if args.apply:
+    apply_setting(client, args.collection, best)
+    print(f"Applied to '{args.collection}'.")
+
+if __name__ == "__main__":
+  main()
@@ -2,12 +2,29 @@ import PyPDF2
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from unstructured.partition.pdf import partition_pdf
 import nltk
-from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer 
+import numpy as np
 import re
+import bisect
+from .model_server import sentence_model
 
 nltk.download("punkt")
-model = SentenceTransformer('all-MiniLM-L6-v2')  #Chromadb default model
+nltk.download("punkt_tab")  # required by sent_tokenize since nltk 3.9
+model = sentence_model()  # Chromadb default model, shared through the model server if set
+
+ENCODE_BATCH_SIZE = 64
+MAX_CARRY_CHARS = 4000  # a sentence still open after this is cut at the page end
+
+class Chunk(str):
+  """Chunk text that also carries the metadata found while splitting it
+  ('page', 'section', 'date'); it behaves as a plain string everywhere else."""
+  def __new__(cls, text: str, metadata: dict = None):
+    chunk = super().__new__(cls, text)
+    chunk.metadata = dict(metadata or {})
+    return chunk
+
+def extract_page_text(page) -> str:
+  """Extracts the text of a single PDF page."""
+  return page.extract_text() or ""
 
 def extract_from_pdf(file_path:str) -> str:
   """Extracts the text from PDFs"""
@@ -15,19 +32,114 @@ def extract_from_pdf(file_path:str) -> str:
   with open(file_path, "rb") as file:
     reader = PyPDF2.PdfReader(file)
     for page in reader.pages:
-      page_text = page.extract_text()
-      if page_text:
-        text += page_text
+      text += extract_page_text(page)
   return text
 
+def iter_pdf_pages(file_path:str):
+  """Yields (page number, text) for each PDF page with text, one at a time."""
+  with open(file_path, "rb") as file:
+    reader = PyPDF2.PdfReader(file)
+    for number, page in enumerate(reader.pages, start=1):
+      page_text = extract_page_text(page)
+      if page_text:
+        yield number, page_text
+
+def pdf_date(file_path:str):
+  """Creation (or else modification) date of a PDF as YYYYMMDD, None if unknown.
+  Stored as an int so it can be filtered with $gte/$lte."""
+  try:
+    with open(file_path, "rb") as file:
+      info = PyPDF2.PdfReader(file).metadata
+      date = info and (info.creation_date or info.modification_date)
+  except Exception:
+    return None
+  return int(date.strftime("%Y%m%d")) if date else None
+
 def split_sentences_with_nltk(text: str) -> list[str]:
   """Uses NLKT for most precise sentence spliting."""
   return nltk.tokenize.sent_tokenize(text)
 
+def iter_sentences(file_path:str):
+  """Yields the sentences of a PDF, segmenting one page at a time.
+  The last sentence of a page may continue on the next one, so it is held
+  back and segmented again together with the following page's text, unless
+  it is already longer than MAX_CARRY_CHARS. Sentences are Chunks with the
+  'page' they start on.
+  """
+  carry, carry_page = "", None
+  for page, page_text in iter_pdf_pages(file_path):
+    text = carry + page_text
+    first_page = carry_page if carry else page
+    sentences = split_sentences_with_nltk(text)
+    if not sentences:
+      carry, carry_page = text, first_page
+      continue
+    for i, sentence in enumerate(sentences[:-1]):
+      yield Chunk(sentence, {"page": first_page if i == 0 else page})
+    # Keep the raw tail, trailing whitespace included, as extract_from_pdf would
+    tail = text.rfind(sentences[-1])
+    carry = text[tail:] if tail >= 0 else sentences[-1]
+    carry_page = first_page if len(sentences) == 1 else page
+    if len(carry) > MAX_CARRY_CHARS:
+      # Text without sentence ends (tables, lists) would be held back forever
+      yield Chunk(sentences[-1], {"page": carry_page})
+      carry = ""
+  for sentence in split_sentences_with_nltk(carry):
+    yield Chunk(sentence, {"page": carry_page})
+
+def iter_embedded_sentences(sentences, batch_size:int = ENCODE_BATCH_SIZE):
+  """Yields (sentence, normalized embedding) pairs, encoding in fixed-size batches."""
+  batch = []
+  for sentence in sentences:
+    batch.append(sentence)
+    if len(batch) == batch_size:
+      yield from zip(batch, model.encode(batch, normalize_embeddings=True))
+      batch = []
+  if batch:
+    yield from zip(batch, model.encode(batch, normalize_embeddings=True))
+
+def group_sentences(embedded, threshold):
+  """Groups consecutive sentences while they stay similar to the first one.
+  A chunk is yielded as soon as a sentence falls below the threshold, so only
+  the open chunk is kept in memory. It keeps the metadata (page) of its
+  first sentence.
+  Args:
+      embedded: Iterable of (sentence, normalized embedding) pairs.
+      threshold: Function of the number of sentences already added to the
+          chunk that returns the similarity the next one must reach.
+  """
+  chunk_raw, anchor, added, metadata = None, None, 0, None
+  for sentence, embedding in embedded:
+    if chunk_raw is not None and float(np.dot(anchor, embedding)) >= threshold(added):
+      chunk_raw += " " + sentence
+      added += 1
+      continue
+    if chunk_raw is not None:
+      yield Chunk(chunk_raw, metadata)
+    chunk_raw, anchor, added = str(sentence), embedding, 0
+    metadata = getattr(sentence, "metadata", None)
+  if chunk_raw is not None:
+    yield Chunk(chunk_raw, metadata)
+
 class Splitter():
   """A class that has text splitting functions"""
   def __init__(self):
     pass
+  def iter_chunks(self, method:str, file_path:str, **params):
+    """Yields the chunks of a PDF, streaming when the method supports it.
+    Chunks carry their metadata: 'page' (first page, 1-based), 'section'
+    (title, unstructured_chunks only) and the document 'date' (YYYYMMDD).
+    """
+    streaming = getattr(self, f"iter_{method}", None)
+    chunks = (streaming(file_path, **params) if streaming is not None
+              else getattr(self, method)(file_path, **params))
+    date = pdf_date(file_path)
+    for chunk in chunks:
+      metadata = dict(getattr(chunk, "metadata", None) or {})
+      if date:
+        metadata["date"] = date
+      yield Chunk(chunk, metadata)
+
   def equal_chunks(self,file_path:str,
                    chunck_size:int = 750,
                    chunk_overlap:int= 50) -> list[str]:
@@ -37,23 +149,24 @@ class Splitter():
     Returns:
         list[str]: A list of text chunks.
     """
-    text = ""
-    with open(file_path, "rb") as file:
-      reader = PyPDF2.PdfReader(file)
-      for page in reader.pages:
-        page_text = page.extract_text()
-        if page_text:
-          text += page_text
-      text_splitter = RecursiveCharacterTextSplitter(
+    text, page_starts = "", []
+    for page, page_text in iter_pdf_pages(file_path):
+      page_starts.append((len(text), page))
+      text += page_text
+    text_splitter = RecursiveCharacterTextSplitter(
       chunk_size = chunck_size,
       chunk_overlap = chunk_overlap,
       length_function = len,
       is_separator_regex= False,
-      )
+      add_start_index = True,
+    )
     chunk = text_splitter.create_documents([text])
+    offsets = [start for start, _ in page_starts]
     documents = []
     for c in chunk:
-      documents.append(c.page_content)
+      position = bisect.bisect_right(offsets, c.metadata.get("start_index", 0)) - 1
+      metadata = {"page": page_starts[position][1]} if position >= 0 else {}
+      documents.append(Chunk(c.page_content, metadata))
     return documents
 
   # Function to return chunks usign usntructured library
@@ -71,10 +184,32 @@ class Splitter():
     chunking_strategy = "by_title",
     )
     documents = []
+    section = None
     for c in raw_chunks:
-      documents.append(c.text)
+      # by_title chunks start at a title; chunks split for size keep the last one
+      titles = [e.text for e in (getattr(c.metadata, "orig_elements", None) or [])
+                if e.category == "Title" and e.text]
+      if titles:
+        section = titles[0]
+      metadata = {}
+      if c.metadata.page_number:
+        metadata["page"] = c.metadata.page_number
+      if section:
+        metadata["section"] = section
+      documents.append(Chunk(c.text, metadata))
     return documents
   # Functions to return semantic chunks
+  def iter_simple_decision(self,file_path,
+                           start_limit:float =0.5,
+                           y:float = 0.1,
+                           batch_size:int = ENCODE_BATCH_SIZE):
+    """Streaming version of simple_decision; yields each chunk once it is closed.
+    Memory stays constant in document size: pages are segmented one at a time
+    and sentences are encoded in batches of batch_size.
+    """
+    embedded = iter_embedded_sentences(iter_sentences(file_path), batch_size)
+    return group_sentences(embedded, lambda added: start_limit + y * added)
+
   def simple_decision(self,file_path,
                       start_limit:float =0.5,
                       y:float = 0.1,)->list[str]:
@@ -82,36 +217,19 @@ class Splitter():
       Args:
           start_limit (float): The initial similarity threshold (e.g., 0.7).
           y (float): Amount to increase the threshold after each addition.
-          sentences (list[str]): The list of sentences to group.
-          all_embeddings: The embedding of each senetence
       Returns:
           list[str]: A list of cohesive text chunks.
       """
-    text = extract_from_pdf(file_path)
-    sentences = split_sentences_with_nltk(text)
-    all_embeddings = model.encode(sentences)
-    chunks = []
-    i = 0
-    while i < (len(sentences)):
-      chunk_raw = sentences[i]
-      embedding_frase = all_embeddings[i]
-      current_limit = start_limit
-      counter = 1
-      while True:
-        following = i + counter
-        if following > len(sentences)-1:
-          break
-        embedding_next = all_embeddings[following]
-        similaridade = cosine_similarity([embedding_frase], [embedding_next])
-        if similaridade >= current_limit :
-          chunk_raw += " " + sentences[following]
-          counter += 1
-          current_limit = current_limit + y
-        else:
-          break
-      chunks.append(chunk_raw)
-      i = i + counter
-    return chunks
+    return list(self.iter_simple_decision(file_path, start_limit, y))
+
+  def iter_changing_decision(self,file_path,
+                             start_limit:float = 0.3,
+                             y:float =0.75,
+                             batch_size:int = ENCODE_BATCH_SIZE):
+    """Streaming version of changing_decision; yields each chunk once it is closed."""
+    limit = 1 - start_limit
+    embedded = iter_embedded_sentences(iter_sentences(file_path), batch_size)
+    return group_sentences(embedded, lambda added: start_limit + limit * (1 - y**added))
 
   def changing_decision(self,file_path,
                         start_limit:float = 0.3,
@@ -121,35 +239,7 @@ class Splitter():
           start_limit (float): The initial similarity threshold (e.g., 0.7).
           y (float): Growth rate (0-1). A smaller value means faster
               growth; a larger value means slower growth.
-          sentences (list[str]): The list of sentences to group.
-          all_embeddings: embedding for each sentece
       Returns:
           list[str]: A list of cohesive text chunks.
       """
-    text = extract_from_pdf(file_path)
-    sentences = split_sentences_with_nltk(text)
-    all_embeddings = model.encode(sentences)
-    chunks = []
-    i = 0
-    while i < (len(sentences)):
-      chunk_raw = sentences[i]
-      embedding_frase = all_embeddings[i]
-      counter = 1
-      current_limit = start_limit
-      limit = 1 - start_limit
-      while True:
-        following = i + counter
-        if following > len(sentences)-1:
-          break
-        embedding_next = all_embeddings[following]
-        similaridade = cosine_similarity([embedding_frase], [embedding_next])
-        x = counter
-        if similaridade >= current_limit :
-          chunk_raw += " " + sentences[following]
-          counter += 1
-          current_limit = start_limit + (limit*(1-y**x))
-        else:
-          break
-      chunks.append(chunk_raw)
-      i = i + counter
-    return chunks
+    return list(self.iter_changing_decision(file_path, start_limit, y))
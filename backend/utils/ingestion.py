@@ -0,0 +1,141 @@
+"""PDF ingestion, shared by the background workers.
+Run the worker pool with:
+  python -m backend.utils.ingestion --workers 4
+"""
+import argparse
+import contextlib
+import multiprocessing
+import os
+import socket
+import time
+import uuid
+from . import chroma_functions as cf
+from . import sqlite_functions as sq
+from .hashing import file_sha256
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+HEARTBEAT_CHUNKS = 256  # chunks split between progress reports
+
+def save_upload(file_name: str, content: bytes) -> str:
+  """Stores an uploaded file where the workers can read it."""
+  os.makedirs(UPLOAD_DIR, exist_ok=True)
+  file_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}_{file_name}")
+  with open(file_path, "wb") as f:
+    f.write(content)
+  return file_path
+
+def discard_upload(file_path: str):
+  """Deletes a stored upload once its job is finished."""
+  with contextlib.suppress(FileNotFoundError):
+    os.remove(file_path)
+
+def ingest_file(client, splitter, collection_name: str, file_path: str,
+                source_name: str, progress=None) -> dict:
+  """Splits a PDF with the collection's method and indexes it.
+  Unchanged and duplicate files are skipped by content hash, and changed
+  files are re-indexed incrementally. Chunks of a new source are written to
+  Chroma while the rest of the PDF is still being split. Progress is
+  reported after every batch, which keeps a worker's job lease alive on
+  large PDFs.
+  Args:
+    client: ChromaDB client.
+    splitter: Splitter instance.
+    collection_name (str): Target collection.
+    file_path (str): Path of the PDF to process.
+    source_name (str): Name the document is stored under.
+    progress: Optional callback(fraction, message).
+  Returns:
+    dict: The 'status' plus chunk counts ('added', 'removed', 'kept').
+  """
+  report = progress or (lambda fraction, message: None)
+  file_hash = file_sha256(file_path)
+  indexed_as = sq.find_document_by_hash_sqlite(collection_name, file_hash)
+  if indexed_as is not None:
+    return {"status": "skipped", "duplicate_of": indexed_as}
+
+  details = sq.get_collection_params_sqlite(collection_name)
+  if not details:
+    raise ValueError(f"Collection '{collection_name}' not found in SQLite.")
+  existed = sq.document_exists_sqlite(collection_name, source_name)
+  collection = cf.get_collection(client, collection_name)
+  chunks = splitter.iter_chunks(details["index_method"], file_path, **details["index_params"])
+  if not cf.get_source_chunks(collection, source_name):
+    # New source: write chunks to Chroma while the rest is still being split
+    report(0.1, "splitting and indexing")
+    count = cf.stream_documents(collection, chunks, source_name, file_hash=file_hash,
+                                progress=lambda n: report(0.1, f"splitting and indexing, {n} chunks"))
+    stats = {"added": count, "removed": 0, "kept": 0}
+  else:
+    report(0.1, "splitting")
+    documents = []
+    for document in chunks:
+      documents.append(document)
+      if len(documents) % HEARTBEAT_CHUNKS == 0:
+        report(0.1, f"splitting, {len(documents)} chunks")
+    if not documents:
+      return {"status": "empty"}
+    report(0.6, "indexing")
+    stats = cf.sync_document(collection, documents, source_name, file_hash,
+                             progress=lambda n: report(0.6, f"indexing, {n} chunks added"))
+    count = len(documents)
+  if not count:
+    return {"status": "empty"}
+  sq.add_document_sqlite(collection_name, source_name, file_hash, count)
+  return {"status": "reindexed" if existed else "indexed", **stats}
+
+def describe(result: dict) -> str:
+  """One-line summary of an ingest_file result for the job list."""
+  if result["status"] == "skipped":
+    return f"skipped, identical to '{result['duplicate_of']}'"
+  if result["status"] == "empty":
+    return "no text extracted"
+  return (f"{result['status']}: {result['added']} chunks added, "
+          f"{result['removed']} removed, {result['kept']} unchanged")
+
+def run_worker(poll_interval: float = 2.0):
+  """Claims and runs ingestion jobs until interrupted."""
+  from .indexing import Splitter
+  client = cf.connect_chroma()
+  splitter = Splitter()
+  worker = f"{socket.gethostname()}-{os.getpid()}"
+  while True:
+    job = sq.claim_job_sqlite(worker)
+    if job is None:
+      time.sleep(poll_interval)
+      continue
+    report = lambda fraction, message: sq.update_job_progress_sqlite(job["id"], fraction, message)
+    try:
+      result = ingest_file(client, splitter, job["collection"], job["file_path"],
+                           job["file_name"], progress=report)
+    except Exception as e:
+      if not sq.fail_job_sqlite(job["id"], f"{type(e).__name__}: {e}"):
+        discard_upload(job["file_path"])
+      continue
+    sq.complete_job_sqlite(job["id"], describe(result))
+    discard_upload(job["file_path"])
+
+def main():
+  parser = argparse.ArgumentParser(description="Runs the PDF ingestion workers.")
+  parser.add_argument("--workers", type=int, default=int(os.getenv("INGEST_WORKERS", "2")))
+  parser.add_argument("--poll-interval", type=float, default=2.0)
+  args = parser.parse_args()
+
+  context = multiprocessing.get_context("spawn")
+  processes = [context.Process(target=run_worker, args=(args.poll_interval,), daemon=True)
+               for _ in range(args.workers)]
+  for process in processes:
+    process.start()
+  try:
+    while True:
+      for i, process in enumerate(processes):
+        if not process.is_alive():
+          processes[i] = context.Process(target=run_worker, args=(args.poll_interval,),
+                                         daemon=True)
+          processes[i].start()
+      time.sleep(5)
+  except KeyboardInterrupt:
+    for process in processes:
+      process.terminate()
+
+if __name__ == "__main__":
+  main()
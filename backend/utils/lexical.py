@@ -0,0 +1,400 @@
+import fcntl
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", "lexical_index")
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./:][a-z0-9]+)*")
+SPLIT_RE = re.compile(r"[-_./:]")
+MAX_TF = np.iinfo(np.uint16).max
+
+def tokenize(text: str) -> list[str]:
+  """Lowercase tokens that keep codes like 'PN-514-E71' whole.
+  Compound tokens are also indexed by their parts, so 'E71' matches too.
+  """
+  tokens = []
+  for token in TOKEN_RE.findall(text.lower()):
+    tokens.append(token)
+    parts = SPLIT_RE.split(token)
+    if len(parts) > 1:
+      tokens.extend(p for p in parts if p)
+  return tokens
+
+class Postings():
+  """Documents tokenized for a BM25Index but not written to it yet, so that
+  a document streamed in batches is saved once. Terms are numbered locally
+  and mapped onto a segment's vocabulary when written."""
+  def __init__(self):
+    self.ids = []
+    self.vocabulary = {}
+    self.terms = [np.zeros(0, dtype=np.int32)]
+    self.docs = [np.zeros(0, dtype=np.int32)]
+    self.tfs = [np.zeros(0, dtype=np.uint16)]
+    self.lengths = [np.zeros(0, dtype=np.int32)]
+
+  def __len__(self) -> int:
+    return len(self.ids)
+
+  def add(self, ids: list[str], documents: list[str]):
+    """Tokenizes documents and keeps their postings."""
+    terms, docs, tfs, lengths = [], [], [], []
+    base = len(self.ids)
+    for position, document in enumerate(documents):
+      tokens = tokenize(document)
+      lengths.append(len(tokens))
+      counts = {}
+      for token in tokens:
+        counts[token] = counts.get(token, 0) + 1
+      for token, tf in counts.items():
+        terms.append(self.vocabulary.setdefault(token, len(self.vocabulary)))
+        docs.append(base + position)
+        tfs.append(min(tf, MAX_TF))
+    self.ids.extend(ids)
+    self.terms.append(np.asarray(terms, dtype=np.int32))
+    self.docs.append(np.asarray(docs, dtype=np.int32))
+    self.tfs.append(np.asarray(tfs, dtype=np.uint16))
+    self.lengths.append(np.asarray(lengths, dtype=np.int32))
+
+  def _extend(self, ids, tokens, terms, docs, tfs, lengths, keep):
+    """Appends postings numbered by another vocabulary, keeping only the
+    documents whose 'keep' flag is set."""
+    mapping = np.asarray([self.vocabulary.setdefault(t, len(self.vocabulary)) for t in tokens],
+                         dtype=np.int32)
+    alive = keep[docs]
+    position = np.cumsum(keep) - 1 + len(self.ids)
+    self.ids.extend(i for i, k in zip(ids, keep) if k)
+    self.terms.append(mapping[terms[alive]])
+    self.docs.append(position[docs[alive]].astype(np.int32))
+    self.tfs.append(np.asarray(tfs[alive], dtype=np.uint16))
+    self.lengths.append(np.asarray(lengths[keep], dtype=np.int32))
+
+  def add_segment(self, segment: "Segment", keep: np.ndarray = None):
+    """Appends the postings of a segment, or of its documents in 'keep'."""
+    keep = np.ones(len(segment), dtype=bool) if keep is None else keep
+    self._extend(segment.ids, segment.tokens(), segment.term_ids(),
+                 np.asarray(segment.docs), segment.tfs, segment.lengths, keep)
+
+  def subset(self, keep: np.ndarray) -> "Postings":
+    """The postings of the documents whose 'keep' flag is set."""
+    subset = Postings()
+    subset._extend(self.ids, list(self.vocabulary), np.concatenate(self.terms),
+                   np.concatenate(self.docs), np.concatenate(self.tfs),
+                   np.concatenate(self.lengths), keep)
+    return subset
+
+class Segment():
+  """Immutable part of a BM25Index: a directory of term-major (CSR) arrays,
+  memory-mapped on load so opening a large index costs almost no RAM:
+    offsets.npy   int64, postings of term t are [offsets[t], offsets[t+1])
+    docs.npy      int32, position in the segment of each posting's document
+    tfs.npy       uint16, term frequency of each posting
+    lengths.npy   int32, token count of each document
+    segment.json  chroma ids and vocabulary
+  """
+  def __init__(self, path: str):
+    self.path = path
+    self.name = os.path.basename(path)
+    with open(os.path.join(path, "segment.json")) as f:
+      meta = json.load(f)
+    self.ids = meta["ids"]
+    self.vocabulary = meta["vocabulary"]
+    load = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+    self.offsets = load("offsets")
+    self.docs = load("docs")
+    self.tfs = load("tfs")
+    self.lengths = load("lengths")
+    self.total_length = int(self.lengths.sum())
+    self._id_set = None
+
+  def __len__(self) -> int:
+    return len(self.ids)
+
+  def __contains__(self, chunk_id: str) -> bool:
+    if self._id_set is None:
+      self._id_set = set(self.ids)
+    return chunk_id in self._id_set
+
+  def tokens(self) -> list[str]:
+    """Vocabulary ordered by term id."""
+    tokens = [None] * len(self.vocabulary)
+    for token, t in self.vocabulary.items():
+      tokens[t] = token
+    return tokens
+
+  def term_ids(self) -> np.ndarray:
+    """Term id of every posting, expanded from the offsets."""
+    return np.repeat(np.arange(len(self.offsets) - 1, dtype=np.int32),
+                     np.diff(self.offsets))
+
+  def postings(self, term: str):
+    """(docs, tfs) of a term, None when the segment does not contain it."""
+    t = self.vocabulary.get(term)
+    if t is None:
+      return None
+    start, end = self.offsets[t], self.offsets[t + 1]
+    return self.docs[start:end], self.tfs[start:end]
+
+  @staticmethod
+  def write(path: str, postings: Postings) -> "Segment":
+    """Writes postings as a new segment directory."""
+    terms = np.concatenate(postings.terms)
+    order = np.argsort(terms, kind="stable")
+    offsets = np.zeros(len(postings.vocabulary) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(terms, minlength=len(postings.vocabulary)), out=offsets[1:])
+    os.makedirs(path)
+    for name, array in (("offsets", offsets),
+                        ("docs", np.concatenate(postings.docs)[order]),
+                        ("tfs", np.concatenate(postings.tfs)[order]),
+                        ("lengths", np.concatenate(postings.lengths))):
+      np.save(os.path.join(path, f"{name}.npy"), array)
+    with open(os.path.join(path, "segment.json"), "w") as f:
+      json.dump({"ids": postings.ids, "vocabulary": postings.vocabulary}, f)
+    return Segment(path)
+
+class BM25Index():
+  """BM25 inverted index for one collection, stored as a list of Segments.
+  manifest.json names the segments of the current generation and is
+  replaced atomically, so readers always see one consistent generation.
+  New documents are written as a new segment, merged with the previous one
+  while they are of similar size, so each write costs about the size of
+  what it adds rather than of the whole index.
+  """
+  k1 = 1.5
+  b = 0.75
+  MERGE_RATIO = 2  # a segment absorbs the next once it is at most this much larger
+  RELOAD_ATTEMPTS = 5  # a writer may delete old segments while they are being opened
+
+  def __init__(self, path: str):
+    self.path = path
+    self.version = None
+    self.generation = 0
+    self.segments = []
+    self.reload()
+
+  def _manifest_path(self) -> str:
+    return os.path.join(self.path, "manifest.json")
+
+  def exists(self) -> bool:
+    return os.path.exists(self._manifest_path())
+
+  def __len__(self) -> int:
+    return sum(len(s) for s in self.segments)
+
+  @property
+  def ids(self) -> list[str]:
+    return [i for s in self.segments for i in s.ids]
+
+  def reload(self):
+    """Loads the current generation if another writer changed it. Segments
+    already open are reused, since they never change."""
+    for attempt in range(self.RELOAD_ATTEMPTS):
+      try:
+        version = os.stat(self._manifest_path()).st_mtime_ns
+      except FileNotFoundError:
+        self.version, self.generation, self.segments = None, 0, []
+        return
+      if version == self.version:
+        return
+      try:
+        with open(self._manifest_path()) as f:
+          manifest = json.load(f)
+        opened = {s.name: s for s in self.segments}
+        self.segments = [opened.get(name) or Segment(os.path.join(self.path, name))
+                         for name in manifest["segments"]]
+      except FileNotFoundError:
+        if attempt == self.RELOAD_ATTEMPTS - 1:
+          raise
+        continue
+      self.generation = manifest["generation"]
+      self.version = version
+      return
+
+  def _commit(self, segments: list[Segment]):
+    """Makes segments the next generation and deletes the unused ones."""
+    manifest = {"generation": self.generation + 1, "segments": [s.name for s in segments]}
+    tmp = self._manifest_path() + ".tmp"
+    with open(tmp, "w") as f:
+      json.dump(manifest, f)
+    os.replace(tmp, self._manifest_path())
+    keep = set(manifest["segments"])
+    for name in os.listdir(self.path):
+      if name.startswith("seg-") and name not in keep:
+        shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+    self.reload()
+
+  def _new_segment(self, postings: Postings, n: int = 0) -> Segment:
+    name = f"seg-{self.generation + 1:08d}-{n}"
+    return Segment.write(os.path.join(self.path, name), postings)
+
+  @contextmanager
+  def _write_lock(self):
+    """Serializes writers across processes. The lock file sits next to the
+    index directory, so that directory can be replaced as a whole."""
+    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+    with open(self.path + ".lock", "w") as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      try:
+        self.reload()
+        yield
+      finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+  def merge(self, postings: Postings) -> bool:
+    """Writes buffered postings as a new segment. Documents already indexed
+    are skipped. An index that does not exist yet is left alone, as it
+    must be built from the whole collection (see ensure_index); returns
+    whether the index exists."""
+    with self._write_lock():
+      if not self.exists():
+        return False
+      fresh = np.asarray([not any(i in s for s in self.segments) for i in postings.ids],
+                         dtype=bool)
+      if not fresh.any():
+        return True
+      segments = self.segments + [self._new_segment(postings.subset(fresh))]
+      n = 1
+      while (len(segments) > 1
+             and len(segments[-2]) <= self.MERGE_RATIO * len(segments[-1])):
+        merged = Postings()
+        merged.add_segment(segments[-2])
+        merged.add_segment(segments[-1])
+        segments[-2:] = [self._new_segment(merged, n)]
+        n += 1
+      self._commit(segments)
+      return True
+
+  def add(self, ids: list[str], documents: list[str]) -> bool:
+    """Appends documents to an existing index, see merge."""
+    postings = Postings()
+    postings.add(ids, documents)
+    return self.merge(postings)
+
+  def build(self, batches) -> bool:
+    """Builds the index from (ids, documents) batches unless it already
+    exists, which is checked again once the writer lock is held. The index
+    is written to a temporary directory renamed into place, so readers
+    never see it half-built. Returns whether it was built here."""
+    with self._write_lock():
+      if self.exists():
+        return False
+      postings = Postings()
+      for ids, documents in batches:
+        postings.add(ids, documents)
+      parent = os.path.dirname(self.path) or "."
+      tmp = tempfile.mkdtemp(prefix=f".{os.path.basename(self.path)}.", dir=parent)
+      try:
+        built = BM25Index(tmp)
+        built._commit([built._new_segment(postings)])
+        if os.path.isdir(self.path):
+          shutil.rmtree(self.path)
+        os.rename(tmp, self.path)
+      except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+      self.version = None
+      self.reload()
+      return True
+
+  def remove(self, ids: list[str]):
+    """Drops documents from the index, rewriting only the segments holding them."""
+    with self._write_lock():
+      removed = set(ids)
+      segments, changed = [], False
+      for segment in self.segments:
+        keep = np.asarray([i not in removed for i in segment.ids], dtype=bool)
+        if keep.all():
+          segments.append(segment)
+          continue
+        changed = True
+        if keep.any():
+          postings = Postings()
+          postings.add_segment(segment, keep)
+          segments.append(self._new_segment(postings, len(segments)))
+      if changed:
+        self._commit(segments)
+
+  def search(self, query: str, n: int) -> list[tuple[str, float]]:
+    """Returns up to n (id, score) pairs with the best BM25 score."""
+    self.reload()
+    segments = self.segments
+    n_docs = sum(len(s) for s in segments)
+    if n_docs == 0:
+      return []
+    average = sum(s.total_length for s in segments) / n_docs or 1.0
+    found = {}
+    for term in set(tokenize(query)):
+      postings = [(i, p) for i, p in enumerate(s.postings(term) for s in segments) if p is not None]
+      if postings:
+        found[term] = postings
+    hits = []
+    for i, segment in enumerate(segments):
+      scores = np.zeros(len(segment), dtype=np.float32)
+      for term, postings in found.items():
+        df = sum(len(docs) for _, (docs, _) in postings)
+        idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        for j, (docs, tfs) in postings:
+          if j != i:
+            continue
+          tf = tfs.astype(np.float32)
+          norm = self.k1 * (1 - self.b + self.b * segment.lengths[docs] / average)
+          scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm)
+      best = np.flatnonzero(scores)
+      if len(best) > n:
+        best = np.sort(best[np.argpartition(-scores[best], n - 1)[:n]])
+      best = best[np.argsort(-scores[best], kind="stable")]
+      hits.extend((float(scores[d]), segment.ids[d]) for d in best)
+    hits.sort(key=lambda hit: -hit[0])
+    return [(chunk_id, score) for score, chunk_id in hits[:n]]
+
+_indexes = {}
+_lock = threading.Lock()
+
+def get_index(collection_name: str) -> BM25Index:
+  """Returns the (cached) lexical index of a collection."""
+  with _lock:
+    if collection_name not in _indexes:
+      _indexes[collection_name] = BM25Index(os.path.join(INDEX_DIR, collection_name))
+    return _indexes[collection_name]
+
+def add_to_index(collection, ids: list[str], documents: list[str]):
+  """Indexes documents that were just added to a Chroma collection. A
+  collection without an index yet gets one built from all its chunks."""
+  ensure_index(collection).add(ids, documents)
+
+def merge_into_index(collection, postings: Postings):
+  """Indexes documents buffered while they were added to a Chroma
+  collection, building the whole index first if there is none yet."""
+  ensure_index(collection).merge(postings)
+
+def remove_from_index(collection_name: str, ids: list[str]):
+  """Removes documents that were deleted from a Chroma collection."""
+  index = get_index(collection_name)
+  if index.exists():
+    index.remove(ids)
+
+def delete_index(collection_name: str):
+  """Deletes the lexical index of a collection from disk."""
+  with _lock:
+    _indexes.pop(collection_name, None)
+  path = os.path.join(INDEX_DIR, collection_name)
+  if os.path.isdir(path):
+    shutil.rmtree(path)
+  if os.path.exists(path + ".lock"):
+    os.remove(path + ".lock")
+
+def ensure_index(collection, batch_size: int = 1000) -> BM25Index:
+  """Builds the index from Chroma for collections created before it existed."""
+  index = get_index(collection.name)
+  if not index.exists():
+    def batches():
+      for offset in range(0, collection.count(), batch_size):
+        batch = collection.get(include=["documents"], limit=batch_size, offset=offset)
+        yield batch["ids"], batch["documents"]
+    index.build(batches())
+  return index
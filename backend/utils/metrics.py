@@ -0,0 +1,79 @@
+import functools
+import inspect
+import threading
+import time
+from collections import Counter, deque
+
+WINDOW = 200  # observations kept per series
+
+_counters = Counter()
+_observations = {}
+_lock = threading.Lock()
+
+def _key(name: str, labels: dict) -> tuple:
+  return (name,) + tuple(sorted(labels.items()))
+
+def increment(name: str, amount: float = 1, **labels):
+  """Adds to a process-wide counter, e.g. increment('cascade_skipped', collection='manuals')."""
+  with _lock:
+    _counters[_key(name, labels)] += amount
+
+def get(name: str, **labels) -> float:
+  """Current value of a counter, 0 if it was never incremented."""
+  with _lock:
+    return _counters.get(_key(name, labels), 0)
+
+def ratio(numerator: str, denominator: str, **labels) -> float:
+  """numerator / denominator for the same labels, 0 before any event."""
+  with _lock:
+    total = _counters.get(_key(denominator, labels), 0)
+    return _counters.get(_key(numerator, labels), 0) / total if total else 0.0
+
+def observe(name: str, value: float, **labels):
+  """Records a measurement, e.g. a latency, keeping the last WINDOW ones."""
+  with _lock:
+    series = _observations.setdefault(_key(name, labels), deque(maxlen=WINDOW))
+    series.append((time.monotonic(), value))
+
+def quantile(name: str, q: float, max_age: float = None, min_count: int = 1, **labels):
+  """q-quantile (0-1) of the recent measurements, None without enough of them.
+  Measurements older than max_age seconds are ignored.
+  """
+  oldest = time.monotonic() - max_age if max_age else float("-inf")
+  with _lock:
+    values = sorted(v for t, v in _observations.get(_key(name, labels), ()) if t >= oldest)
+  if len(values) < max(min_count, 1):
+    return None
+  return values[min(len(values) - 1, int(q * len(values)))]
+
+def timed(method):
+  """Observes the duration of each call as 'latency_seconds', labelled with
+  the method name and, when it has one, its 'collection_name' argument."""
+  signature = inspect.signature(method)
+  @functools.wraps(method)
+  def wrapper(*args, **kwargs):
+    bound = signature.bind(*args, **kwargs)
+    labels = {"strategy": method.__name__}
+    if "collection_name" in bound.arguments:
+      labels["collection"] = bound.arguments["collection_name"]
+    start = time.perf_counter()
+    result = method(*args, **kwargs)
+    observe("latency_seconds", time.perf_counter() - start, **labels)
+    return result
+  return wrapper
+
+def snapshot() -> dict:
+  """Every counter as {'name{label=value,...}': value}."""
+  with _lock:
+    items = list(_counters.items())
+  result = {}
+  for (name, *labels), value in sorted(items, key=lambda item: str(item[0])):
+    suffix = ",".join(f"{k}={v}" for k, v in labels)
+    result[f"{name}{{{suffix}}}" if suffix else name] = value
+  return result
+
+def reset():
+  """Clears every counter and measurement."""
+  with _lock:
+    _counters.clear()
+    _observations.clear()
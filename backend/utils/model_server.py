@@ -0,0 +1,254 @@
+"""Shared embedding and reranking models.
+One process per node loads the MiniLM embedder and the BGE reranker and
+serves them over HTTP; the frontend, the agent and the ingestion workers
+call it instead of each holding their own copies. Requests from concurrent
+callers are merged into batches on the server, so the models run on full
+batches even when every caller sends one query.
+
+Run with:
+  python -m backend.utils.model_server --host 127.0.0.1 --port 8100
+and point the clients at it with MODEL_SERVER_URL=http://127.0.0.1:8100.
+Without MODEL_SERVER_URL the models are loaded in-process, as before.
+"""
+import argparse
+import base64
+import json
+import os
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+from . import metrics
+
+MODEL_SERVER_URL = os.getenv("MODEL_SERVER_URL", "").rstrip("/")
+MODEL_SERVER_TIMEOUT = float(os.getenv("MODEL_SERVER_TIMEOUT", "60"))
+EMBED_MODEL = "all-MiniLM-L6-v2"  # Chroma's default model
+RERANK_MODEL = "BAAI/bge-reranker-base"
+MAX_BATCH = int(os.getenv("MODEL_MAX_BATCH", "64"))
+MAX_WAIT_MS = float(os.getenv("MODEL_MAX_WAIT_MS", "5"))
+CONNECT_RETRIES = 30  # the server may still be loading the models
+
+class _Request():
+  def __init__(self, items: list):
+    self.items = items
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+class DynamicBatcher():
+  """Runs a batch function over the items of concurrent callers together.
+  The first waiting request opens a batch, which then takes further
+  requests until it holds max_batch items or max_wait seconds have passed.
+  Args:
+    function: Takes a list of items and returns one output per item.
+    max_batch (int): Items after which a batch is closed.
+    max_wait (float): Seconds a batch waits for more requests.
+    name (str): Label of the 'model_batches' and 'model_batch_items' metrics.
+  """
+  def __init__(self, function, max_batch: int, max_wait: float, name: str):
+    self.function = function
+    self.max_batch = max_batch
+    self.max_wait = max_wait
+    self.name = name
+    self.queue = queue.Queue()
+    threading.Thread(target=self._loop, name=f"batcher-{name}", daemon=True).start()
+
+  def submit(self, items: list) -> list:
+    """Outputs for items, computed in a shared batch."""
+    if not items:
+      return []
+    request = _Request(items)
+    self.queue.put(request)
+    request.done.wait()
+    if request.error is not None:
+      raise request.error
+    return request.result
+
+  def _loop(self):
+    while True:
+      batch = [self.queue.get()]
+      size = len(batch[0].items)
+      deadline = time.monotonic() + self.max_wait
+      while size < self.max_batch:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+          break
+        try:
+          request = self.queue.get(timeout=timeout)
+        except queue.Empty:
+          break
+        batch.append(request)
+        size += len(request.items)
+      self._run(batch, size)
+
+  def _run(self, batch: list, size: int):
+    metrics.increment("model_batches", model=self.name)
+    metrics.increment("model_batch_items", size, model=self.name)
+    try:
+      outputs = self.function([item for request in batch for item in request.items])
+      start = 0
+      for request in batch:
+        request.result = outputs[start:start + len(request.items)]
+        start += len(request.items)
+    except Exception as e:
+      for request in batch:
+        request.error = e
+    for request in batch:
+      request.done.set()
+
+def load_batchers(max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS) -> dict:
+  """Loads both models and returns their batchers."""
+  from sentence_transformers import SentenceTransformer
+  from FlagEmbedding import FlagReranker
+  embedder = SentenceTransformer(EMBED_MODEL)
+  reranker = FlagReranker(RERANK_MODEL, use_fp16=True, normalize=True)
+
+  def embed(texts):
+    return embedder.encode(texts, batch_size=max_batch, normalize_embeddings=True,
+                           convert_to_numpy=True).astype(np.float32)
+
+  def rerank(pairs):
+    scores = reranker.compute_score(pairs)
+    return scores if isinstance(scores, list) else [scores]
+
+  return {"embed": DynamicBatcher(embed, max_batch, max_wait_ms / 1000, "embed"),
+          "rerank": DynamicBatcher(rerank, max_batch, max_wait_ms / 1000, "rerank")}
+
+def make_handler(batchers: dict):
+  class ModelHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, status: int, body: dict):
+      data = json.dumps(body).encode("utf-8")
+      self.send_response(status)
+      self.send_header("Content-Type", "application/json")
+      self.send_header("Content-Length", str(len(data)))
+      self.end_headers()
+      self.wfile.write(data)
+
+    def do_GET(self):
+      if self.path == "/health":
+        self._reply(200, {"status": "ok"})
+      elif self.path == "/metrics":
+        self._reply(200, metrics.snapshot())
+      else:
+        self._reply(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+      try:
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if self.path == "/embed":
+          vectors = np.asarray(batchers["embed"].submit(payload["texts"]), dtype="<f4")
+          self._reply(200, {"shape": list(vectors.shape),
+                            "data": base64.b64encode(vectors.tobytes()).decode("ascii")})
+        elif self.path == "/rerank":
+          scores = batchers["rerank"].submit([tuple(p) for p in payload["pairs"]])
+          self._reply(200, {"scores": [float(s) for s in scores]})
+        else:
+          self._reply(404, {"error": f"unknown path {self.path}"})
+      except Exception as e:
+        self._reply(500, {"error": str(e)})
+
+    def log_message(self, format, *args):
+      pass
+
+  return ModelHandler
+
+def _post(path: str, payload: dict) -> dict:
+  request = urllib.request.Request(MODEL_SERVER_URL + path,
+                                   data=json.dumps(payload).encode("utf-8"),
+                                   headers={"Content-Type": "application/json"})
+  for attempt in range(CONNECT_RETRIES):
+    try:
+      with urllib.request.urlopen(request, timeout=MODEL_SERVER_TIMEOUT) as response:
+        return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+      raise RuntimeError(f"Model server error: {e.read().decode('utf-8', 'replace')}") from e
+    except urllib.error.URLError:
+      if attempt == CONNECT_RETRIES - 1:
+        raise
+      time.sleep(1)
+
+class RemoteEmbedder(EmbeddingFunction):
+  """Embedder backed by the model server, usable where a SentenceTransformer
+  (encode) or a Chroma embedding function (called with a list) is expected.
+  It serves Chroma's default model, so it registers under Chroma's 'default'
+  name and collections stay readable by clients without the server."""
+  def __init__(self):
+    pass
+
+  @staticmethod
+  def name() -> str:
+    return "default"
+
+  @staticmethod
+  def build_from_config(config: dict) -> "RemoteEmbedder":
+    return RemoteEmbedder()
+
+  def get_config(self) -> dict:
+    return {}
+
+  def encode(self, texts, normalize_embeddings: bool = True, **kwargs) -> np.ndarray:
+    if isinstance(texts, str):
+      return self.encode([texts])[0]
+    if not texts:
+      return np.zeros((0, 0), dtype=np.float32)
+    reply = _post("/embed", {"texts": list(texts)})
+    return np.frombuffer(base64.b64decode(reply["data"]), dtype="<f4").reshape(reply["shape"])
+
+  def __call__(self, input) -> list:
+    return list(self.encode(list(input)))
+
+class RemoteReranker():
+  """Reranker backed by the model server, with FlagReranker's compute_score."""
+  def compute_score(self, pairs, **kwargs) -> list:
+    return _post("/rerank", {"pairs": [list(p) for p in pairs]})["scores"]
+
+def sentence_model():
+  """The sentence embedder: the shared server's when configured, else local."""
+  if MODEL_SERVER_URL:
+    return RemoteEmbedder()
+  from sentence_transformers import SentenceTransformer
+  return SentenceTransformer(EMBED_MODEL)
+
+def query_embedder():
+  """Embedding function for queries and sentences, compatible with Chroma's."""
+  if MODEL_SERVER_URL:
+    return RemoteEmbedder()
+  from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+  return DefaultEmbeddingFunction()
+
+def collection_embedder():
+  """Embedding function to open collections with, so that Chroma embeds
+  documents and query texts through the shared server; None keeps Chroma's
+  in-process default."""
+  return RemoteEmbedder() if MODEL_SERVER_URL else None
+
+def reranker():
+  """The cross-encoder reranker: the shared server's when configured, else local."""
+  if MODEL_SERVER_URL:
+    return RemoteReranker()
+  from FlagEmbedding import FlagReranker
+  return FlagReranker(RERANK_MODEL, use_fp16=True, normalize=True)
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                   formatter_class=argparse.RawDescriptionHelpFormatter,
+                                   epilog="\n".join(__doc__.splitlines()[1:]))
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8100)
+  parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+  parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+  args = parser.parse_args()
+
+  batchers = load_batchers(args.max_batch, args.max_wait_ms)
+  server = ThreadingHTTPServer((args.host, args.port), make_handler(batchers))
+  print(f"Serving {EMBED_MODEL} and {RERANK_MODEL} on {args.host}:{args.port}")
+  server.serve_forever()
+
+if __name__ == "__main__":
+  main()
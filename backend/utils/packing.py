@@ -0,0 +1,167 @@
+import re
+from functools import lru_cache
+from typing import Dict, List, Any, Optional
+
+MIN_OVERLAP = 10  # shorter repeats between neighbouring chunks are coincidence
+MAX_OVERLAP = 400
+RESULT_LISTS = ("ids", "content", "distances", "sources")
+
+class RegexEncoding():
+  """Word and punctuation count, used when no BPE tokenizer is available."""
+  name = "regex"
+  pattern = re.compile(r"\w+|[^\w\s]")
+
+  def encode(self, text: str) -> List[str]:
+    return self.pattern.findall(text)
+
+  def decode(self, tokens: List[str]) -> str:
+    return " ".join(tokens)
+
+@lru_cache(maxsize=8)
+def get_encoding(model: Optional[str] = None):
+  """Returns the tokenizer of a model, loaded once per model name.
+  OpenAI models use their tiktoken encoding and Hugging Face models their
+  cached tokenizer; other models (e.g. served by Ollama) are counted with
+  cl100k_base, which is close enough for budgeting. Without any of them
+  (e.g. encodings that cannot be downloaded) words and punctuation are counted.
+  """
+  try:
+    import tiktoken
+  except ImportError:
+    tiktoken = None
+  if tiktoken is not None and model:
+    try:
+      return tiktoken.encoding_for_model(model)
+    except Exception:
+      pass
+  if model and "/" in model:
+    try:
+      from transformers import AutoTokenizer
+      return AutoTokenizer.from_pretrained(model, local_files_only=True)
+    except Exception:
+      pass
+  if tiktoken is not None:
+    try:
+      return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+      pass
+  return RegexEncoding()
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+  """Number of tokens of a text for the given model."""
+  return len(get_encoding(model).encode(text))
+
+def truncate_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+  """Cuts a text down to its first max_tokens tokens."""
+  encoding = get_encoding(model)
+  tokens = encoding.encode(text)
+  if len(tokens) <= max_tokens:
+    return text
+  return encoding.decode(tokens[:max_tokens])
+
+def trim_overlap(previous: str, text: str) -> str:
+  """Removes from text the prefix it repeats from the end of previous.
+  Fixed-size chunks are cut with an overlap, so neighbouring chunks of a
+  window share a few sentences that would otherwise be sent twice.
+  """
+  longest = min(len(previous), len(text), MAX_OVERLAP)
+  for size in range(longest, MIN_OVERLAP - 1, -1):
+    if previous.endswith(text[:size]):
+      return text[size:].lstrip()
+  return text
+
+def dedupe_spans(result: Dict[str, Any],
+                 spans: Optional[List[List[int]]] = None) -> List[List[int]]:
+  """Drops repeated chunks from the spans of a result and trims each chunk's
+  overlap with the previous one of its span, in result['content'].
+  Returns the spans left, one span per chunk when spans is omitted.
+  """
+  ids, content = result["ids"], list(result["content"])
+  if spans is None:
+    spans = [[i] for i in range(len(ids))]
+  first, unique_spans = {}, []
+  for span in spans:
+    kept = []
+    for i in span:
+      if ids[i] in first:
+        continue
+      first[ids[i]] = i
+      if kept:
+        content[i] = trim_overlap(content[kept[-1]], content[i])
+      kept.append(i)
+    if kept:
+      unique_spans.append(kept)
+  result["content"] = content
+  return unique_spans
+
+def pack_result(result: Dict[str, Any],
+                max_tokens: int,
+                model: Optional[str] = None,
+                spans: Optional[List[List[int]]] = None,
+                higher_is_better: bool = True) -> Dict[str, Any]:
+  """Fits a retrieval result into a token budget.
+  Repeated chunks are dropped, and chunks of the same window ('spans', lists
+  of positions in the result) are deduplicated against their neighbours and
+  kept or dropped as a unit. Spans are taken best score first until the
+  budget is spent; the kept chunks stay in their original order. The result
+  gets a 'tokens' entry with the budget and the tokens returned and dropped.
+  Args:
+    result (dict): Output of a Retriever strategy.
+    max_tokens (int): Token budget for 'content', 0 or None for no limit.
+    model (str): Model whose tokenizer counts the tokens.
+    spans (list[list[int]]): Windows of adjacent chunks, one span per chunk
+      when omitted.
+    higher_is_better (bool): Whether 'distances' holds scores or distances.
+  Returns:
+    dict: The same result, with the lists filtered and 'tokens' added.
+  """
+  ids = result["ids"]
+  total = sum(count_tokens(c, model) for c in result["content"])
+  scores = result.get("distances") or [None] * len(ids)
+  unique_spans = dedupe_spans(result, spans)
+  content = result["content"]
+
+  # Repeated chunks (e.g. from several query variations) keep their best score
+  best = {}
+  for i, id_ in enumerate(ids):
+    if scores[i] is None:
+      continue
+    if id_ not in best or (scores[i] > best[id_]) == higher_is_better:
+      best[id_] = scores[i]
+  def span_rank(span):
+    values = [best[ids[i]] for i in span if ids[i] in best]
+    if not values:
+      return (1, 0)
+    value = max(values) if higher_is_better else min(values)
+    return (0, -value if higher_is_better else value)
+
+  sizes = {i: count_tokens(content[i], model) for span in unique_spans for i in span}
+  selected = set()
+  used = 0
+  for span in sorted(unique_spans, key=span_rank):
+    cost = sum(sizes[i] for i in span)
+    if not max_tokens or used + cost <= max_tokens:
+      selected.update(span)
+      used += cost
+    elif not selected:
+      # Not even the best span fits: return as much of it as the budget allows
+      for i in span:
+        if used >= max_tokens:
+          break
+        content[i] = truncate_tokens(content[i], max_tokens - used, model)
+        sizes[i] = count_tokens(content[i], model)
+        selected.add(i)
+        used += sizes[i]
+
+  order = sorted(selected)
+  result["content"] = content
+  for key in RESULT_LISTS:
+    if isinstance(result.get(key), list) and len(result[key]) == len(ids):
+      result[key] = [result[key][i] for i in order]
+  result["tokens"] = {
+    "budget": max_tokens or None,
+    "returned": used,
+    "dropped": total - used,
+    "tokenizer": getattr(get_encoding(model), "name", type(get_encoding(model)).__name__),
+  }
+  return result
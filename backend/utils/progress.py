@@ -0,0 +1,32 @@
+import contextlib
+import contextvars
+
+PREVIEW_CHARS = 200
+
+_listener = contextvars.ContextVar("retrieval_progress", default=None)
+
+def report(stage: str, **details):
+  """Tells the current listener, if any, that a retrieval stage finished.
+  details must be JSON-serializable; without a listener this does nothing.
+  """
+  listener = _listener.get()
+  if listener is not None:
+    listener(stage, details)
+
+def current_listener():
+  """The callback stages are reported to in this context, None without one."""
+  return _listener.get()
+
+@contextlib.contextmanager
+def listening(callback):
+  """Sends the stages reported in this context (and the threads and tasks it
+  starts) to callback(stage, details)."""
+  token = _listener.set(callback)
+  try:
+    yield
+  finally:
+    _listener.reset(token)
+
+def preview(documents: list, n: int = 3) -> list:
+  """Beginning of the first documents, to show early results cheaply."""
+  return [d[:PREVIEW_CHARS] for d in documents[:n]]
@@ -1,38 +1,222 @@
 import os
+import re
 import time
-from typing import Dict, List, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional
 from pathlib import Path
-from .sqlite_functions import get_config_sqlite
+from .sqlite_functions import (get_config_sqlite, list_collections_sqlite,
+                               get_search_params_sqlite)
+from . import lexical
+from . import metrics
+from . import progress
+from .coalescing import coalesced
+from .admission import BoundedPool, Saturated
+from .packing import dedupe_spans, pack_result
+from .compression import compress_result
+from .sharding import ShardedClient
+from .model_server import query_embedder, reranker
+import numpy as np
 import chromadb
-from FlagEmbedding import FlagReranker
 from langchain_core.messages import SystemMessage, HumanMessage
 from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
 
 load_dotenv(dotenv_path=Path(__file__).parent / '.env')
 
+RRF_K = 60  # Reciprocal Rank Fusion constant
+FILTERED_LEXICAL_FACTOR = 4  # Deeper BM25 search when hits may be filtered out
+FEDERATED_WORKERS = int(os.getenv("FEDERATED_WORKERS", "16"))
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", "1"))
+RERANK_QUEUE_DEPTH = int(os.getenv("RERANK_QUEUE_DEPTH", "4"))
+RERANK_DEADLINE = float(os.getenv("RERANK_DEADLINE_MS", "2000")) / 1000 or None
+# Strategies the adaptive tool chooses from, with a latency prior (ms) used
+# until enough live measurements exist. The first one within budget is taken,
+# so they are ordered by cost (richest first): a step after a cheaper one
+# would never be reached. top_k_reranker reranks 20 candidates and
+# hybrid_reranker 8, already lifted by the keyword ranking, so it is cheaper.
+ADAPTIVE_LADDER = [
+  ("multi_query_reranker", {"n_results": 5, "n_queries": 3}, 3000),
+  ("top_k_reranker", {"high_k": 20}, 1200),
+  ("hybrid_reranker", {"high_k": 8}, 900),
+  ("top_k_cascade", {"k": 5, "high_k": 20}, 500),
+  ("hybrid", {"k": 5, "n_candidates": 20}, 150),
+  ("top_k", {"k": 5}, 80),
+]
+LATENCY_QUANTILE = 0.9
+LATENCY_MAX_AGE = 300  # seconds; older measurements are forgotten so slow
+                       # strategies get retried once the peak is over
+LATENCY_MIN_SAMPLES = 3
+CODE_RE = re.compile(r"\b(?=[A-Za-z0-9-]*\d)(?=[A-Za-z0-9-]*[A-Za-z])[A-Za-z0-9]+(?:-[A-Za-z0-9]+)*\b")
+# Per-collection overrides live in the collection's search_params
+CASCADE_DEFAULTS = {
+  "cascade_margin": 0.1,  # top-1 similarity lead that skips the reranker
+  "cascade_band": 0.15,   # candidates this close to the top-1 get reranked
+}
+
 OPENAI_URL = get_config_sqlite('openai_baseurl')
 OPENAI_KEY = get_config_sqlite('openai_api_key')
 CHROMA_URL = str(os.getenv("CHROMA_HOST"))
 CHROMA_PORT = int(os.getenv("CHROMA_PORT"))
 MODEL = get_config_sqlite('model')
+try:
+  CONTEXT_TOKENS = int(get_config_sqlite('context_token_budget') or 0)
+except ValueError:
+  CONTEXT_TOKENS = 0
+try:
+  LATENCY_BUDGET_MS = int(get_config_sqlite('latency_budget_ms') or 0)
+except ValueError:
+  LATENCY_BUDGET_MS = 1500
+try:
+  COMPRESSION_THRESHOLD = float(get_config_sqlite('compression_threshold') or 0)
+except ValueError:
+  COMPRESSION_THRESHOLD = 0.0
 
-print(CHROMA_URL,CHROMA_PORT)
-client = chromadb.HttpClient(host=CHROMA_URL,port=CHROMA_PORT)
+client = None
+embedder = None
+fanout_pool = None
+rerank_pool = None
 
 llm = ChatOpenAI(base_url=OPENAI_URL,MODEL=MODEL,api_key=OPENAI_KEY)
 
+def get_client():
+  """Returns the shared ChromaDB client, connecting on first use."""
+  global client
+  if client is None:
+    client = ShardedClient(chromadb.HttpClient(host=CHROMA_URL,port=CHROMA_PORT))
+  return client
+
+def get_llm():
+  """Returns the shared chat model used to rewrite queries."""
+  return llm
+
+def get_embedder():
+  """Returns the embedding function Chroma uses for the collections."""
+  global embedder
+  if embedder is None:
+    embedder = query_embedder()
+  return embedder
+
+def get_fanout_pool() -> ThreadPoolExecutor:
+  """Returns the shared thread pool used to query collections concurrently."""
+  global fanout_pool
+  if fanout_pool is None:
+    fanout_pool = ThreadPoolExecutor(max_workers=FEDERATED_WORKERS,
+                                     thread_name_prefix="federated")
+  return fanout_pool
+
+def get_rerank_pool() -> BoundedPool:
+  """Returns the shared pool that bounds concurrent reranker calls."""
+  global rerank_pool
+  if rerank_pool is None:
+    rerank_pool = BoundedPool(RERANK_WORKERS, RERANK_QUEUE_DEPTH, name="reranker")
+  return rerank_pool
+
+def distance_to_similarity(distance: float, space: str) -> float:
+  """Maps a Chroma distance to a similarity comparable across collections."""
+  if space == "l2":
+    # squared L2 between unit vectors is 2 - 2*cos
+    return 1 - distance / 2
+  return 1 - distance  # cosine and inner product
+
+def mmr_select(query_embedding,
+               embeddings,
+               k: int,
+               lambda_mult: float = 0.5) -> List[int]:
+  """Maximal Marginal Relevance selection over candidate embeddings.
+  The query relevance and the candidate-to-candidate similarity matrix are
+  computed once; each step only updates every candidate's highest similarity
+  to the selected set.
+  Args:
+    query_embedding: Embedding of the query.
+    embeddings: Embeddings of the candidates, one row each.
+    k (int): Number of candidates to select.
+    lambda_mult (float): 1 ranks by relevance only, 0 by diversity only.
+  Returns:
+    list[int]: Positions of the selected candidates, in selection order.
+  """
+  vectors = np.asarray(embeddings, dtype=np.float32)
+  if len(vectors) == 0 or k <= 0:
+    return []
+  vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+  query = np.asarray(query_embedding, dtype=np.float32)
+  query = query / max(float(np.linalg.norm(query)), 1e-12)
+  relevance = vectors @ query
+  similarity = vectors @ vectors.T
+
+  first = int(np.argmax(relevance))
+  selected = [first]
+  redundancy = similarity[first].copy()
+  scores = np.empty_like(relevance)
+  available = np.ones(len(vectors), dtype=bool)
+  available[first] = False
+  for _ in range(min(k, len(vectors)) - 1):
+    np.multiply(relevance, lambda_mult, out=scores)
+    scores -= (1 - lambda_mult) * redundancy
+    scores[~available] = -np.inf
+    chosen = int(np.argmax(scores))
+    selected.append(chosen)
+    available[chosen] = False
+    np.maximum(redundancy, similarity[chosen], out=redundancy)
+  return selected
+
+def query_features(query: str) -> dict:
+  """Features of a query that change which strategy suits it best."""
+  return {"words": len(query.split()),
+          "codes": CODE_RE.findall(query)}
+
+def adjacent_runs(keys: list) -> List[List[int]]:
+  """Groups positions of sorted (source, ordinal) keys into runs of neighbours."""
+  runs = []
+  for position, (source, ordinal) in enumerate(keys):
+    if runs and keys[position - 1] == (source, ordinal - 1):
+      runs[-1].append(position)
+    else:
+      runs.append([position])
+  return runs
+
 class Retriever():
-  """Class that has the rertieval functions"""
-  def __init__(self):
+  """Class that has the rertieval functions.
+  Args:
+    client: ChromaDB client to query, defaults to the shared HTTP client.
+    llm: Chat model used to rewrite queries, defaults to the configured one.
+    max_tokens: Token budget of the returned content, defaults to the
+      'context_token_budget' config; 0 returns everything.
+    compress_threshold: Minimum query similarity of the sentences kept from
+      each chunk, defaults to the 'compression_threshold' config; 0 keeps
+      the chunks whole.
+    compress_neighbors: Sentences kept around each relevant one.
+  """
+  def __init__(self, client=None, llm=None, max_tokens=None,
+               compress_threshold=None, compress_neighbors=1):
     self.re_ranker = None
+    self.client = client if client is not None else get_client()
+    self.llm = llm if llm is not None else get_llm()
+    self.max_tokens = CONTEXT_TOKENS if max_tokens is None else max_tokens
+    self.compress_threshold = (COMPRESSION_THRESHOLD if compress_threshold is None
+                               else compress_threshold)
+    self.compress_neighbors = compress_neighbors
+
+  def pack(self,
+            result: Dict[str, Any],
+            higher_is_better: bool = True,
+            spans: Optional[List[List[int]]] = None) -> Dict[str, Any]:
+    """Drops repeated chunks and the overlap between neighbouring ones,
+    compresses what is left to its relevant sentences, then fits it into the
+    token budget, counting with the model's tokenizer. Every strategy, and
+    callers assembling results of their own, finish a result with it."""
+    spans = dedupe_spans(result, spans)
+    if self.compress_threshold:
+      result = compress_result(result, get_embedder(),
+                               self.compress_threshold, self.compress_neighbors)
+    result = pack_result(result, self.max_tokens, MODEL, spans, higher_is_better)
+    progress.report("retrieved", chunks=len(result['ids']),
+                    tokens=result.get('tokens', {}).get('returned'))
+    return result
 
   def get_reranker(self):
     """gets the reranker"""
     if self.re_ranker is None:
-      self.re_ranker = FlagReranker('BAAI/bge-reranker-base',
-                              use_fp16=True,
-                              normalize=True)
+      self.re_ranker = reranker()
     return self.re_ranker
 
   def rerank_documents(self,
@@ -40,81 +224,159 @@ class Retriever():
                       documents: List[str],
                       top_r: int =None) -> tuple[List[str], List[float]]:
     """Helper function to rerank documents using the reranker model."""
+    indices, scores = self.rerank_indices(query, documents, top_r)
+    return [documents[i] for i in indices], scores
+
+  def rerank_indices(self,
+                     query: str,
+                     documents: List[str],
+                     top_r: int =None) -> tuple[List[int], List[float]]:
+    """Returns the positions of documents sorted by reranker score.
+    Scoring runs in the bounded reranker pool; raises Saturated when the pool
+    cannot take it or it would not finish within RERANK_DEADLINE_MS.
+    """
     tuples = [[query, d] for d in documents]
-    scores = self.re_ranker.compute_score(tuples)
+    scores = get_rerank_pool().run(self.get_reranker().compute_score, tuples,
+                                   deadline=RERANK_DEADLINE)
+    if not isinstance(scores, list):
+      scores = [scores]
+    indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
     if top_r:
-      indices = sorted(range(len(scores)),
-                      key=lambda i: scores[i],
-                      reverse=True)[:top_r]
-      return [documents[i] for i in indices], [scores[i] for i in indices]
-    else:
-      indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
-      return [documents[i] for i in indices], [scores[i] for i in indices]
+      indices = indices[:top_r]
+    return indices, [scores[i] for i in indices]
+
+  def _rerank_or_keep(self,
+                      query: str,
+                      documents: List[str],
+                      strategy: str,
+                      fallback_scores: Optional[List[float]] = None,
+                      top_r: int = None) -> tuple[List[int], List[float], bool]:
+    """Reranks documents, or keeps their current order under overload.
+    When the reranker pool is saturated the documents are returned as they
+    are, with fallback_scores, and the degradation is counted in the
+    'rerank_degraded' metric. The last value tells if that happened.
+    The candidates are reported as early results before reranking starts.
+    """
+    progress.report("candidates", strategy=strategy, count=len(documents),
+                    preview=progress.preview(documents))
+    try:
+      indices, scores = self.rerank_indices(query, documents, top_r)
+      progress.report("reranked", strategy=strategy, count=len(indices), degraded=False)
+      return indices, scores, False
+    except Saturated:
+      metrics.increment("rerank_degraded", strategy=strategy)
+      n = len(documents) if not top_r else min(top_r, len(documents))
+      scores = list(fallback_scores)[:n] if fallback_scores is not None else [None] * n
+      progress.report("reranked", strategy=strategy, count=n, degraded=True)
+      return list(range(n)), scores, True
+
+  def _neighbors(self,
+                 collection,
+                 ids: List[str],
+                 metadatas: List[dict],
+                 n_around: int,
+                 where: Optional[Dict[str, Any]] = None,
+                 where_document: Optional[Dict[str, Any]] = None) -> tuple[List[str], List[str], List[List[int]]]:
+    """Fetches the chunks stored around each hit, in document order.
+    Windows are selected by the 'source'/'ordinal' metadata in one request,
+    so they never cross into another document; collections indexed before
+    ordinals existed fall back to the insertion order of the whole collection.
+    Neighbours must also match the query's where/where_document filters.
+    Also returns the runs of adjacent chunks, as lists of positions.
+    """
+    if not ids:
+      return [], [], []
+    if any(not m or 'ordinal' not in m for m in metadatas):
+      all_ids = collection.get(where=where, where_document=where_document, include=[])['ids']
+      position = {id_: p for p, id_ in enumerate(all_ids)}
+      selected = set()
+      for i in ids:
+        index = position[i]
+        selected.update(all_ids[max(index-n_around,0):index+n_around+1])
+      ordered = sorted(selected, key=position.get)
+      fetched = collection.get(ids=ordered, include=['documents'])
+      doc_map = dict(zip(fetched['ids'], fetched['documents']))
+      return (ordered, [doc_map[i] for i in ordered],
+              adjacent_runs([(None, position[i]) for i in ordered]))
+
+    windows = [{'$and': [{'source': m['source']},
+                         {'ordinal': {'$gte': m['ordinal'] - n_around}},
+                         {'ordinal': {'$lte': m['ordinal'] + n_around}}]}
+               for m in metadatas]
+    windows_where = windows[0] if len(windows) == 1 else {'$or': windows}
+    if where:
+      windows_where = {'$and': [where, windows_where]}
+    fetched = collection.get(where=windows_where, where_document=where_document,
+                             include=['documents', 'metadatas'])
+    keys = [(m['source'], m['ordinal']) for m in fetched['metadatas']]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    return ([fetched['ids'][i] for i in order],
+            [fetched['documents'][i] for i in order],
+            adjacent_runs([keys[i] for i in order]))
 
+  @coalesced
+  @metrics.timed
   def sentence_window_retrieval(self,
                                 query: str,
                                 collection_name: str,
                                 n_main: int = 1,
-                                n_around: int = 3) -> Dict[str, Any]:
-    f"""
+                                n_around: int = 3,
+                                where: Optional[Dict[str, Any]] = None,
+                                where_document: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
     Implements the SWR (Sentence Window Retrieval) strategy.
     This function finds the most relevant document and also retrieves the
     documents that were physically stored next to it (before and after),
     assuming they might contain relevant context.
-    The collections avaliable {client.list_collections()} 
     Args:
       query (str): The user's query.
       collection_name (str): The name of an existing ChromaDB collection.
       n_main (int): The number of central documents to find.
       n_around (int): The number of neighboring documents to retrieve.
+      where (dict): Metadata filter, e.g. {"source": "manual.pdf"} or
+        {"page": {"$lte": 10}}; also applied to neighbouring chunks.
+      where_document (dict): Text filter, e.g. {"$contains": "E42"}.
     Returns:
-      Dict[str, Any]: A dictionary with 'collection', 'content', 'distances',
-        'parameters', and 'query'.
+      Dict[str, Any]: A dictionary with 'collection', 'ids', 'content',
+        'distances', 'parameters', and 'query'.
     """
     try:
-      collection = client.get_collection(name=collection_name)
+      collection = self.client.get_collection(name=collection_name)
     except Exception as e:
       raise ValueError(f"Collection '{collection_name}' not found: {e}")
 
-    ids = collection.get()['ids']
-    all_ids = set()
-    distances_map = {}
-
     results = collection.query(query_texts=query,
                                n_results=n_main,
-                               include=['distances'])
-    for i, dist in zip(results['ids'][0], results['distances'][0]):
-      index = ids.index(i)
-      indexes = ids[max(index-n_around,0):min(index+n_around+1,len(ids))]
-      for x in indexes:
-        all_ids.add(x)
-        if x == i:
-          distances_map[x] = dist
-
-    all_docs = collection.get(ids=list(all_ids))['documents']
-    doc_map = {id_: doc for id_, doc in zip(list(all_ids), all_docs)}
-
-    final_docs = []
-    distances_list = []
-    for x in sorted(all_ids, key=lambda x: ids.index(x)):
-      final_docs.append(doc_map[x])
-      distances_list.append(distances_map.get(x, None))
+                               where=where,
+                               where_document=where_document,
+                               include=['distances', 'metadatas'])
+    distances_map = dict(zip(results['ids'][0], results['distances'][0]))
+    final_ids, final_docs, spans = self._neighbors(collection,
+                                            results['ids'][0],
+                                            results['metadatas'][0],
+                                            n_around, where, where_document)
+    distances_list = [distances_map.get(x, None) for x in final_ids]
     result = {
       'query': query,
       'collection': collection_name,
+      'ids': final_ids,
       'content': final_docs,
       'distances': distances_list,
       'parameters': {'n_main': n_main,
                      'n_around': n_around},
       'time':time.time()
     }
-    return result
+    return self.pack(result, higher_is_better=False, spans=spans)
 
+  @coalesced
+  @metrics.timed
   def multi_query(self,
                   query: str,
                   collection_name: str,
                   n_results: int,
-                  n_queries: int = 5) -> Dict[str, Any]:
+                  n_queries: int = 5,
+                  where: Optional[Dict[str, Any]] = None,
+                  where_document: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     Generates multiple variations of a query using an LLM to broaden the search.
     This technique helps find documents that the original query might have missed,
@@ -124,12 +386,15 @@ class Retriever():
       collection_name (str): The name of an existing ChromaDB collection.
       n_results (int): The number of results per query variation.
       n_queries (int): The number of query variations to generate.
+      where (dict): Metadata filter, e.g. {"source": "manual.pdf"} or
+        {"page": {"$lte": 10}}.
+      where_document (dict): Text filter, e.g. {"$contains": "E42"}.
     Returns:
-      Dict[str, Any]: A dictionary with 'collection', 'content', 'distances',
-        'parameters', and 'query'.
+      Dict[str, Any]: A dictionary with 'collection', 'ids', 'content',
+        'distances', 'parameters', and 'query'.
     """
     try:
-      collection = client.get_collection(name=collection_name)
+      collection = self.client.get_collection(name=collection_name)
     except Exception as e:
       raise ValueError(f"Collection '{collection_name}' not found: {e}")
 
@@ -145,36 +410,46 @@ class Retriever():
       HumanMessage(content=f'The question is: {query}')
     ]
     try:
-      rewrite = eval(llm.invoke(messages).content)
+      rewrite = eval(self.llm.invoke(messages).content)
     except Exception as e:
       raise ValueError(f"Failed to parse LLM response: {e}")
+    progress.report("rewritten", queries=[str(q) for q in rewrite.values()])
 
+    final_ids = []
     final_docs = []
     distances_list = []
     for question in rewrite.keys():
       answer = collection.query(query_texts=[rewrite[question]],
                                 n_results=n_results,
+                                where=where,
+                                where_document=where_document,
                                 include=['documents', 'distances'])
       distances = answer.get('distances', [[]])[0]
       documents = answer.get('documents', [[]])[0]
+      final_ids.extend(answer.get('ids', [[]])[0])
       final_docs.extend(documents)
       distances_list.extend(distances)
     result = {
       'query': query,
       'collection': collection_name,
+      'ids': final_ids,
       'content': final_docs,
       'distances': distances_list,
       'parameters': {'n_queries': n_queries,
                      'n_results': n_results},
       'time':time.time()
     }
-    return result
+    return self.pack(result, higher_is_better=False)
 
 
+  @coalesced
+  @metrics.timed
   def top_k(self,
             query: str,
             collection_name: str,
-            k: int = 5) -> Dict[str, Any]:
+            k: int = 5,
+            where: Optional[Dict[str, Any]] = None,
+            where_document: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     Performs a simple vector search and returns the top 'k' most similar docs.
     This is the most basic form of Retrieval-Augmented Generation (RAG).
@@ -182,18 +457,23 @@ class Retriever():
       query (str): The user's query.
       collection_name (str): The name of an existing ChromaDB collection.
       k (int): The number of documents to return.
+      where (dict): Metadata filter, e.g. {"source": "manual.pdf"} or
+        {"page": {"$lte": 10}}.
+      where_document (dict): Text filter, e.g. {"$contains": "E42"}.
     Returns:
-      Dict[str, Any]: A dictionary with 'collection', 'content', 'distances',
-        'parameters', and 'query'.
+      Dict[str, Any]: A dictionary with 'collection', 'ids', 'content',
+        'distances', 'parameters', and 'query'.
     """
     try:
-      collection = client.get_collection(name=collection_name)
+      collection = self.client.get_collection(name=collection_name)
     except Exception as e:
       raise ValueError(f"Collection '{collection_name}' not found: {e}")
 
     results = collection.query(
       query_texts=query,
       n_results=k,
+      where=where,
+      where_document=where_document,
       include=["documents", "distances"]
     )
     content = results["documents"][0]
@@ -201,121 +481,159 @@ class Retriever():
     result = {
       'query': query,
       'collection': collection_name,
+      'ids': results["ids"][0],
       'content': content,
       'distances': distances,
       'parameters': {'k': k},
       'time':time.time()
     }
-    return result
+    return self.pack(result, higher_is_better=False)
 
 
+  @coalesced
+  @metrics.timed
   def top_k_reranker(self,
                      query: str,
                 collection_name: str,
-                high_k: int = 20) -> Dict[str, Any]:
+                high_k: int = 20,
+                where: Optional[Dict[str, Any]] = None,
+                where_document: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     Implements the 'retrieve-then-rerank' strategy.
     First, it retrieves a larger number of documents (high_k), and then uses a
     more accurate reranker MODEL to find the top 5 best matches among them.
+    When the reranker is overloaded it degrades to the top_k result.
     Args:
       query (str): The user's query.
       collection_name (str): The name of an existing ChromaDB collection.
       high_k (int): The initial number of documents to retrieve for reranking.
+      where (dict): Metadata filter, e.g. {"source": "manual.pdf"} or
+        {"page": {"$lte": 10}}.
+      where_document (dict): Text filter, e.g. {"$contains": "E42"}.
     Returns:
-      Dict[str, Any]: A dictionary with 'collection', 'content', 'distances',
-        'parameters', and 'query'.
+      Dict[str, Any]: A dictionary with 'collection', 'ids', 'content',
+        'distances', 'parameters', and 'query'.
     """
     try:
-      collection = client.get_collection(name=collection_name)
+      collection = self.client.get_collection(name=collection_name)
     except Exception as e:
       raise ValueError(f"Collection '{collection_name}' not found: {e}")
 
     results = collection.query(
       query_texts=query,
       n_results=high_k,
-      include=["documents"]
+      where=where,
+      where_document=where_document,
+      include=["documents", "distances"]
     )
     documents = results["documents"][0]
-    docs, scores = self.rerank_documents(query, documents)
+    indices, scores, degraded = self._rerank_or_keep(query, documents, "top_k_reranker",
+                                                     results["distances"][0])
     result = {
       'query': query,
       'collection': collection_name,
-      'content': docs,
-      'distances': scores,  # Actually scores from reranker
+      'ids': [results["ids"][0][i] for i in indices],
+      'content': [documents[i] for i in indices],
+      'distances': scores,  # Actually scores from reranker, unless degraded
       'parameters': {'high_k': high_k},
       'time':time.time()
     }
-    return result
+    if degraded:
+      result['degraded'] = 'top_k'
+    return self.pack(result, higher_is_better=not degraded)
 
 
+  @coalesced
+  @metrics.timed
   def sentence_window_retriever_reranker(self,
                                          query: str,
                                          collection_name: str,
                                          n_main: int = 3,
-                                         n_around: int = 4) -> Dict[str, Any]:
+                                         n_around: int = 4,
+                                         where: Optional[Dict[str, Any]] = None,
+                                         where_document: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     Implements the SWR (Sentence Window Retrieval) strategy, with ReRanker.
     This function finds the most relevant document and also retrieves the
     documents that were physically stored next to it (before and after),
     assuming they might contain relevant context. Its necessary to use higher
-    variables with ReRanker.
+    variables with ReRanker. When the reranker is overloaded it degrades to
+    the sentence_window_retrieval result.
     Args:
       query (str): The user's query.
       collection_name (str): The name of an existing ChromaDB collection.
       n_main (int): The number of central documents to find.
       n_around (int): The number of neighboring documents to retrieve.
+      where (dict): Metadata filter, e.g. {"source": "manual.pdf"} or
+        {"page": {"$lte": 10}}; also applied to neighbouring chunks.
+      where_document (dict): Text filter, e.g. {"$contains": "E42"}.
     Returns:
-      Dict[str, Any]: A dictionary with 'collection', 'content', 'distances',
-        'parameters', and 'query'.
+      Dict[str, Any]: A dictionary with 'collection', 'ids', 'content',
+        'distances', 'parameters', and 'query'.
     """
     try:
-      collection = client.get_collection(name=collection_name)
+      collection = self.client.get_collection(name=collection_name)
     except Exception as e:
       raise ValueError(f"Collection '{collection_name}' not found: {e}")
 
-    ids = collection.get()['ids']
-    results = collection.query(query_texts=query, n_results=n_main)['ids']
-    all_ids = []
-    for i in results[0]:
-      index = ids.index(i)
-      indexes = ids[max(index-n_around,0):min(index+n_around+1,len(ids))]
-      all_ids.extend(indexes)
-    single_ids = list(set(all_ids))
-    documents = collection.get(ids=single_ids)['documents'][0]
-    docs, scores = self.rerank_documents(query, documents)
+    results = collection.query(query_texts=query,
+                               n_results=n_main,
+                               where=where,
+                               where_document=where_document,
+                               include=['metadatas', 'distances'])
+    window_ids, documents, spans = self._neighbors(collection,
+                                                results['ids'][0],
+                                                results['metadatas'][0],
+                                                n_around, where, where_document)
+    distances_map = dict(zip(results['ids'][0], results['distances'][0]))
+    indices, scores, degraded = self._rerank_or_keep(
+      query, documents, "sentence_window_retriever_reranker",
+      [distances_map.get(x) for x in window_ids])
     result = {
       'query': query,
       'collection': collection_name,
-      'content': docs,
+      'ids': [window_ids[i] for i in indices],
+      'content': [documents[i] for i in indices],
       'distances': scores,
       'parameters': {'n_main': n_main, 'n_around': n_around},
       'time':time.time()
     }
-    return result
+    if degraded:
+      result['degraded'] = 'sentence_window_retrieval'
+      return self.pack(result, higher_is_better=False, spans=spans)
+    return self.pack(result)
 
 
+  @coalesced
+  @metrics.timed
   def multi_query_reranker(self,
                            query: str,
                            collection_name: str,
                            n_results: int,
-                           n_queries: int) -> Dict[str, Any]:
+                           n_queries: int,
+                           where: Optional[Dict[str, Any]] = None,
+                           where_document: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     Generates multiple variations of a query using an LLM to broaden the search.
     This technique helps find documents that the original query might have missed,
     improving the chance of finding relevant information (recall). Now the final
     docs are passing through a ReRanker MODEL, its recommend higher returns to
-    work better with ReRanker MODELs.
+    work better with ReRanker MODELs. When the reranker is overloaded it
+    degrades to the multi_query result.
     Args:
       query (str): The user's original query.
       collection_name (str): The name of an existing ChromaDB collection.
       n_results (int): The number of results per query variation.
       n_queries (int): The number of query variations to generate.
+      where (dict): Metadata filter, e.g. {"source": "manual.pdf"} or
+        {"page": {"$lte": 10}}.
+      where_document (dict): Text filter, e.g. {"$contains": "E42"}.
     Returns:
-      Dict[str, Any]: A dictionary with 'collection', 'content', 'distances',
-        'parameters', and 'query'.
+      Dict[str, Any]: A dictionary with 'collection', 'ids', 'content',
+        'distances', 'parameters', and 'query'.
     """
     try:
-      collection = client.get_collection(name=collection_name)
+      collection = self.client.get_collection(name=collection_name)
     except Exception as e:
       raise ValueError(f"Collection '{collection_name}' not found: {e}")
 
@@ -331,25 +649,453 @@ class Retriever():
       HumanMessage(content=f'The question is: {query}')
     ]
     try:
-      rewrite = eval(llm.invoke(messages).content)
+      rewrite = eval(self.llm.invoke(messages).content)
     except Exception as e:
       raise ValueError(f"Failed to parse LLM response: {e}")
+    progress.report("rewritten", queries=[str(q) for q in rewrite.values()])
 
-    all_ids = []
+    best_distance = {}
+    doc_map = {}
     for question in rewrite.keys():
       answer = collection.query(query_texts=[rewrite[question]],
-                                n_results=n_results)
-      ids = answer.get('ids',[[]])[0]
-      all_ids.extend(ids)
-    single_ids = list(set(all_ids))
-    documents = collection.get(ids=single_ids)['documents'][0]
-    docs, scores = self.rerank_documents(query, documents)
+                                n_results=n_results,
+                                where=where,
+                                where_document=where_document,
+                                include=['documents', 'distances'])
+      for id_, document, distance in zip(answer['ids'][0], answer['documents'][0],
+                                         answer['distances'][0]):
+        doc_map[id_] = document
+        best_distance[id_] = min(distance, best_distance.get(id_, distance))
+    single_ids = list(doc_map)
+    documents = [doc_map[i] for i in single_ids]
+    indices, scores, degraded = self._rerank_or_keep(
+      query, documents, "multi_query_reranker", [best_distance[i] for i in single_ids])
     result = {
       'query': query,
       'collection': collection_name,
-      'content': docs,
+      'ids': [single_ids[i] for i in indices],
+      'content': [documents[i] for i in indices],
       'distances': scores,
       'parameters': {'n_queries': n_queries, 'n_results': n_results},
       'time':time.time()
     }
+    if degraded:
+      result['degraded'] = 'multi_query'
+    return self.pack(result, higher_is_better=not degraded)
+
+
+  @coalesced
+  @metrics.timed
+  def mmr(self,
+          query: str,
+          collection_name: str,
+          k: int = 5,
+          fetch_k: int = 20,
+          lambda_mult: float = 0.5,
+          where: Optional[Dict[str, Any]] = None,
+          where_document: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Maximal Marginal Relevance: a relevant but diverse top 'k'.
+    Over-fetches 'fetch_k' candidates with their embeddings and picks them one
+    at a time, trading relevance to the query against similarity to the
+    chunks already picked, so repeated headers and overlapping chunks are
+    not returned several times.
+    Args:
+      query (str): The user's query.
+      collection_name (str): The name of an existing ChromaDB collection.
+      k (int): The number of documents to return.
+      fetch_k (int): The number of candidates to choose from.
+      lambda_mult (float): Between 0 (most diverse) and 1 (most relevant).
+      where (dict): Metadata filter, e.g. {"source": "manual.pdf"} or
+        {"page": {"$lte": 10}}.
+      where_document (dict): Text filter, e.g. {"$contains": "E42"}.
+    Returns:
+      Dict[str, Any]: A dictionary with 'collection', 'ids', 'content',
+        'distances', 'parameters', and 'query'.
+    """
+    try:
+      collection = self.client.get_collection(name=collection_name)
+    except Exception as e:
+      raise ValueError(f"Collection '{collection_name}' not found: {e}")
+
+    embedding = get_embedder()([query])[0]
+    results = collection.query(query_embeddings=[embedding],
+                               n_results=fetch_k,
+                               where=where,
+                               where_document=where_document,
+                               include=["documents", "distances", "embeddings"])
+    indices = mmr_select(embedding, results["embeddings"][0], k, lambda_mult)
+    result = {
+      'query': query,
+      'collection': collection_name,
+      'ids': [results["ids"][0][i] for i in indices],
+      'content': [results["documents"][0][i] for i in indices],
+      'distances': [results["distances"][0][i] for i in indices],
+      'parameters': {'k': k, 'fetch_k': fetch_k, 'lambda_mult': lambda_mult},
+      'time':time.time()
+    }
+    return self.pack(result, higher_is_better=False)
+
+  @coalesced
+  @metrics.timed
+  def top_k_cascade(self,
+                    query: str,
+                    collection_name: str,
+                    k: int = 5,
+                    high_k: int = 20,
+                    where: Optional[Dict[str, Any]] = None,
+                    where_document: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Cascaded 'retrieve-then-rerank' that calls the reranker MODEL only when needed.
+    The vector similarity is used as a cheap first score. When the best
+    candidate leads the second by at least the collection's 'cascade_margin',
+    or no other one is within its 'cascade_band', the vector order is returned
+    as is; otherwise only the candidates in the band are reranked and the
+    rest keep their order. Skips are counted in the 'cascade_*' metrics.
+    Args:
+      query (str): The user's query.
+      collection_name (str): The name of an existing ChromaDB collection.
+      k (int): The number of documents to return.
+      high_k (int): The number of candidates scored by the cheap stage.
+      where (dict): Metadata filter, e.g. {"source": "manual.pdf"} or
+        {"page": {"$lte": 10}}.
+      where_document (dict): Text filter, e.g. {"$contains": "E42"}.
+    Returns:
+      Dict[str, Any]: A dictionary with 'collection', 'ids', 'content',
+        'distances', 'cascade', 'parameters', and 'query'.
+    """
+    try:
+      collection = self.client.get_collection(name=collection_name)
+    except Exception as e:
+      raise ValueError(f"Collection '{collection_name}' not found: {e}")
+
+    thresholds = {**CASCADE_DEFAULTS, **get_search_params_sqlite(collection_name)}
+    space = ((collection.configuration or {}).get("hnsw") or {}).get("space", "l2")
+    results = collection.query(query_texts=query,
+                               n_results=high_k,
+                               where=where,
+                               where_document=where_document,
+                               include=["documents", "distances"])
+    ids = results["ids"][0]
+    documents = results["documents"][0]
+    similarities = [distance_to_similarity(d, space) for d in results["distances"][0]]
+
+    margin = similarities[0] - similarities[1] if len(similarities) > 1 else None
+    # Candidates come sorted by similarity, so the band is a prefix
+    band = sum(1 for s in similarities if s >= similarities[0] - thresholds["cascade_band"])
+    skipped = margin is None or margin >= thresholds["cascade_margin"] or band < 2
+    degraded = False
+    if skipped:
+      order, scores = list(range(len(ids))), similarities
+    else:
+      indices, band_scores, degraded = self._rerank_or_keep(
+        query, documents[:band], "top_k_cascade", similarities[:band])
+      order = indices + list(range(band, len(ids)))
+      scores = similarities if degraded else band_scores + [None] * (len(ids) - band)
+    order, scores = order[:k], scores[:k]
+
+    metrics.increment("cascade_queries", collection=collection_name)
+    if skipped:
+      metrics.increment("cascade_skipped", collection=collection_name)
+    elif not degraded:
+      metrics.increment("cascade_reranked_candidates", band, collection=collection_name)
+    result = {
+      'query': query,
+      'collection': collection_name,
+      'ids': [ids[i] for i in order],
+      'content': [documents[i] for i in order],
+      'distances': scores,  # Similarities when skipped, else reranker scores
+      'cascade': {'skipped': skipped,
+                  'margin': None if margin is None else round(margin, 4),
+                  'reranked': 0 if skipped or degraded else band,
+                  'skip_rate': round(metrics.ratio("cascade_skipped", "cascade_queries",
+                                                   collection=collection_name), 4)},
+      'parameters': {'k': k, 'high_k': high_k, **thresholds},
+      'time':time.time()
+    }
+    if degraded:
+      result['degraded'] = 'top_k'
+    return self.pack(result)
+
+  def estimate_latency(self, strategy: str, collection_name: str, prior_ms: float) -> float:
+    """Expected latency of a strategy in ms: the recent LATENCY_QUANTILE of
+    its measured calls on the collection (the prior without enough of them),
+    plus the current reranker queue wait for reranking strategies."""
+    measured = metrics.quantile("latency_seconds", LATENCY_QUANTILE,
+                                max_age=LATENCY_MAX_AGE, min_count=LATENCY_MIN_SAMPLES,
+                                strategy=strategy, collection=collection_name)
+    estimate = prior_ms if measured is None else measured * 1000
+    if "reranker" in strategy or strategy == "top_k_cascade":
+      pool = get_rerank_pool()
+      estimate += pool.expected_wait(pool.pending) * 1000
+    return estimate
+
+  @coalesced
+  def adaptive(self,
+               query: str,
+               collection_name: str,
+               latency_budget_ms: int = None,
+               where: Optional[Dict[str, Any]] = None,
+               where_document: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Picks the richest strategy expected to answer within a latency budget.
+    Strategies are tried from ADAPTIVE_LADDER, costliest first, using live
+    latency statistics of each one on this collection, so reranked
+    multi-query runs off-peak and cheaper strategies take over at peak.
+    Queries with exact codes (part numbers, error codes) only use the
+    strategies backed by the keyword index.
+    Args:
+      query (str): The user's query.
+      collection_name (str): The name of an existing ChromaDB collection.
+      latency_budget_ms (int): Time the retrieval may take, defaults to the
+        'latency_budget_ms' config.
+      where (dict): Metadata filter, e.g. {"source": "manual.pdf"} or
+        {"page": {"$lte": 10}}.
+      where_document (dict): Text filter, e.g. {"$contains": "E42"}.
+    Returns:
+      Dict[str, Any]: The chosen strategy's result, with an 'adaptive' entry
+        describing the choice.
+    """
+    budget = latency_budget_ms or LATENCY_BUDGET_MS
+    features = query_features(query)
+    ladder = ADAPTIVE_LADDER
+    if features["codes"]:
+      ladder = [step for step in ADAPTIVE_LADDER if step[0].startswith("hybrid")]
+
+    estimates = []
+    for strategy, params, prior_ms in ladder:
+      estimates.append(self.estimate_latency(strategy, collection_name, prior_ms))
+      if estimates[-1] <= budget:
+        break
+    else:
+      # Nothing fits: take the fastest one
+      fastest = min(range(len(ladder)), key=estimates.__getitem__)
+      strategy, params, _ = ladder[fastest]
+      estimates.append(estimates[fastest])
+
+    result = getattr(self, strategy)(query=query, collection_name=collection_name,
+                                     where=where, where_document=where_document, **params)
+    result['adaptive'] = {'strategy': strategy,
+                          'estimate_ms': round(estimates[-1], 1),
+                          'budget_ms': budget,
+                          'features': features}
+    metrics.increment("adaptive_choice", strategy=strategy)
     return result
+
+  def _hybrid_candidates(self,
+                         query: str,
+                         collection,
+                         n_candidates: int,
+                         where: Optional[Dict[str, Any]] = None,
+                         where_document: Optional[Dict[str, Any]] = None) -> tuple[List[str], List[str], List[float]]:
+    """Fuses vector and BM25 rankings with Reciprocal Rank Fusion.
+    The BM25 index is not filtered, so with filters it is searched deeper
+    and its hits are kept only if they match them.
+    Returns the fused ids, their documents and fused scores, best first.
+    """
+    results = collection.query(query_texts=query,
+                               n_results=n_candidates,
+                               where=where,
+                               where_document=where_document,
+                               include=["documents"])
+    vector_ids = results["ids"][0]
+    doc_map = dict(zip(vector_ids, results["documents"][0]))
+    index = lexical.ensure_index(collection)
+    filtered = bool(where or where_document)
+    depth = n_candidates * FILTERED_LEXICAL_FACTOR if filtered else n_candidates
+    lexical_ids = [i for i, _ in index.search(query, depth)]
+    if filtered and lexical_ids:
+      allowed = set(collection.get(ids=lexical_ids, where=where,
+                                   where_document=where_document, include=[])["ids"])
+      lexical_ids = [i for i in lexical_ids if i in allowed]
+    lexical_ids = lexical_ids[:n_candidates]
+
+    fused = {}
+    for ranking in (vector_ids, lexical_ids):
+      for rank, id_ in enumerate(ranking):
+        fused[id_] = fused.get(id_, 0.0) + 1 / (RRF_K + rank + 1)
+    ordered = sorted(fused, key=lambda i: fused[i], reverse=True)[:n_candidates]
+
+    missing = [i for i in ordered if i not in doc_map]
+    if missing:
+      fetched = collection.get(ids=missing, include=["documents"])
+      doc_map.update(zip(fetched["ids"], fetched["documents"]))
+    ordered = [i for i in ordered if i in doc_map]
+    return ordered, [doc_map[i] for i in ordered], [fused[i] for i in ordered]
+
+  @coalesced
+  @metrics.timed
+  def hybrid(self,
+             query: str,
+             collection_name: str,
+             k: int = 5,
+             n_candidates: int = 20,
+             where: Optional[Dict[str, Any]] = None,
+             where_document: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Combines vector search with a BM25 keyword index of the same collection.
+    Exact terms such as part numbers and error codes that embeddings handle
+    poorly are found by the keyword index, and both rankings are fused.
+    Args:
+      query (str): The user's query.
+      collection_name (str): The name of an existing ChromaDB collection.
+      k (int): The number of documents to return.
+      n_candidates (int): The number of candidates taken from each ranking.
+      where (dict): Metadata filter, e.g. {"source": "manual.pdf"} or
+        {"page": {"$lte": 10}}.
+      where_document (dict): Text filter, e.g. {"$contains": "E42"}.
+    Returns:
+      Dict[str, Any]: A dictionary with 'collection', 'ids', 'content',
+        'distances', 'parameters', and 'query'.
+    """
+    try:
+      collection = self.client.get_collection(name=collection_name)
+    except Exception as e:
+      raise ValueError(f"Collection '{collection_name}' not found: {e}")
+
+    ids, documents, scores = self._hybrid_candidates(query, collection, n_candidates,
+                                                     where, where_document)
+    result = {
+      'query': query,
+      'collection': collection_name,
+      'ids': ids[:k],
+      'content': documents[:k],
+      'distances': scores[:k],  # Actually fused scores, higher is better
+      'parameters': {'k': k, 'n_candidates': n_candidates},
+      'time':time.time()
+    }
+    return self.pack(result)
+
+  @coalesced
+  @metrics.timed
+  def hybrid_reranker(self,
+                      query: str,
+                      collection_name: str,
+                      high_k: int = 8,
+                      where: Optional[Dict[str, Any]] = None,
+                      where_document: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Hybrid (vector + BM25) retrieval followed by the reranker MODEL.
+    Because exact terms are already ranked high by the keyword index, far
+    fewer candidates need to be reranked than with top_k_reranker. When the
+    reranker is overloaded it degrades to the hybrid result.
+    Args:
+      query (str): The user's query.
+      collection_name (str): The name of an existing ChromaDB collection.
+      high_k (int): The number of fused candidates to rerank.
+      where (dict): Metadata filter, e.g. {"source": "manual.pdf"} or
+        {"page": {"$lte": 10}}.
+      where_document (dict): Text filter, e.g. {"$contains": "E42"}.
+    Returns:
+      Dict[str, Any]: A dictionary with 'collection', 'ids', 'content',
+        'distances', 'parameters', and 'query'.
+    """
+    try:
+      collection = self.client.get_collection(name=collection_name)
+    except Exception as e:
+      raise ValueError(f"Collection '{collection_name}' not found: {e}")
+
+    ids, documents, fused = self._hybrid_candidates(query, collection, high_k,
+                                                    where, where_document)
+    indices, scores, degraded = self._rerank_or_keep(query, documents, "hybrid_reranker", fused)
+    result = {
+      'query': query,
+      'collection': collection_name,
+      'ids': [ids[i] for i in indices],
+      'content': [documents[i] for i in indices],
+      'distances': scores,  # Fused scores when degraded
+      'parameters': {'high_k': high_k},
+      'time':time.time()
+    }
+    if degraded:
+      result['degraded'] = 'hybrid'
+    return self.pack(result)
+
+
+  def _search_collection(self,
+                         collection_name: str,
+                         embedding,
+                         n_results: int,
+                         where: Optional[Dict[str, Any]] = None,
+                         where_document: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Queries one collection with a precomputed embedding."""
+    collection = self.client.get_collection(name=collection_name)
+    space = ((collection.configuration or {}).get("hnsw") or {}).get("space", "l2")
+    results = collection.query(query_embeddings=[embedding],
+                               n_results=n_results,
+                               where=where,
+                               where_document=where_document,
+                               include=["documents", "distances"])
+    return {
+      'ids': results['ids'][0],
+      'content': results['documents'][0],
+      'scores': [distance_to_similarity(d, space) for d in results['distances'][0]],
+    }
+
+  @coalesced
+  @metrics.timed
+  def federated_search(self,
+                       query: str,
+                       collection_names: Optional[List[str]] = None,
+                       k: int = 5,
+                       rerank: bool = False,
+                       where: Optional[Dict[str, Any]] = None,
+                       where_document: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Searches several collections at once and returns a global top 'k'.
+    The collections are queried concurrently, so the latency is that of the
+    slowest collection. Results are merged by normalized similarity, or by
+    the reranker MODEL score when 'rerank' is set, and annotated with the
+    collection they came from.
+    Args:
+      query (str): The user's query.
+      collection_names (list[str]): Collections to search, all when empty.
+      k (int): The number of documents to return.
+      rerank (bool): Whether to merge the candidates with the reranker.
+      where (dict): Metadata filter, e.g. {"source": "manual.pdf"} or
+        {"page": {"$lte": 10}}.
+      where_document (dict): Text filter, e.g. {"$contains": "E42"}.
+    Returns:
+      Dict[str, Any]: A dictionary with 'collection', 'ids', 'content',
+        'distances', 'sources', 'errors', 'parameters', and 'query'.
+    """
+    names = list(collection_names or list_collections_sqlite())
+    embedding = get_embedder()([query])[0]
+    futures = {name: get_fanout_pool().submit(self._search_collection, name, embedding, k,
+                                                 where, where_document)
+               for name in names}
+
+    candidates = []
+    errors = {}
+    for name, future in futures.items():
+      try:
+        found = future.result()
+      except Exception as e:
+        errors[name] = str(e)
+        continue
+      candidates.extend(zip(found['ids'], found['content'], found['scores'],
+                            [name] * len(found['ids'])))
+
+    degraded = False
+    if rerank and candidates:
+      indices, scores, degraded = self._rerank_or_keep(
+        query, [c[1] for c in candidates], "federated_search", top_r=k)
+    if rerank and candidates and not degraded:
+      merged = [candidates[i][:2] + (score,) + candidates[i][3:]
+                for i, score in zip(indices, scores)]
+    else:
+      merged = sorted(candidates, key=lambda c: c[2], reverse=True)[:k]
+    result = {
+      'query': query,
+      'collection': names,
+      'ids': [c[0] for c in merged],
+      'content': [c[1] for c in merged],
+      'distances': [c[2] for c in merged],  # Similarities or reranker scores
+      'sources': [c[3] for c in merged],
+      'errors': errors,
+      'parameters': {'k': k, 'rerank': rerank},
+      'time':time.time()
+    }
+    if degraded:
+      result['degraded'] = 'federated_search'
+    return self.pack(result)
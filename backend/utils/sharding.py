@@ -0,0 +1,367 @@
+"""Collections partitioned across several Chroma servers.
+A collection is sharded when its row in config.db lists shard endpoints
+("host:port"). Its chunks are then spread over a collection of the same name
+on each endpoint, either by source document (the default, so the whole
+document and every sentence window lives on one shard) or by chunk id hash
+(even spread, parallel writes even within one document).
+
+ShardedClient wraps the regular client and returns a ShardedCollection for
+sharded collections, which offers the part of the Chroma Collection API used
+by this project: writes are split per shard and sent in parallel, queries are
+scattered to every shard and merged into a global top-k by distance.
+
+Shard maps are cached for SHARD_MAP_TTL seconds; configure_shards drops the
+cached entry at once, other processes see the change once theirs expires.
+"""
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import chromadb
+from . import sqlite_functions as sq
+from .model_server import collection_embedder
+
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "16"))
+SHARD_MAP_TTL = float(os.getenv("SHARD_MAP_TTL", "60"))
+PARTITIONS = ("source", "hash")
+RESULT_FIELDS = ("ids", "documents", "metadatas", "embeddings", "distances", "uris", "data")
+
+shard_pool = None
+_clients = {}
+_clients_lock = threading.Lock()
+_shard_maps = {}
+_shard_maps_lock = threading.Lock()
+
+def get_shard_pool() -> ThreadPoolExecutor:
+  """Returns the shared thread pool used to call the shards concurrently."""
+  global shard_pool
+  if shard_pool is None:
+    shard_pool = ThreadPoolExecutor(max_workers=SHARD_WORKERS, thread_name_prefix="shard")
+  return shard_pool
+
+def get_shard_client(endpoint: str):
+  """Returns the HTTP client of a 'host:port' endpoint, connecting on first use."""
+  with _clients_lock:
+    if endpoint not in _clients:
+      host, _, port = endpoint.split("://")[-1].rpartition(":")
+      _clients[endpoint] = chromadb.HttpClient(host=host, port=int(port))
+    return _clients[endpoint]
+
+def get_shard_map(collection_name: str):
+  """Shard configuration of a collection in config.db, None when it is not
+  sharded. Cached for SHARD_MAP_TTL seconds."""
+  now = time.monotonic()
+  with _shard_maps_lock:
+    cached = _shard_maps.get(collection_name)
+    if cached is not None and cached[0] > now:
+      return cached[1]
+  config = sq.get_shards_sqlite(collection_name)
+  with _shard_maps_lock:
+    _shard_maps[collection_name] = (now + SHARD_MAP_TTL, config)
+  return config
+
+def invalidate_shard_map(collection_name: str = None):
+  """Drops the cached shard map of a collection, or of every collection."""
+  with _shard_maps_lock:
+    if collection_name is None:
+      _shard_maps.clear()
+    else:
+      _shard_maps.pop(collection_name, None)
+
+def configure_shards(collection_name: str, endpoints: list, partition: str = "source"):
+  """Saves the shard endpoints of a collection in config.db (before it is
+  created in Chroma; an empty list unshards it) and drops its cached map."""
+  if endpoints and partition not in PARTITIONS:
+    raise ValueError(f"Unknown partition '{partition}', expected one of {PARTITIONS}")
+  sq.update_shards_sqlite(collection_name, endpoints, partition)
+  invalidate_shard_map(collection_name)
+
+def shard_index(key: str, n_shards: int) -> int:
+  """Stable shard of a key (the same in every process, unlike hash())."""
+  digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+  return int.from_bytes(digest, "big") % n_shards
+
+def filter_sources(where):
+  """Sources a metadata filter is restricted to, None when it can match any."""
+  if not where:
+    return None
+  sources = None
+  for key, value in where.items():
+    if key == "source":
+      if isinstance(value, str):
+        found = {value}
+      elif isinstance(value, dict) and "$eq" in value:
+        found = {value["$eq"]}
+      elif isinstance(value, dict) and "$in" in value:
+        found = set(value["$in"])
+      else:
+        continue
+    elif key == "$and":
+      found = None
+      for clause in value:
+        clause_sources = filter_sources(clause)
+        if clause_sources is not None:
+          found = clause_sources if found is None else found & clause_sources
+      if found is None:
+        continue
+    elif key == "$or":
+      parts = [filter_sources(clause) for clause in value]
+      if any(p is None for p in parts):
+        continue
+      found = set().union(*parts)
+    else:
+      continue
+    sources = found if sources is None else sources & found
+  return sources
+
+class ShardedCollection():
+  """One logical collection stored as same-named collections on several servers.
+  Args:
+    name (str): Collection name, the same on every shard.
+    collections (list): The Chroma collection on each shard, in shard order.
+    partition (str): 'source' to keep each document on one shard, 'hash'
+      to spread chunks by id.
+    clients (list): The client of each shard, for administrative tasks.
+    embedding_function: Embeds query texts once for every shard; defaults
+      to the one in the collection's configuration.
+  """
+  def __init__(self, name: str, collections: list, partition: str = "source", clients: list = None,
+               embedding_function=None):
+    if partition not in PARTITIONS:
+      raise ValueError(f"Unknown partition '{partition}', expected one of {PARTITIONS}")
+    self.name = name
+    self.shards = collections
+    self.partition = partition
+    self.clients = clients or []
+    self._embedding_function = embedding_function
+
+  @property
+  def embedding_function(self):
+    if self._embedding_function is None:
+      self._embedding_function = self.configuration["embedding_function"]
+    return self._embedding_function
+
+  @property
+  def configuration(self):
+    return self.shards[0].configuration
+
+  @property
+  def metadata(self):
+    return self.shards[0].metadata
+
+  def _map(self, calls: dict) -> dict:
+    """Runs {shard: (method, kwargs)} concurrently, returns {shard: result}."""
+    if len(calls) == 1:
+      (shard, (method, kwargs)), = calls.items()
+      return {shard: getattr(self.shards[shard], method)(**kwargs)}
+    futures = {shard: get_shard_pool().submit(getattr(self.shards[shard], method), **kwargs)
+               for shard, (method, kwargs) in calls.items()}
+    return {shard: future.result() for shard, future in futures.items()}
+
+  def _shard_of(self, chunk_id: str, metadata: dict = None) -> int:
+    if self.partition == "source":
+      if not metadata or "source" not in metadata:
+        raise ValueError(f"Chunk '{chunk_id}' has no 'source' metadata to place it by")
+      return shard_index(metadata["source"], len(self.shards))
+    return shard_index(chunk_id, len(self.shards))
+
+  def _target_shards(self, where) -> list:
+    """Shards that can hold chunks matching a filter."""
+    sources = filter_sources(where) if self.partition == "source" else None
+    if sources is None:
+      return list(range(len(self.shards)))
+    return sorted({shard_index(s, len(self.shards)) for s in sources})
+
+  def _locate(self, ids: list) -> dict:
+    """{shard: ids stored there}."""
+    if self.partition == "hash":
+      located = {}
+      for chunk_id in ids:
+        located.setdefault(shard_index(chunk_id, len(self.shards)), []).append(chunk_id)
+      return located
+    found = self._map({s: ("get", {"ids": ids, "include": []}) for s in range(len(self.shards))})
+    return {s: r["ids"] for s, r in found.items() if r["ids"]}
+
+  def _split(self, ids, metadatas=None, locate: bool = False, **columns) -> dict:
+    """Splits parallel write columns into {shard: kwargs}. Chunks are placed
+    by their 'source' metadata or id hash; with 'locate', chunks without it
+    are looked up on the shards instead.
+    """
+    ids = [ids] if isinstance(ids, str) else list(ids)
+    if isinstance(metadatas, dict):
+      metadatas = [metadatas]
+    if self.partition == "hash":
+      shards = [self._shard_of(i) for i in ids]
+    elif metadatas is not None and all(m and "source" in m for m in metadatas):
+      shards = [self._shard_of(i, m) for i, m in zip(ids, metadatas)]
+    elif locate:
+      placed = {i: s for s, found in self._locate(ids).items() for i in found}
+      shards = [placed.get(i) for i in ids]
+    else:
+      raise ValueError("Chunks need a 'source' metadata to be placed on a shard")
+    columns = {k: v for k, v in dict(columns, metadatas=metadatas).items() if v is not None}
+    split = {}
+    for position, shard in enumerate(shards):
+      if shard is None:
+        continue
+      kwargs = split.setdefault(shard, {"ids": []})
+      kwargs["ids"].append(ids[position])
+      for key, values in columns.items():
+        kwargs.setdefault(key, []).append(values[position])
+    return split
+
+  def count(self) -> int:
+    return sum(self._map({s: ("count", {}) for s in range(len(self.shards))}).values())
+
+  def add(self, ids, embeddings=None, metadatas=None, documents=None, **kwargs):
+    """Adds chunks, each batch to its shards in parallel."""
+    split = self._split(ids, metadatas, embeddings=embeddings, documents=documents)
+    self._map({s: ("add", kw) for s, kw in split.items()})
+
+  def update(self, ids, embeddings=None, metadatas=None, documents=None, **kwargs):
+    split = self._split(ids, metadatas, locate=True, embeddings=embeddings, documents=documents)
+    self._map({s: ("update", kw) for s, kw in split.items()})
+
+  def delete(self, ids=None, where=None, where_document=None):
+    if ids is not None:
+      calls = {s: ("delete", {"ids": found, "where": where, "where_document": where_document})
+               for s, found in self._locate(ids).items()}
+    else:
+      calls = {s: ("delete", {"where": where, "where_document": where_document})
+               for s in self._target_shards(where)}
+    if calls:
+      self._map(calls)
+
+  def get(self, ids=None, where=None, limit=None, offset=None, where_document=None,
+          include=("metadatas", "documents")):
+    """Gathers matching chunks from the shards that can hold them, in shard order.
+    With limit/offset the shards are read one after the other as if they
+    were concatenated, which is how collections are paged through in batches.
+    """
+    include = list(include)
+    if ids is not None:
+      targets = self._locate([ids] if isinstance(ids, str) else list(ids))
+      calls = {s: ("get", {"ids": found, "where": where, "where_document": where_document,
+                           "include": include}) for s, found in targets.items()}
+      return self._merge_gets(self._map(calls), include) if calls else self._empty(include)
+    targets = self._target_shards(where)
+    if limit is None and not offset:
+      calls = {s: ("get", {"where": where, "where_document": where_document, "include": include})
+               for s in targets}
+      return self._merge_gets(self._map(calls), include)
+
+    parts, skip = {}, offset or 0
+    remaining = limit if limit is not None else float("inf")
+    for shard in targets:
+      if remaining <= 0:
+        break
+      collection = self.shards[shard]
+      if where is None and where_document is None:
+        size = collection.count()
+      else:
+        size = len(collection.get(where=where, where_document=where_document, include=[])["ids"])
+      if skip >= size:
+        skip -= size
+        continue
+      take = min(remaining, size - skip)
+      parts[shard] = collection.get(where=where, where_document=where_document, include=include,
+                                    limit=int(take), offset=skip)
+      skip, remaining = 0, remaining - take
+    return self._merge_gets(parts, include)
+
+  @staticmethod
+  def _empty(include: list) -> dict:
+    return {field: [] if field == "ids" or field in include else None for field in RESULT_FIELDS}
+
+  def _merge_gets(self, parts: dict, include: list) -> dict:
+    merged = self._empty(include)
+    for shard in sorted(parts):
+      for field in ["ids"] + include:
+        values = parts[shard].get(field)
+        if values is not None:
+          merged[field].extend(values)
+    return merged
+
+  def query(self, query_embeddings=None, query_texts=None, n_results: int = 10, where=None,
+            where_document=None, include=("metadatas", "documents", "distances"), **kwargs):
+    """Scatters the query to every shard that can match and merges the
+    answers into a global top n_results by distance. Texts are embedded once,
+    not once per shard.
+    """
+    include = list(include)
+    if query_embeddings is None:
+      texts = [query_texts] if isinstance(query_texts, str) else list(query_texts)
+      query_embeddings = self.embedding_function.embed_query(texts)
+    fields = include if "distances" in include else include + ["distances"]
+    calls = {s: ("query", {"query_embeddings": query_embeddings, "n_results": n_results,
+                           "where": where, "where_document": where_document, "include": fields})
+             for s in self._target_shards(where)}
+    parts = self._map(calls)
+
+    merged = {field: [] if field == "ids" or field in include else None for field in RESULT_FIELDS}
+    for q in range(len(query_embeddings)):
+      hits = [(distance, shard, position)
+              for shard, part in parts.items()
+              for position, distance in enumerate(part["distances"][q])]
+      hits = sorted(hits)[:n_results]
+      for field in ["ids"] + include:
+        merged[field].append([parts[shard][field][q][position] for _, shard, position in hits])
+    return merged
+
+class ShardedClient():
+  """Chroma client that resolves sharded collections from config.db.
+  Collections are opened with the model server's embedding function when
+  one is configured. Every other call goes to the wrapped client unchanged.
+  """
+  def __init__(self, client):
+    self.client = client
+
+  def __getattr__(self, name):
+    return getattr(self.client, name)
+
+  @staticmethod
+  def _with_embedder(kwargs: dict) -> dict:
+    embedder = collection_embedder()
+    if embedder is not None:
+      kwargs.setdefault("embedding_function", embedder)
+    return kwargs
+
+  def _shards(self, name: str):
+    config = get_shard_map(name)
+    if not config or not config.get("endpoints"):
+      return None, None
+    clients = [get_shard_client(e) for e in config["endpoints"]]
+    return clients, config.get("partition", "source")
+
+  def get_collection(self, name: str, **kwargs):
+    kwargs = self._with_embedder(kwargs)
+    clients, partition = self._shards(name)
+    if clients is None:
+      return self.client.get_collection(name=name, **kwargs)
+    return ShardedCollection(name, [c.get_collection(name=name, **kwargs) for c in clients],
+                             partition, clients, kwargs.get("embedding_function"))
+
+  def create_collection(self, name: str, **kwargs):
+    kwargs = self._with_embedder(kwargs)
+    clients, partition = self._shards(name)
+    if clients is None:
+      return self.client.create_collection(name=name, **kwargs)
+    return ShardedCollection(name, [c.create_collection(name=name, **kwargs) for c in clients],
+                             partition, clients, kwargs.get("embedding_function"))
+
+  def get_or_create_collection(self, name: str, **kwargs):
+    kwargs = self._with_embedder(kwargs)
+    clients, partition = self._shards(name)
+    if clients is None:
+      return self.client.get_or_create_collection(name=name, **kwargs)
+    return ShardedCollection(name, [c.get_or_create_collection(name=name, **kwargs) for c in clients],
+                             partition, clients, kwargs.get("embedding_function"))
+
+  def delete_collection(self, name: str):
+    clients, _ = self._shards(name)
+    invalidate_shard_map(name)
+    if clients is None:
+      return self.client.delete_collection(name=name)
+    for c in clients:
+      c.delete_collection(name=name)
@@ -0,0 +1,194 @@
+"""Collection snapshots: export a collection and restore it without re-embedding.
+A snapshot is a directory of columnar files:
+  manifest.json        collection settings, SQLite row and documents
+  embeddings.npy       float16 or float32 (n, dim), memory-mapped on import
+  ordinals.npy         int32, -1 when the chunk has no ordinal
+  <column>.bin         UTF-8 strings back to back, for ids, documents,
+  <column>.offsets.npy   sources, chunk hashes, file hashes and any other
+                         metadata (as JSON); string i is bin[off[i]:off[i+1]]
+
+Run from the repository root:
+  python -m backend.utils.snapshot export manuals ./snapshots/manuals
+  python -m backend.utils.snapshot import ./snapshots/manuals --name manuals_copy
+"""
+import argparse
+import json
+import os
+import numpy as np
+from . import chroma_functions as cf
+from . import lexical
+from . import sqlite_functions as sq
+
+FORMAT_VERSION = 1
+STRING_COLUMNS = ("ids", "documents", "sources", "chunk_hashes", "file_hashes", "extra")
+KNOWN_METADATA = ("source", "ordinal", "chunk_hash", "file_hash")
+
+class StringColumnWriter():
+  """Appends strings to a <name>.bin file and records their offsets."""
+  def __init__(self, path: str, name: str):
+    self.prefix = os.path.join(path, name)
+    self.file = open(self.prefix + ".bin", "wb")
+    self.offsets = [0]
+
+  def extend(self, values):
+    for value in values:
+      data = (value or "").encode("utf-8")
+      self.file.write(data)
+      self.offsets.append(self.offsets[-1] + len(data))
+
+  def close(self):
+    self.file.close()
+    np.save(self.prefix + ".offsets.npy", np.asarray(self.offsets, dtype=np.int64))
+
+class StringColumn():
+  """Reads a string column written by StringColumnWriter, memory-mapped."""
+  def __init__(self, path: str, name: str):
+    prefix = os.path.join(path, name)
+    self.offsets = np.load(prefix + ".offsets.npy", mmap_mode="r")
+    size = int(self.offsets[-1])
+    self.data = np.memmap(prefix + ".bin", dtype=np.uint8, mode="r") if size else b""
+
+  def slice(self, start: int, end: int) -> list:
+    offsets = np.asarray(self.offsets[start:end + 1])
+    if len(offsets) < 2:
+      return []
+    block = bytes(self.data[offsets[0]:offsets[-1]])
+    base = int(offsets[0])
+    return [block[int(a) - base:int(b) - base].decode("utf-8")
+            for a, b in zip(offsets[:-1], offsets[1:])]
+
+def export_collection(client, collection_name: str, path: str,
+                      dtype: str = "float16", batch_size: int = 5000) -> dict:
+  """Writes a collection, its embeddings and its SQLite rows to a snapshot.
+  Returns the manifest. Raises RuntimeError, without writing the manifest,
+  when the collection changes size during the export.
+  """
+  collection = cf.get_collection(client, collection_name)
+  total = collection.count()
+  os.makedirs(path, exist_ok=True)
+  writers = {name: StringColumnWriter(path, name) for name in STRING_COLUMNS}
+  ordinals = np.full(total, -1, dtype=np.int32)
+  embeddings = None
+  position = 0
+  for batch in cf.iter_collection(collection, batch_size):
+    vectors = np.asarray(batch["embeddings"], dtype=np.float32)
+    if embeddings is None:
+      embeddings = np.lib.format.open_memmap(os.path.join(path, "embeddings.npy"), mode="w+",
+                                             dtype=dtype, shape=(total, vectors.shape[1]))
+    end = position + len(batch["ids"])
+    if end > total:
+      break
+    embeddings[position:end] = vectors
+    metadatas = [m or {} for m in batch["metadatas"]]
+    ordinals[position:end] = [m.get("ordinal", -1) for m in metadatas]
+    writers["ids"].extend(batch["ids"])
+    writers["documents"].extend(batch["documents"])
+    writers["sources"].extend(m.get("source") for m in metadatas)
+    writers["chunk_hashes"].extend(m.get("chunk_hash") for m in metadatas)
+    writers["file_hashes"].extend(m.get("file_hash") for m in metadatas)
+    writers["extra"].extend(
+      json.dumps({k: v for k, v in m.items() if k not in KNOWN_METADATA})
+      if set(m) - set(KNOWN_METADATA) else "" for m in metadatas)
+    position = end
+  for writer in writers.values():
+    writer.close()
+  if embeddings is not None:
+    embeddings.flush()
+  if position != total or collection.count() != total:
+    raise RuntimeError(f"Collection '{collection_name}' changed during the export "
+                       f"({total} chunks expected, {position} read); run it again")
+  np.save(os.path.join(path, "ordinals.npy"), ordinals)
+
+  manifest = {
+    "format": FORMAT_VERSION,
+    "collection": collection_name,
+    "count": position,
+    "dimension": None if embeddings is None else int(embeddings.shape[1]),
+    "dtype": dtype,
+    "hnsw": cf.hnsw_configuration(collection),
+    "metadata": collection.metadata,
+    "sqlite": {"collection": sq.get_collection_params_sqlite(collection_name),
+               "search_params": sq.get_search_params_sqlite(collection_name),
+               "documents": sq.list_documents_sqlite(collection_name)},
+  }
+  with open(os.path.join(path, "manifest.json"), "w") as f:
+    json.dump(manifest, f, indent=2, default=str)
+  return manifest
+
+def import_collection(client, path: str, collection_name: str = None,
+                      batch_size: int = 5000) -> int:
+  """Creates a collection from a snapshot without re-embedding and registers
+  it in SQLite, then builds its BM25 index.
+  Returns how many chunks were loaded.
+  """
+  with open(os.path.join(path, "manifest.json")) as f:
+    manifest = json.load(f)
+  if manifest["format"] != FORMAT_VERSION:
+    raise ValueError(f"Unsupported snapshot format {manifest['format']}")
+  name = collection_name or manifest["collection"]
+  collection = client.create_collection(name=name,
+                                        configuration={"hnsw": manifest["hnsw"]},
+                                        metadata=manifest["metadata"])
+
+  total = manifest["count"]
+  if total:
+    embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+    ordinals = np.load(os.path.join(path, "ordinals.npy"), mmap_mode="r")
+    columns = {column: StringColumn(path, column) for column in STRING_COLUMNS}
+    for start in range(0, total, batch_size):
+      end = min(start + batch_size, total)
+      values = {column: reader.slice(start, end) for column, reader in columns.items()}
+      metadatas = []
+      for i in range(end - start):
+        metadata = json.loads(values["extra"][i]) if values["extra"][i] else {}
+        for key, column in (("source", "sources"), ("chunk_hash", "chunk_hashes"),
+                            ("file_hash", "file_hashes")):
+          if values[column][i]:
+            metadata[key] = values[column][i]
+        if ordinals[start + i] >= 0:
+          metadata["ordinal"] = int(ordinals[start + i])
+        metadatas.append(metadata or None)
+      collection.add(ids=values["ids"],
+                     embeddings=np.asarray(embeddings[start:end], dtype=np.float32),
+                     documents=values["documents"],
+                     metadatas=metadatas)
+
+  details = manifest["sqlite"]["collection"]
+  if details:
+    sq.create_collection_sqlite(name, details["index_method"], details["index_params"])
+    if manifest["sqlite"]["search_params"]:
+      sq.update_search_params_sqlite(name, manifest["sqlite"]["search_params"])
+    sq.update_hnsw_sqlite(name, manifest["hnsw"])
+    for document in manifest["sqlite"]["documents"]:
+      sq.add_document_sqlite(name, document["name"], document["file_hash"],
+                             document["chunk_count"], document["status"])
+  lexical.delete_index(name)  # left over from an earlier collection with this name
+  lexical.ensure_index(collection)
+  return total
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                   formatter_class=argparse.RawDescriptionHelpFormatter,
+                                   epilog="\n".join(__doc__.splitlines()[1:]))
+  commands = parser.add_subparsers(dest="command", required=True)
+  export = commands.add_parser("export", help="dump a collection to a snapshot")
+  export.add_argument("collection")
+  export.add_argument("path")
+  export.add_argument("--dtype", choices=["float16", "float32"], default="float16")
+  export.add_argument("--batch-size", type=int, default=5000)
+  restore = commands.add_parser("import", help="load a snapshot into Chroma")
+  restore.add_argument("path")
+  restore.add_argument("--name", help="collection name, defaults to the exported one")
+  restore.add_argument("--batch-size", type=int, default=5000)
+  args = parser.parse_args()
+
+  client = cf.connect_chroma()
+  if args.command == "export":
+    manifest = export_collection(client, args.collection, args.path, args.dtype, args.batch_size)
+    print(f"Exported {manifest['count']} chunks of '{args.collection}' to {args.path}")
+  else:
+    count = import_collection(client, args.path, args.name, args.batch_size)
+    print(f"Imported {count} chunks from {args.path}")
+
+if __name__ == "__main__":
+  main()
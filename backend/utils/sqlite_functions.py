@@ -5,7 +5,81 @@ from dotenv import load_dotenv
 import datetime
 
 load_dotenv()
-db_path = "config.db"
+db_path = os.getenv("SQLITE_PATH", "config.db")
+
+INGESTION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    collection TEXT NOT NULL,
+    name TEXT NOT NULL,
+    file_hash TEXT,
+    chunk_count INTEGER DEFAULT 0,
+    ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    status TEXT DEFAULT 'ready',
+    UNIQUE (collection, name)
+);
+CREATE INDEX IF NOT EXISTS idx_documents_hash ON documents (collection, file_hash);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    collection TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    worker TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    available_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, available_at, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_collection ON jobs (collection, id);
+"""
+SCHEMA_VERSION = 1  # PRAGMA user_version once pdf_name is copied into documents
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "1800"))
+_migrated = set()
+
+def _connect() -> sqlite3.Connection:
+  """Opens the database in WAL mode, safe for parallel ingestion workers,
+  and migrates it to the current schema on first use."""
+  conn = sqlite3.connect(db_path, timeout=30)
+  conn.execute("PRAGMA journal_mode=WAL")
+  if db_path not in _migrated:
+    _migrate(conn)
+    _migrated.add(db_path)
+  return conn
+
+def _migrate(conn: sqlite3.Connection):
+  """Creates the documents table and copies the old pdf_name JSON lists into it."""
+  conn.executescript(INGESTION_SCHEMA)
+  cur = conn.cursor()
+  cur.execute("BEGIN IMMEDIATE")
+  try:
+    columns = [c[1] for c in cur.execute("PRAGMA table_info(collections)")]
+    if columns and "deleted_chunks" not in columns:
+      cur.execute("ALTER TABLE collections ADD COLUMN deleted_chunks INTEGER DEFAULT 0")
+    if columns and "search_params" not in columns:
+      cur.execute("ALTER TABLE collections ADD COLUMN search_params TEXT DEFAULT '{}'")
+    if columns and "shards" not in columns:
+      cur.execute("ALTER TABLE collections ADD COLUMN shards TEXT")
+    if columns and "hnsw" not in columns:
+      cur.execute("ALTER TABLE collections ADD COLUMN hnsw TEXT DEFAULT '{}'")
+    # Copied once, recorded by the schema version; pdf_name itself is kept
+    if cur.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+      cur.execute("""SELECT name, pdf_name FROM collections
+                     WHERE pdf_name IS NOT NULL AND pdf_name != ''""")
+      for collection_name, pdf_name in cur.fetchall():
+        cur.executemany("""INSERT OR IGNORE INTO documents (collection, name, status)
+                           VALUES (?, ?, 'ready')""",
+                        [(collection_name, name) for name in json.loads(pdf_name)])
+      cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+  except sqlite3.OperationalError:
+    # No collections table yet (database not initialized)
+    conn.rollback()
 # Functions to manage config table
 
 def get_config_sqlite(variable_name: str) -> str:
@@ -142,40 +216,252 @@ def add_pdf_to_collection_sqlite(collection_name: str, pdf_name: str):
     """
     Adiciona um PDF à lista existente da collection.
     """
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
+    add_document_sqlite(collection_name, pdf_name)
 
-    # Busca a lista atual de PDFs
-    cur.execute("SELECT pdf_name FROM collections WHERE name = ?", (collection_name,))
-    row = cur.fetchone()
+#Functions to manage documents table
 
-    # Converte JSON → lista
-    pdf_list = json.loads(row[0]) if row[0] else []
+def add_document_sqlite(collection_name: str,
+                        pdf_name: str,
+                        file_hash: str = None,
+                        chunk_count: int = 0,
+                        status: str = "ready"):
+    """
+    Registra (ou atualiza) um documento da collection em uma única instrução.
+    """
+    conn = _connect()
+    try:
+        conn.execute("""
+        INSERT INTO documents (collection, name, file_hash, chunk_count, status)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (collection, name) DO UPDATE SET
+            file_hash = COALESCE(excluded.file_hash, file_hash),
+            chunk_count = excluded.chunk_count,
+            status = excluded.status,
+            ingested_at = CURRENT_TIMESTAMP
+        """, (collection_name, pdf_name, file_hash, chunk_count, status))
+        conn.commit()
+    except sqlite3.Error as e:
+        raise RuntimeError(f"Database error: {e}")
+    finally:
+        conn.close()
+
+
+def update_document_status_sqlite(collection_name: str, pdf_name: str, status: str):
+    """
+    Atualiza o status de um documento (ex.: 'processing', 'ready', 'failed').
+    """
+    conn = _connect()
+    try:
+        conn.execute("UPDATE documents SET status = ? WHERE collection = ? AND name = ?",
+                     (status, collection_name, pdf_name))
+        conn.commit()
+    except sqlite3.Error as e:
+        raise RuntimeError(f"Database error: {e}")
+    finally:
+        conn.close()
+
+
+def list_documents_sqlite(collection_name: str) -> list[dict]:
+    """
+    Retorna os documentos de uma collection, ordenados por nome.
+    """
+    conn = _connect()
+    try:
+        cur = conn.execute("""
+        SELECT name, file_hash, chunk_count, ingested_at, status
+        FROM documents WHERE collection = ? ORDER BY name
+        """, (collection_name,))
+        columns = [c[0] for c in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def document_exists_sqlite(collection_name: str, pdf_name: str) -> bool:
+    """
+    Verifica se um documento já faz parte da collection.
+    """
+    conn = _connect()
+    try:
+        cur = conn.execute("SELECT 1 FROM documents WHERE collection = ? AND name = ?",
+                           (collection_name, pdf_name))
+        return cur.fetchone() is not None
+    finally:
+        conn.close()
 
-    # Adiciona o novo PDF se ainda não existir
-    if pdf_name not in pdf_list:
-        pdf_list.append(pdf_name)
 
-    # Salva de volta no banco
-    cur.execute("""
-    UPDATE collections
-    SET pdf_name = ?
-    WHERE name = ?
-    """, (json.dumps(pdf_list), collection_name))
+def remove_document_sqlite(collection_name: str, pdf_name: str, chunk_count: int = 0):
+    """
+    Remove um documento da collection e contabiliza os chunks apagados,
+    usados para decidir quando compactar o índice.
+    """
+    conn = _connect()
+    try:
+        conn.execute("DELETE FROM documents WHERE collection = ? AND name = ?",
+                     (collection_name, pdf_name))
+        conn.execute("""UPDATE collections SET deleted_chunks = COALESCE(deleted_chunks, 0) + ?
+                        WHERE name = ?""", (chunk_count, collection_name))
+        conn.commit()
+    except sqlite3.Error as e:
+        raise RuntimeError(f"Database error: {e}")
+    finally:
+        conn.close()
+
+
+def get_deleted_chunks_sqlite(collection_name: str) -> int:
+    """
+    Retorna quantos chunks foram apagados desde a última compactação.
+    """
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT deleted_chunks FROM collections WHERE name = ?",
+                           (collection_name,)).fetchone()
+        return (row[0] or 0) if row else 0
+    finally:
+        conn.close()
 
-    conn.commit()
-    conn.close()
+
+def reset_deleted_chunks_sqlite(collection_name: str):
+    """
+    Zera o contador de chunks apagados após compactar a collection.
+    """
+    conn = _connect()
+    try:
+        conn.execute("UPDATE collections SET deleted_chunks = 0 WHERE name = ?",
+                     (collection_name,))
+        conn.commit()
+    finally:
+        conn.close()
 
 
+def find_document_by_hash_sqlite(collection_name: str, file_hash: str):
+    """
+    Retorna o nome do documento com esse hash na collection, ou None.
+    """
+    conn = _connect()
+    try:
+        cur = conn.execute("""
+        SELECT name FROM documents
+        WHERE collection = ? AND file_hash = ? AND status = 'ready'
+        LIMIT 1
+        """, (collection_name, file_hash))
+        row = cur.fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+
+def get_search_params_sqlite(collection_name: str) -> dict:
+    """
+    Retorna os parâmetros de busca da collection (ex.: limiares da cascata).
+    """
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT search_params FROM collections WHERE name = ?",
+                           (collection_name,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+    finally:
+        conn.close()
+
+
+def update_search_params_sqlite(collection_name: str, params: dict):
+    """
+    Atualiza (mescla) os parâmetros de busca da collection.
+    """
+    conn = _connect()
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        row = cur.execute("SELECT search_params FROM collections WHERE name = ?",
+                          (collection_name,)).fetchone()
+        if row is None:
+            raise ValueError(f"Collection '{collection_name}' not found.")
+        current = json.loads(row[0]) if row[0] else {}
+        current.update(params)
+        cur.execute("UPDATE collections SET search_params = ? WHERE name = ?",
+                    (json.dumps(current), collection_name))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_shards_sqlite(collection_name: str) -> dict:
+    """
+    Retorna a configuração de shards da collection ({'endpoints': [...],
+    'partition': ...}) ou None se ela não for particionada.
+    """
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT shards FROM collections WHERE name = ?",
+                           (collection_name,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+    finally:
+        conn.close()
+
+
+def update_shards_sqlite(collection_name: str, endpoints: list, partition: str = "source"):
+    """
+    Define os endpoints Chroma ("host:port") em que a collection é particionada.
+    Deve ser feito antes de criar a collection no Chroma; lista vazia desfaz.
+    """
+    shards = json.dumps({"endpoints": list(endpoints), "partition": partition}) if endpoints else None
+    conn = _connect()
+    try:
+        cur = conn.execute("UPDATE collections SET shards = ? WHERE name = ?",
+                           (shards, collection_name))
+        if cur.rowcount == 0:
+            raise ValueError(f"Collection '{collection_name}' not found.")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_hnsw_sqlite(collection_name: str) -> dict:
+    """
+    Retorna os parâmetros HNSW da collection no Chroma (ex.: max_neighbors,
+    ef_construction, ef_search); vazio usa os padrões do Chroma.
+    """
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT hnsw FROM collections WHERE name = ?",
+                           (collection_name,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+    finally:
+        conn.close()
+
+
+def update_hnsw_sqlite(collection_name: str, params: dict):
+    """
+    Atualiza (mescla) os parâmetros HNSW da collection. max_neighbors e
+    ef_construction só valem ao criar (ou reconstruir) a collection no Chroma.
+    """
+    conn = _connect()
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        row = cur.execute("SELECT hnsw FROM collections WHERE name = ?",
+                          (collection_name,)).fetchone()
+        if row is None:
+            raise ValueError(f"Collection '{collection_name}' not found.")
+        current = json.loads(row[0]) if row[0] else {}
+        current.update(params)
+        cur.execute("UPDATE collections SET hnsw = ? WHERE name = ?",
+                    (json.dumps(current), collection_name))
+        conn.commit()
+    finally:
+        conn.close()
+
 
 def delete_collection_sqlite(collection_name: str):
     """
     Remove a linha inteira da tabela 'collections' com o nome especificado.
     """
-    conn = sqlite3.connect(db_path)
+    conn = _connect()
     cur = conn.cursor()
 
     cur.execute("DELETE FROM collections WHERE name = ?", (collection_name,))
+    cur.execute("DELETE FROM documents WHERE collection = ?", (collection_name,))
     conn.commit()
     conn.close()
 
@@ -200,11 +486,11 @@ def get_collection_params_sqlite(collection_name: str):
     """
     Retorna os parâmetros e PDFs de uma collection específica.
     """
-    conn = sqlite3.connect(db_path)
+    conn = _connect()
     cur = conn.cursor()
 
     cur.execute("""
-    SELECT index_method, index_params, pdf_name
+    SELECT index_method, index_params
     FROM collections
     WHERE name = ?
     """, (collection_name,))
@@ -216,9 +502,163 @@ def get_collection_params_sqlite(collection_name: str):
         print(f"Collection '{collection_name}' não encontrada.")
         return None
 
-    index_method, index_params, pdf_name = row
+    index_method, index_params = row
     return {
         "index_method": index_method,
         "index_params": json.loads(index_params),
-        "pdfs": json.loads(pdf_name) if pdf_name else []
+        "pdfs": [d["name"] for d in list_documents_sqlite(collection_name)]
     }
+
+
+#Functions to manage jobs table
+
+def enqueue_job_sqlite(collection_name: str,
+                       file_name: str,
+                       file_path: str,
+                       max_attempts: int = 3) -> int:
+    """
+    Adiciona um job de ingestão à fila e retorna seu id.
+    """
+    conn = _connect()
+    try:
+        cur = conn.execute("""
+        INSERT INTO jobs (collection, file_name, file_path, max_attempts)
+        VALUES (?, ?, ?, ?)
+        """, (collection_name, file_name, file_path, max_attempts))
+        conn.commit()
+        return cur.lastrowid
+    except sqlite3.Error as e:
+        raise RuntimeError(f"Database error: {e}")
+    finally:
+        conn.close()
+
+
+def claim_job_sqlite(worker: str):
+    """
+    Reserva o próximo job disponível para um worker, ou retorna None.
+    Jobs 'running' cujo worker parou de dar sinal por JOB_LEASE_SECONDS voltam
+    a ser elegíveis enquanto houver tentativas; sem tentativas, ficam como
+    'failed'. Nunca dois jobs do mesmo arquivo rodam ao mesmo tempo.
+    """
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("""
+        UPDATE jobs SET status = 'failed', updated_at = CURRENT_TIMESTAMP,
+                        message = 'worker stopped responding, no attempts left'
+        WHERE status = 'running' AND updated_at <= datetime('now', ?)
+          AND attempts >= max_attempts
+        """, (f"-{JOB_LEASE_SECONDS} seconds",))
+        row = conn.execute("""
+        SELECT id FROM jobs AS j
+        WHERE ((j.status = 'queued' AND j.available_at <= CURRENT_TIMESTAMP)
+               OR (j.status = 'running' AND j.updated_at <= datetime('now', ?)))
+          AND NOT EXISTS (SELECT 1 FROM jobs AS r
+                          WHERE r.status = 'running' AND r.id != j.id
+                            AND r.collection = j.collection AND r.file_name = j.file_name
+                            AND r.updated_at > datetime('now', ?))
+        ORDER BY j.id LIMIT 1
+        """, (f"-{JOB_LEASE_SECONDS} seconds", f"-{JOB_LEASE_SECONDS} seconds")).fetchone()
+        if row is None:
+            conn.commit()
+            return None
+        conn.execute("""
+        UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?,
+                        progress = 0, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+        """, (worker, row[0]))
+        conn.commit()
+        return get_job_sqlite(row[0])
+    except sqlite3.Error as e:
+        conn.rollback()
+        raise RuntimeError(f"Database error: {e}")
+    finally:
+        conn.close()
+
+
+def update_job_progress_sqlite(job_id: int, progress: float, message: str = None):
+    """
+    Atualiza o progresso (0 a 1) de um job; também serve de sinal de vida do worker.
+    """
+    conn = _connect()
+    try:
+        conn.execute("""
+        UPDATE jobs SET progress = ?, message = COALESCE(?, message),
+                        updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+        """, (progress, message, job_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def complete_job_sqlite(job_id: int, message: str = None):
+    """
+    Marca um job como concluído.
+    """
+    conn = _connect()
+    try:
+        conn.execute("""
+        UPDATE jobs SET status = 'done', progress = 1, message = ?,
+                        updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+        """, (message, job_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def fail_job_sqlite(job_id: int, error: str, retry_delay: int = 30) -> bool:
+    """
+    Registra a falha de um job. Se ainda houver tentativas ele volta para a
+    fila com espera crescente; senão fica como 'failed'. Retorna True se
+    o job será tentado de novo.
+    """
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        attempts, max_attempts = conn.execute(
+            "SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        retry = attempts < max_attempts
+        conn.execute("""
+        UPDATE jobs SET status = ?, message = ?, updated_at = CURRENT_TIMESTAMP,
+                        available_at = datetime('now', ?)
+        WHERE id = ?
+        """, ("queued" if retry else "failed", error,
+              f"+{retry_delay * attempts} seconds", job_id))
+        conn.commit()
+        return retry
+    finally:
+        conn.close()
+
+
+def get_job_sqlite(job_id: int):
+    """
+    Retorna um job pelo id, ou None.
+    """
+    conn = _connect()
+    try:
+        cur = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return dict(zip([c[0] for c in cur.description], row))
+    finally:
+        conn.close()
+
+
+def list_jobs_sqlite(collection_name: str = None, limit: int = 50) -> list[dict]:
+    """
+    Retorna os jobs mais recentes, de uma collection ou de todas.
+    """
+    conn = _connect()
+    try:
+        if collection_name is None:
+            cur = conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+        else:
+            cur = conn.execute("""SELECT * FROM jobs WHERE collection = ?
+                                  ORDER BY id DESC LIMIT ?""", (collection_name, limit))
+        columns = [c[0] for c in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+    finally:
+        conn.close()
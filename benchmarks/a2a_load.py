@@ -0,0 +1,388 @@
+"""Load test of the A2A agent server: how many concurrent sessions it sustains.
+For each retrieval_function setting, builds the same app as
+backend/agente/root_agent.py (build_agent + build_a2a_app) on a throwaway
+config.db, an in-process Chroma loaded with the synthetic corpus and a stub
+OpenAI-compatible LLM server on loopback. The stub first calls the RAG tool
+with the user's question and then streams an answer word by word, with a
+configurable time to first token and per-word delay.
+
+Questions (synthetic, or replayed from a file) arrive as a Poisson process
+at each rate in --rates for --duration seconds, each one in a new session.
+Every rate reports throughput, latency percentiles and sessions in flight;
+the first rate whose throughput falls below 90% of the offered rate, whose
+p95 exceeds --slo-ms or whose error rate exceeds 1% is the saturation point.
+
+By default the app is served by uvicorn on 127.0.0.1, as in the container;
+--in-process calls it through httpx's ASGI transport instead, which buffers
+responses, so time to first event is then meaningless.
+
+Run from the repository root:
+  python -m benchmarks.a2a_load --strategies top_k hybrid --rates 1 2 4 8 16 --output a2a.json
+  python -m benchmarks.a2a_load --queries-file questions.txt --stream --stub-reranker
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.common import (bootstrap, latency_summary, percentile, environment, emit_json,
+                               StubLLM, StubReranker)
+from benchmarks.corpus import build_corpus, synthetic_queries
+from benchmarks.retrieval_bench import STRATEGY_PARAMS, ingest
+
+SUSTAINED_FRACTION = 0.9  # throughput / offered rate still counted as keeping up
+MAX_ERROR_RATE = 0.01
+
+def free_port() -> int:
+  with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    return s.getsockname()[1]
+
+def _text(content) -> str:
+  if isinstance(content, list):
+    return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+  return content or ""
+
+class StubChatServer():
+  """OpenAI-compatible /chat/completions endpoint for the agent's LiteLlm.
+  Args:
+    tool_arguments (dict): Arguments added to every RAG tool call, besides
+      the query; only those the tool declares are sent.
+    ttft (float): Seconds before the first chunk of every response.
+    token_delay (float): Seconds between streamed words.
+    answer_words (int): Length of the final answer.
+  """
+  def __init__(self, tool_arguments: dict, ttft: float = 0.2, token_delay: float = 0.01,
+               answer_words: int = 60):
+    self.tool_arguments = tool_arguments
+    self.ttft = ttft
+    self.token_delay = token_delay
+    self.answer_words = answer_words
+    self.calls = 0
+    self.server = None
+
+  def start(self) -> str:
+    """Serves in a background thread and returns the base URL."""
+    self.server = ThreadingHTTPServer(("127.0.0.1", free_port()), self._handler())
+    self.server.daemon_threads = True
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+  def stop(self):
+    if self.server is not None:
+      self.server.shutdown()
+      self.server.server_close()
+
+  def reply(self, body: dict) -> dict:
+    """The assistant message: a RAG tool call on the first turn, an answer
+    once the conversation holds the tool's result."""
+    self.calls += 1
+    messages = body.get("messages", [])
+    if any(m.get("role") == "tool" for m in messages):
+      words = [f"word{i}" for i in range(self.answer_words)]
+      return {"role": "assistant", "content": " ".join(words)}
+    question = next((_text(m.get("content")) for m in reversed(messages)
+                     if m.get("role") == "user"), "")
+    for tool in body.get("tools", []):
+      function = tool.get("function", {})
+      declared = (function.get("parameters") or {}).get("properties", {})
+      if "query" in declared:
+        arguments = {k: v for k, v in self.tool_arguments.items() if k in declared}
+        arguments["query"] = question
+        return {"role": "assistant", "content": None,
+                "tool_calls": [{"id": f"call_{uuid.uuid4().hex[:12]}", "type": "function",
+                                "function": {"name": function["name"],
+                                             "arguments": json.dumps(arguments)}}]}
+    return {"role": "assistant", "content": "No retrieval tool was offered."}
+
+  def _handler(self):
+    stub = self
+
+    class ChatHandler(BaseHTTPRequestHandler):
+      def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        message = stub.reply(body)
+        finish = "tool_calls" if message.get("tool_calls") else "stop"
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()),
+                "model": body.get("model", "stub")}
+        usage = {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+        time.sleep(stub.ttft)
+        if not body.get("stream"):
+          data = json.dumps(dict(base, object="chat.completion", usage=usage,
+                                 choices=[{"index": 0, "message": message,
+                                           "finish_reason": finish}])).encode("utf-8")
+          self.send_response(200)
+          self.send_header("Content-Type", "application/json")
+          self.send_header("Content-Length", str(len(data)))
+          self.end_headers()
+          self.wfile.write(data)
+          return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        def write(chunk: dict):
+          self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+          self.wfile.flush()
+        def send(delta: dict, finish_reason=None):
+          write(dict(base, object="chat.completion.chunk",
+                     choices=[{"index": 0, "delta": delta, "finish_reason": finish_reason}]))
+        if message.get("tool_calls"):
+          send({"role": "assistant",
+                "tool_calls": [dict(call, index=i) for i, call in enumerate(message["tool_calls"])]})
+        else:
+          for i, word in enumerate(message["content"].split(" ")):
+            send({"role": "assistant", "content": word if i == 0 else " " + word})
+            time.sleep(stub.token_delay)
+        send({}, finish)
+        write(dict(base, object="chat.completion.chunk", choices=[], usage=usage))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+      def log_message(self, format, *args):
+        pass
+
+    return ChatHandler
+
+class LoopbackServer():
+  """Runs an ASGI app with uvicorn on 127.0.0.1 in a background thread."""
+  def __init__(self, app):
+    import uvicorn
+    self.port = free_port()
+    self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port,
+                                                log_level="warning"))
+    self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+  def __enter__(self) -> str:
+    self.thread.start()
+    while not self.server.started:
+      if not self.thread.is_alive():
+        raise RuntimeError("The agent server did not start")
+      time.sleep(0.05)
+    return f"http://127.0.0.1:{self.port}"
+
+  def __exit__(self, *exc):
+    self.server.should_exit = True
+    self.thread.join()
+
+def build_app(strategy: str):
+  """The A2A app of backend/agente/root_agent.py for one retrieval_function."""
+  from a2a.types import AgentCard
+  from backend.utils import sqlite_functions as sq
+  from backend.utils.agent_menager import build_agent
+  from backend.utils.a2a_streaming import build_a2a_app
+  sq.update_config_sqlite("retrieval_function", strategy)
+  agent = build_agent()
+  agent_card = AgentCard(name=agent.name,
+    url="http://127.0.0.1/",
+    description="Load test agent",
+    version="1.0.0",
+    capabilities={"streaming": True},
+    skills=[],
+    defaultInputModes=["text/plain"],
+    defaultOutputModes=["text/plain"],
+    supportsAuthenticatedExtendedCard=False,
+  )
+  return build_a2a_app(agent, agent_card)
+
+async def send_message(client, query: str, stream: bool) -> dict:
+  """Sends one question in a new session and times it."""
+  payload = {"jsonrpc": "2.0", "id": str(uuid.uuid4()),
+             "method": "message/stream" if stream else "message/send",
+             "params": {"message": {"role": "user", "messageId": str(uuid.uuid4()),
+                                    "parts": [{"kind": "text", "text": query}]}}}
+  start = time.perf_counter()
+  first_event, state = None, None
+  try:
+    if stream:
+      async with client.stream("POST", "/", json=payload) as response:
+        async for line in response.aiter_lines():
+          if not line.startswith("data:"):
+            continue
+          first_event = first_event or time.perf_counter() - start
+          event = json.loads(line[5:])
+          if "error" in event:
+            state = "error"
+          elif event.get("result", {}).get("status"):
+            state = event["result"]["status"].get("state")
+    else:
+      response = await client.post("/", json=payload)
+      body = response.json()
+      state = "error" if "error" in body else body.get("result", {}).get("status", {}).get("state")
+      first_event = time.perf_counter() - start
+  except Exception as e:
+    state = f"error: {type(e).__name__}"
+  return {"seconds": time.perf_counter() - start, "first_event": first_event,
+          "ok": state == "completed", "state": state}
+
+async def run_rate(client, queries: list[str], rate: float, duration: float,
+                   stream: bool, rng: random.Random) -> dict:
+  """Offers questions at 'rate' per second (Poisson arrivals) for 'duration'
+  seconds and waits for every answer."""
+  loop = asyncio.get_running_loop()
+  in_flight, peak = 0, 0
+
+  async def one(query):
+    nonlocal in_flight, peak
+    in_flight += 1
+    peak = max(peak, in_flight)
+    try:
+      return await send_message(client, query, stream)
+    finally:
+      in_flight -= 1
+
+  tasks = []
+  start = loop.time()
+  arrival = start
+  while True:
+    arrival += rng.expovariate(rate)
+    if arrival - start > duration:
+      break
+    await asyncio.sleep(max(0.0, arrival - loop.time()))
+    tasks.append(asyncio.create_task(one(queries[len(tasks) % len(queries)])))
+  results = await asyncio.gather(*tasks)
+  elapsed = loop.time() - start
+
+  done = [r for r in results if r["ok"]]
+  seconds = [r["seconds"] for r in done]
+  throughput = len(done) / elapsed if elapsed else 0.0
+  latency = latency_summary(seconds)
+  latency["p99"] = round(percentile([s * 1000 for s in seconds], 99), 3)
+  return {
+    "target_rps": rate,
+    "offered_rps": round(len(results) / duration, 3),
+    "sent": len(results),
+    "completed": len(done),
+    "errors": len(results) - len(done),
+    "error_states": sorted({str(r["state"]) for r in results if not r["ok"]}),
+    "throughput_rps": round(throughput, 3),
+    "latency_ms": latency,
+    "first_event_ms": latency_summary([r["first_event"] for r in done if r["first_event"]]),
+    "peak_sessions": peak,
+    # Little's law: average sessions being served at once
+    "mean_sessions": round(throughput * (sum(seconds) / len(seconds) if seconds else 0.0), 2),
+  }
+
+def sustained(step: dict, slo_ms: float) -> bool:
+  """Whether the server kept up with the offered rate."""
+  return (step["sent"] > 0
+          and step["errors"] / step["sent"] <= MAX_ERROR_RATE
+          and step["throughput_rps"] >= SUSTAINED_FRACTION * step["offered_rps"]
+          and step["latency_ms"]["p95"] <= slo_ms)
+
+async def load_strategy(base_url: str, app, queries: list[str], args) -> dict:
+  """Steps through the rates for one app, stopping after the saturation point."""
+  import httpx
+  transport = httpx.ASGITransport(app=app) if app is not None else None
+  limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+  rng = random.Random(args.seed)
+  steps, saturation, best = [], None, None
+  async with httpx.AsyncClient(base_url=base_url, transport=transport, limits=limits,
+                               timeout=args.timeout) as client:
+    await send_message(client, queries[0], args.stream)  # warm-up: loads the models
+    for rate in sorted(args.rates):
+      step = await run_rate(client, queries, rate, args.duration, args.stream, rng)
+      steps.append(step)
+      print(f"    {rate:g}/s: {step['throughput_rps']}/s done, p95={step['latency_ms']['p95']}ms, "
+            f"errors={step['errors']}, sessions={step['mean_sessions']}")
+      if sustained(step, args.slo_ms):
+        best = step
+      elif saturation is None:
+        saturation = step
+        if not args.all_rates:
+          break
+  return {
+    "steps": steps,
+    "max_sustained_rps": best["target_rps"] if best else 0.0,
+    "sustained_sessions": best["mean_sessions"] if best else 0.0,
+    "saturation_rps": saturation["target_rps"] if saturation else None,
+  }
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                   formatter_class=argparse.RawDescriptionHelpFormatter,
+                                   epilog="\n".join(__doc__.splitlines()[1:]))
+  parser.add_argument("--strategies", nargs="+", default=["top_k", "hybrid", "sentence_window_retrieval"],
+                      choices=list(STRATEGY_PARAMS), help="retrieval_function settings to test")
+  parser.add_argument("--rates", type=float, nargs="+", default=[1, 2, 4, 8, 16, 32],
+                      help="offered questions per second")
+  parser.add_argument("--duration", type=float, default=20, help="seconds per rate")
+  parser.add_argument("--slo-ms", type=float, default=10000, help="p95 latency still acceptable")
+  parser.add_argument("--all-rates", action="store_true", help="keep going past saturation")
+  parser.add_argument("--stream", action="store_true", help="use message/stream instead of message/send")
+  parser.add_argument("--in-process", action="store_true", help="skip uvicorn, call the ASGI app directly")
+  parser.add_argument("--queries-file", help="questions to replay: lines, or JSON lines with 'query'")
+  parser.add_argument("--queries", type=int, default=200, help="synthetic questions in the mix")
+  parser.add_argument("--docs", type=int, default=4, help="PDFs in the corpus")
+  parser.add_argument("--pages", type=int, default=10, help="pages per PDF")
+  parser.add_argument("--llm-ttft-ms", type=float, default=200)
+  parser.add_argument("--llm-token-ms", type=float, default=10)
+  parser.add_argument("--answer-words", type=int, default=60)
+  parser.add_argument("--timeout", type=float, default=120, help="seconds per request")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--stub-reranker", action="store_true",
+                      help="score with word overlap instead of loading BGE")
+  parser.add_argument("--output", help="JSON file, defaults to stdout")
+  args = parser.parse_args()
+
+  work_dir = tempfile.mkdtemp(prefix="bench_a2a_")
+  # A throwaway config.db: the runs rewrite retrieval_function and openai_baseurl
+  os.environ["SQLITE_PATH"] = os.path.join(work_dir, "config.db")
+  bootstrap()
+  import chromadb
+  from backend.utils import sqlite_functions as sq
+  from backend.utils import metrics
+  from backend.utils import retrieval
+  from backend.utils.batch_retrieval import read_queries
+  from backend.utils.indexing import Splitter
+  from backend.utils.sharding import ShardedClient
+
+  collection_name = "bench_equal_chunks"
+  stub = StubChatServer({}, args.llm_ttft_ms / 1000, args.llm_token_ms / 1000, args.answer_words)
+  sq.update_config_sqlite("openai_baseurl", stub.start())
+  retrieval.client = ShardedClient(chromadb.EphemeralClient())
+  retrieval.llm = StubLLM()
+  if args.stub_reranker:
+    retrieval.reranker = StubReranker
+
+  paths = build_corpus(os.path.join(work_dir, "corpus"), args.docs, args.pages, args.seed)
+  collection = ingest(retrieval.client, Splitter(), "equal_chunks", paths)
+  print(f"[corpus] {collection['chunks']} chunks in {collection['ingest_seconds']}s")
+  if args.queries_file:
+    queries = list(read_queries(args.queries_file))
+  else:
+    queries = synthetic_queries(args.queries, args.docs, args.pages, args.seed)
+  random.Random(args.seed).shuffle(queries)
+
+  report = {"benchmark": "a2a_load",
+            "environment": environment(),
+            "config": vars(args),
+            "results": []}
+  try:
+    for strategy in args.strategies:
+      print(f"[{strategy}]")
+      stub.tool_arguments = {"collection_name": collection_name, **STRATEGY_PARAMS[strategy]}
+      app = build_app(strategy)
+      if args.in_process:
+        result = asyncio.run(load_strategy("http://agent", app, queries, args))
+      else:
+        with LoopbackServer(app) as base_url:
+          result = asyncio.run(load_strategy(base_url, None, queries, args))
+      result["strategy"] = strategy
+      report["results"].append(result)
+      print(f"  sustained {result['max_sustained_rps']}/s with "
+            f"{result['sustained_sessions']} sessions in flight")
+  finally:
+    stub.stop()
+  report["llm_calls"] = stub.calls
+  report["metrics"] = metrics.snapshot()
+  emit_json(report, args.output)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,166 @@
+"""Shared helpers for the benchmark scripts.
+Call bootstrap() before importing anything from backend.utils.retrieval, so the
+module can be imported without a running Chroma server.
+"""
+import json
+import os
+import platform
+import re
+import resource
+import sys
+import tempfile
+import time
+
+def bootstrap():
+  """Prepares the environment the backend modules expect at import time."""
+  os.environ.setdefault("CHROMA_HOST", "localhost")
+  os.environ.setdefault("CHROMA_PORT", "8000")
+  os.environ.setdefault("LEXICAL_INDEX_DIR", tempfile.mkdtemp(prefix="bench_lexical_"))
+  # A throwaway config.db unless SQLITE_PATH points at one
+  os.environ.setdefault("SQLITE_PATH", os.path.join(tempfile.mkdtemp(prefix="bench_config_"), "config.db"))
+  from backend.utils import sqlite_functions as sq
+  if not os.path.exists(sq.db_path):
+    import initial_config  # noqa: F401  creates and seeds config.db
+
+def percentile(values: list[float], p: float) -> float:
+  """Nearest-rank percentile, p in [0, 100]."""
+  if not values:
+    return 0.0
+  ordered = sorted(values)
+  index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered))) - 1))
+  return ordered[index]
+
+def latency_summary(seconds: list[float]) -> dict:
+  """p50/p95/mean of a list of durations, in milliseconds."""
+  ms = [s * 1000 for s in seconds]
+  return {
+    "p50": round(percentile(ms, 50), 3),
+    "p95": round(percentile(ms, 95), 3),
+    "mean": round(sum(ms) / len(ms), 3) if ms else 0.0,
+  }
+
+def rss_mb() -> float:
+  """Current resident set size of this process in MiB."""
+  try:
+    with open("/proc/self/statm") as f:
+      pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+  except (OSError, ValueError):
+    return peak_rss_mb()
+
+def peak_rss_mb() -> float:
+  """Peak resident set size of this process in MiB."""
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # Linux reports KiB, macOS reports bytes
+  return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+def environment() -> dict:
+  """Describes the machine so results can be compared across releases."""
+  return {
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "cpus": os.cpu_count(),
+    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+  }
+
+def emit_json(report: dict, output: str | None):
+  """Writes the report to a file, or to stdout when no file is given."""
+  text = json.dumps(report, indent=2)
+  if output:
+    with open(output, "w") as f:
+      f.write(text)
+    print(f"Results written to {output}")
+  else:
+    print(text)
+
+class CountingCollection():
+  """Wraps a Chroma collection and counts the calls made to it."""
+  def __init__(self, collection, counter: dict):
+    self._collection = collection
+    self._counter = counter
+
+  def __getattr__(self, name):
+    attr = getattr(self._collection, name)
+    if not callable(attr):
+      return attr
+    def counted(*args, **kwargs):
+      self._counter[name] = self._counter.get(name, 0) + 1
+      return attr(*args, **kwargs)
+    return counted
+
+class CountingClient():
+  """Wraps a Chroma client so every round-trip is counted in self.calls."""
+  def __init__(self, client):
+    self._client = client
+    self.calls = {}
+
+  def total(self) -> int:
+    return sum(self.calls.values())
+
+  def reset(self):
+    self.calls.clear()
+
+  def __getattr__(self, name):
+    attr = getattr(self._client, name)
+    if not callable(attr):
+      return attr
+    def counted(*args, **kwargs):
+      self.calls[name] = self.calls.get(name, 0) + 1
+      result = attr(*args, **kwargs)
+      if name in ("get_collection", "create_collection", "get_or_create_collection"):
+        return CountingCollection(result, self.calls)
+      return result
+    return counted
+
+class StubMessage():
+  def __init__(self, content: str):
+    self.content = content
+
+class StubLLM():
+  """Deterministic replacement for ChatOpenAI used by the multi-query strategies.
+  It answers the rewrite prompt with the schema it asks for, without network.
+  """
+  def __init__(self, delay: float = 0.0):
+    self.delay = delay
+    self.calls = 0
+
+  def invoke(self, messages):
+    self.calls += 1
+    if self.delay:
+      time.sleep(self.delay)
+    system, human = messages[0].content, messages[-1].content
+    keys = re.findall(r"'(question_\d+)'", system)
+    query = human.split("The question is:", 1)[-1].strip()
+    prefixes = ["", "How to handle: ", "Explain ", "Steps when ", "Fix for "]
+    rewrite = {key: f"{prefixes[i % len(prefixes)]}{query}" for i, key in enumerate(keys)}
+    return StubMessage(repr(rewrite))
+
+class StubReranker():
+  """Word-overlap scorer with the FlagReranker.compute_score interface.
+  Used with --stub-reranker to run fully offline without the BGE weights.
+  """
+  def compute_score(self, pairs):
+    scores = []
+    for query, document in pairs:
+      q = set(re.findall(r"\w+", query.lower()))
+      d = set(re.findall(r"\w+", document.lower()))
+      scores.append(len(q & d) / (len(q) or 1))
+    return scores
+
+class StageTimer():
+  """Accumulates wall time spent inside wrapped functions, per stage."""
+  def __init__(self):
+    self.seconds = {}
+    self.calls = {}
+
+  def wrap(self, stage: str, function):
+    self.seconds.setdefault(stage, 0.0)
+    self.calls.setdefault(stage, 0)
+    def timed(*args, **kwargs):
+      start = time.perf_counter()
+      try:
+        return function(*args, **kwargs)
+      finally:
+        self.seconds[stage] += time.perf_counter() - start
+        self.calls[stage] += 1
+    return timed
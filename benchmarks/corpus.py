@@ -0,0 +1,129 @@
+"""Deterministic synthetic corpus used by the benchmarks.
+Generates technical-manual-like text (with part numbers and error codes) and
+writes it to plain PDFs that PyPDF2 can extract, so no fixtures are needed.
+"""
+import os
+import random
+import re
+
+TOPICS = {
+  "pump": ["impeller", "seal", "motor", "valve", "bearing", "pressure sensor"],
+  "network": ["router", "switch", "firewall", "gateway", "access point", "uplink"],
+  "storage": ["disk", "controller", "array", "cache", "volume", "backplane"],
+  "power": ["breaker", "inverter", "battery", "rectifier", "fuse", "busbar"],
+}
+ACTIONS = ["reports", "raises", "logs", "displays", "triggers"]
+EFFECTS = ["overheats", "loses sync", "stops responding", "drops packets",
+           "exceeds its rated load", "fails the self test"]
+FIXES = ["replace the", "recalibrate the", "reset the", "inspect the",
+         "tighten the", "update the firmware of the"]
+SENTENCE_RE = re.compile(rf"^The (\w+) (.+?) (?:{'|'.join(ACTIONS)}) error code (E\d+)")
+
+def _code(rng: random.Random) -> str:
+  return f"E{rng.randint(1000, 9999)}"
+
+def _part(rng: random.Random) -> str:
+  return f"PN-{rng.randint(100, 999)}-{rng.choice('ABCDEFGH')}{rng.randint(10, 99)}"
+
+def synthetic_pages(n_pages: int,
+                    seed: int = 0,
+                    sentences_per_page: int = 24) -> list[list[str]]:
+  """Generates pages of sentences, grouped in topical sections.
+  Args:
+    n_pages (int): Number of pages to generate.
+    seed (int): Seed that makes the text reproducible.
+    sentences_per_page (int): Sentences written on each page.
+  Returns:
+    list[list[str]]: The sentences of each page.
+  """
+  rng = random.Random(seed)
+  pages = []
+  topic = rng.choice(list(TOPICS))
+  for _ in range(n_pages):
+    page = []
+    for _ in range(sentences_per_page):
+      if rng.random() < 0.1:
+        topic = rng.choice(list(TOPICS))
+      component = rng.choice(TOPICS[topic])
+      page.append(
+        f"The {topic} {component} {rng.choice(ACTIONS)} error code "
+        f"{_code(rng)} when it {rng.choice(EFFECTS)}. To solve it "
+        f"{rng.choice(FIXES)} {component} with part number {_part(rng)}."
+      )
+    pages.append(page)
+  return pages
+
+def _escape(text: str) -> str:
+  return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def _wrap(sentences: list[str], width: int = 95) -> list[str]:
+  lines, line = [], ""
+  for word in " ".join(sentences).split(" "):
+    if line and len(line) + len(word) + 1 > width:
+      lines.append(line)
+      line = word
+    else:
+      line = f"{line} {word}" if line else word
+  if line:
+    lines.append(line)
+  return lines
+
+def write_pdf(file_path: str, pages: list[list[str]]) -> str:
+  """Writes a minimal text-only PDF with one page per sentence list."""
+  objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+             b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+  kids = []
+  for page in pages:
+    lines = _wrap(page)
+    stream = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(
+      f"({_escape(line)}) Tj T*" for line in lines) + " ET"
+    stream = stream.encode("latin-1", "replace")
+    objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+    content_id = len(objects)
+    objects.append(("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                    f"/Resources << /Font << /F1 3 0 R >> >> "
+                    f"/Contents {content_id} 0 R >>").encode())
+    kids.append(f"{len(objects)} 0 R")
+  objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+  out = bytearray(b"%PDF-1.4\n")
+  offsets = []
+  for i, obj in enumerate(objects, start=1):
+    offsets.append(len(out))
+    out += b"%d 0 obj\n%s\nendobj\n" % (i, obj)
+  xref = len(out)
+  out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+  for offset in offsets:
+    out += b"%010d 00000 n \n" % offset
+  out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+    len(objects) + 1, xref)
+  with open(file_path, "wb") as f:
+    f.write(out)
+  return file_path
+
+def build_corpus(out_dir: str,
+                 n_docs: int = 4,
+                 pages_per_doc: int = 10,
+                 seed: int = 0) -> list[str]:
+  """Writes n_docs synthetic PDFs into out_dir and returns their paths."""
+  os.makedirs(out_dir, exist_ok=True)
+  paths = []
+  for d in range(n_docs):
+    pages = synthetic_pages(pages_per_doc, seed=seed + d)
+    paths.append(write_pdf(os.path.join(out_dir, f"manual_{d}.pdf"), pages))
+  return paths
+
+def synthetic_queries(n_queries: int,
+                      n_docs: int = 4,
+                      pages_per_doc: int = 10,
+                      seed: int = 0) -> list[str]:
+  """Builds questions about sentences that exist in the generated corpus."""
+  rng = random.Random(seed + 7919)
+  docs = [synthetic_pages(pages_per_doc, seed=seed + d) for d in range(n_docs)]
+  queries = []
+  for _ in range(n_queries):
+    sentence = rng.choice(rng.choice(rng.choice(docs)))
+    match = SENTENCE_RE.match(sentence)
+    queries.append(f"What should I do when the {match.group(2)} "
+                   f"reports error code {match.group(3)}?")
+  return queries
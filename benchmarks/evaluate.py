@@ -0,0 +1,215 @@
+"""Retrieval quality-vs-latency evaluation harness.
+Runs each Retriever strategy over a grid of parameters against a labeled set of
+questions and relevant chunk ids, computing recall@k, MRR, latency and tokens
+returned (counted with the configured model's tokenizer), and prints the Pareto frontier so the cheapest configuration meeting
+a quality bar can be written to 'retrieval_function' in config.db.
+
+Everything runs offline: a local Chroma (persistent path or in-process
+synthetic corpus) and the deterministic LLM stub used by the benchmarks.
+
+Labels are a JSON list of objects with a "query" and either "relevant_ids"
+(chunk ids in the collection) or "relevant_texts" (substrings of the chunks).
+
+Run from the repository root:
+  python -m benchmarks.evaluate --chroma-path ./chroma-data --collection manuals \\
+    --labels labels.json --min-recall 0.8
+  python -m benchmarks.evaluate --synthetic --stub-reranker
+"""
+import argparse
+import itertools
+import json
+import tempfile
+import time
+
+from benchmarks.common import (bootstrap, latency_summary, environment, emit_json,
+                               StubLLM, StubReranker)
+from benchmarks.corpus import build_corpus, synthetic_queries
+
+DEFAULT_GRID = {
+  "top_k": {"k": [3, 5, 10]},
+  "top_k_reranker": {"high_k": [10, 20, 40]},
+  "top_k_cascade": {"k": [5], "high_k": [10, 20, 40]},
+  "multi_query": {"n_results": [3, 5], "n_queries": [2, 3, 5]},
+  "multi_query_reranker": {"n_results": [3, 5], "n_queries": [2, 3, 5]},
+  "sentence_window_retrieval": {"n_main": [1, 2, 3], "n_around": [1, 2, 3]},
+  "sentence_window_retriever_reranker": {"n_main": [1, 3], "n_around": [2, 4]},
+  "hybrid": {"k": [3, 5, 10], "n_candidates": [10, 20]},
+  "hybrid_reranker": {"high_k": [4, 8, 12]},
+  "mmr": {"k": [3, 5, 10], "fetch_k": [20, 50], "lambda_mult": [0.3, 0.5, 0.7]},
+  "adaptive": {"latency_budget_ms": [100, 500, 2000]},
+}
+
+def expand_grid(grid: dict) -> list[tuple[str, dict]]:
+  """Turns {strategy: {param: [values]}} into (strategy, params) pairs."""
+  configs = []
+  for strategy, params in grid.items():
+    names = list(params)
+    for values in itertools.product(*(params[name] for name in names)):
+      configs.append((strategy, dict(zip(names, values))))
+  return configs
+
+def resolve_labels(raw: list[dict], collection) -> list[dict]:
+  """Maps every label to the set of relevant chunk ids in the collection."""
+  needs_texts = any("relevant_texts" in label for label in raw)
+  stored = collection.get(include=["documents"]) if needs_texts else None
+  labels = []
+  for label in raw:
+    relevant = set(label.get("relevant_ids", []))
+    for text in label.get("relevant_texts", []):
+      relevant.update(i for i, doc in zip(stored["ids"], stored["documents"])
+                      if text in doc)
+    if relevant:
+      labels.append({"query": label["query"], "relevant": relevant})
+  return labels
+
+def synthetic_labels(collection, queries: list[str]) -> list[dict]:
+  """Labels each synthetic question with the chunks quoting its error code."""
+  raw = [{"query": q, "relevant_texts": [q.rsplit(" ", 1)[-1].rstrip("?")]}
+         for q in queries]
+  return resolve_labels(raw, collection)
+
+def evaluate_config(retriever, strategy: str, params: dict, collection_name: str,
+                    labels: list[dict], eval_k: int) -> dict:
+  """Runs one (strategy, params) configuration over every label."""
+  function = getattr(retriever, strategy)
+  recalls, recalls_all, reciprocal_ranks, latencies, tokens = [], [], [], [], []
+  kept_ratios = []
+  for label in labels:
+    start = time.perf_counter()
+    result = function(query=label["query"], collection_name=collection_name, **params)
+    latencies.append(time.perf_counter() - start)
+    ranked = list(dict.fromkeys(result["ids"]))
+    relevant = label["relevant"]
+    recalls.append(len(relevant.intersection(ranked[:eval_k])) / len(relevant))
+    recalls_all.append(len(relevant.intersection(ranked)) / len(relevant))
+    rank = next((r for r, i in enumerate(ranked, start=1) if i in relevant), None)
+    reciprocal_ranks.append(1 / rank if rank else 0.0)
+    tokens.append(result["tokens"]["returned"])
+    if "compression" in result:
+      kept_ratios.append(result["compression"]["ratio"])
+  n = len(labels)
+  return {
+    "strategy": strategy,
+    "parameters": params,
+    f"recall@{eval_k}": round(sum(recalls) / n, 4),
+    "recall_all": round(sum(recalls_all) / n, 4),
+    "mrr": round(sum(reciprocal_ranks) / n, 4),
+    "latency_ms": latency_summary(latencies),
+    "tokens_returned": round(sum(tokens) / n, 1),
+    "sentences_kept": round(sum(kept_ratios) / n, 4) if kept_ratios else None,
+  }
+
+def pareto_frontier(rows: list[dict], recall_key: str) -> list[dict]:
+  """Configurations no other one beats on recall, latency and tokens at once."""
+  def dominates(a, b):
+    better_or_equal = (a[recall_key] >= b[recall_key]
+                       and a["latency_ms"]["p50"] <= b["latency_ms"]["p50"]
+                       and a["tokens_returned"] <= b["tokens_returned"])
+    strictly = (a[recall_key] > b[recall_key]
+                or a["latency_ms"]["p50"] < b["latency_ms"]["p50"]
+                or a["tokens_returned"] < b["tokens_returned"])
+    return better_or_equal and strictly
+  frontier = [row for row in rows if not any(dominates(other, row) for other in rows)]
+  return sorted(frontier, key=lambda row: row["latency_ms"]["p50"])
+
+def print_table(rows: list[dict], recall_key: str):
+  print(f"{'strategy':36} {'parameters':34} {recall_key:>9} {'mrr':>6} "
+        f"{'p50 ms':>9} {'tokens':>8}")
+  for row in rows:
+    params = ", ".join(f"{k}={v}" for k, v in row["parameters"].items())
+    print(f"{row['strategy']:36} {params:34} {row[recall_key]:>9.3f} "
+          f"{row['mrr']:>6.3f} {row['latency_ms']['p50']:>9.1f} "
+          f"{row['tokens_returned']:>8.0f}")
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                   formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--chroma-path", help="directory of a persistent local Chroma")
+  parser.add_argument("--collection", help="collection to evaluate")
+  parser.add_argument("--labels", help="JSON file with the labeled questions")
+  parser.add_argument("--synthetic", action="store_true",
+                      help="build and label a synthetic corpus in memory")
+  parser.add_argument("--splitter", default="equal_chunks",
+                      help="Splitter method used for the synthetic corpus")
+  parser.add_argument("--queries", type=int, default=40)
+  parser.add_argument("--grid", help="JSON file overriding the parameter grid")
+  parser.add_argument("--strategies", nargs="+", help="restrict the grid")
+  parser.add_argument("--eval-k", type=int, default=5)
+  parser.add_argument("--max-tokens", type=int, default=0,
+                      help="context token budget applied to every result, 0 for none")
+  parser.add_argument("--compress", type=float, default=0.0,
+                      help="sentence similarity threshold for compression, 0 for none")
+  parser.add_argument("--min-recall", type=float,
+                      help="print the cheapest configuration meeting this recall@k")
+  parser.add_argument("--stub-reranker", action="store_true",
+                      help="score with word overlap instead of loading BGE")
+  parser.add_argument("--output", help="JSON file for the full results")
+  args = parser.parse_args()
+  if not args.synthetic and not (args.chroma_path and args.collection and args.labels):
+    parser.error("use --synthetic or give --chroma-path, --collection and --labels")
+
+  bootstrap()
+  import chromadb
+  from backend.utils.retrieval import Retriever
+
+  grid = DEFAULT_GRID
+  if args.grid:
+    with open(args.grid) as f:
+      grid = json.load(f)
+  if args.strategies:
+    grid = {s: grid[s] for s in args.strategies}
+
+  if args.synthetic:
+    from backend.utils import chroma_functions as cf
+    from backend.utils.indexing import Splitter
+    client = chromadb.EphemeralClient()
+    collection_name = "eval_synthetic"
+    collection = cf.create_collection(client, collection_name)
+    with tempfile.TemporaryDirectory() as corpus_dir:
+      for path in build_corpus(corpus_dir):
+        documents = getattr(Splitter(), args.splitter)(path)
+        cf.add_documents(collection, documents, path.rsplit("/", 1)[-1])
+    labels = synthetic_labels(collection, synthetic_queries(args.queries))
+  else:
+    client = chromadb.PersistentClient(path=args.chroma_path)
+    collection_name = args.collection
+    with open(args.labels) as f:
+      labels = resolve_labels(json.load(f), client.get_collection(collection_name))
+  if not labels:
+    raise SystemExit("No label matched a chunk of the collection.")
+
+  retriever = Retriever(client=client, llm=StubLLM(), max_tokens=args.max_tokens,
+                        compress_threshold=args.compress)
+  if args.stub_reranker:
+    retriever.re_ranker = StubReranker()
+
+  recall_key = f"recall@{args.eval_k}"
+  rows = []
+  for strategy, params in expand_grid(grid):
+    rows.append(evaluate_config(retriever, strategy, params, collection_name,
+                                labels, args.eval_k))
+  frontier = pareto_frontier(rows, recall_key)
+
+  print(f"\nAll configurations ({len(labels)} labeled questions):")
+  print_table(rows, recall_key)
+  print("\nPareto frontier (recall vs latency vs tokens):")
+  print_table(frontier, recall_key)
+  choice = None
+  if args.min_recall is not None:
+    meeting = [row for row in frontier if row[recall_key] >= args.min_recall]
+    if meeting:
+      choice = min(meeting, key=lambda row: (row["latency_ms"]["p50"], row["tokens_returned"]))
+      print(f"\nCheapest configuration with {recall_key} >= {args.min_recall}:")
+      print_table([choice], recall_key)
+    else:
+      print(f"\nNo configuration reaches {recall_key} >= {args.min_recall}.")
+  if args.output:
+    emit_json({"benchmark": "evaluation",
+               "environment": environment(),
+               "config": vars(args),
+               "results": rows,
+               "frontier": frontier,
+               "choice": choice}, args.output)
+
+if __name__ == "__main__":
+  main()
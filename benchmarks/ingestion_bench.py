@@ -0,0 +1,119 @@
+"""Benchmarks ingestion throughput of every Splitter method.
+Generates synthetic PDFs of increasing size and, for each (method, size), runs
+extraction, chunking and add_documents into an in-process Chroma in a fresh
+process, reporting pages/s, sentences/s, chunks/s, peak RSS and the time split
+between extraction, sentence splitting, embedding, chunking and add_documents.
+With --streaming, chunks go through Splitter.iter_chunks and stream_documents
+instead, and the time until the first batch reaches Chroma is reported.
+
+Run from the repository root:
+  python -m benchmarks.ingestion_bench --sizes 10 100 500 2000 --output ingestion.json
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmarks.common import (bootstrap, peak_rss_mb, environment, emit_json,
+                               StageTimer)
+from benchmarks.corpus import synthetic_pages, write_pdf
+
+SPLITTERS = ["equal_chunks", "unstructured_chunks", "simple_decision", "changing_decision"]
+
+def run_case(method: str, pdf_path: str, pages: int, sentences: int,
+             streaming: bool = False) -> dict:
+  """Ingests one PDF with one method; runs inside a dedicated process."""
+  bootstrap()
+  import chromadb
+  from backend.utils import indexing
+  from backend.utils import chroma_functions as cf
+
+  timer = StageTimer()
+  produced = {"sentences": 0}
+  split_sentences = indexing.split_sentences_with_nltk
+  def counted_split(text):
+    result = split_sentences(text)
+    produced["sentences"] += len(result)
+    return result
+  indexing.extract_page_text = timer.wrap("extraction", indexing.extract_page_text)
+  # unstructured partitions and chunks by title in a single call
+  indexing.partition_pdf = timer.wrap("extraction", indexing.partition_pdf)
+  indexing.split_sentences_with_nltk = timer.wrap("sentence_splitting", counted_split)
+  indexing.model.encode = timer.wrap("embedding", indexing.model.encode)
+
+  client = chromadb.EphemeralClient()
+  collection = cf.create_collection(client, f"ingest_{method}")
+  # Warm up the embedding function so model loading is not billed to the run
+  collection.add(ids=["warmup"], documents=["warm up"])
+  collection.delete(ids=["warmup"])
+  baseline_rss = peak_rss_mb()
+
+  first_write = []
+  add_batches = cf._add_batches
+  def timed_add_batches(*args, **kwargs):
+    first_write.append(time.perf_counter())
+    return add_batches(*args, **kwargs)
+  cf._add_batches = timer.wrap("add_documents", timed_add_batches)
+
+  start = time.perf_counter()
+  if streaming:
+    chunks = indexing.Splitter().iter_chunks(method, pdf_path)
+    n_chunks = cf.stream_documents(collection, chunks, os.path.basename(pdf_path))
+  else:
+    documents = getattr(indexing.Splitter(), method)(pdf_path)
+    n_chunks = len(documents)
+    cf.add_documents(collection, documents, os.path.basename(pdf_path))
+  total = time.perf_counter() - start
+
+  stages = {stage: round(seconds, 3) for stage, seconds in timer.seconds.items()}
+  stages["chunking"] = round(max(0.0, total - sum(timer.seconds.values())), 3)
+  return {
+    "method": method,
+    "streaming": streaming,
+    "pages": pages,
+    "chunks": n_chunks,
+    "first_write_seconds": round(first_write[0] - start, 3) if first_write else None,
+    "seconds": round(total, 3),
+    "pages_per_s": round(pages / total, 2),
+    "sentences_per_s": round(sentences / total, 2),
+    "chunks_per_s": round(n_chunks / total, 2),
+    "sentences_split_by_method": produced["sentences"],
+    "stage_seconds": stages,
+    "peak_rss_mb": round(peak_rss_mb(), 1),
+    "baseline_rss_mb": round(baseline_rss, 1),
+  }
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--methods", nargs="+", default=SPLITTERS, choices=SPLITTERS)
+  parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 500, 2000],
+                      help="pages per generated PDF")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--streaming", action="store_true",
+                      help="split and write chunks incrementally")
+  parser.add_argument("--output", help="JSON file, defaults to stdout")
+  args = parser.parse_args()
+
+  bootstrap()
+  report = {"benchmark": "ingestion",
+            "environment": environment(),
+            "config": vars(args),
+            "results": []}
+  context = multiprocessing.get_context("spawn")
+  with tempfile.TemporaryDirectory() as corpus_dir:
+    for size in args.sizes:
+      pages = synthetic_pages(size, seed=args.seed)
+      sentences = sum(len(page) * 2 for page in pages)  # each entry holds two sentences
+      pdf_path = write_pdf(os.path.join(corpus_dir, f"manual_{size}p.pdf"), pages)
+      for method in args.methods:
+        with context.Pool(1, maxtasksperchild=1) as pool:
+          result = pool.apply(run_case, (method, pdf_path, size, sentences,
+                                           args.streaming))
+        report["results"].append(result)
+        print(f"[{method}] {size} pages: {result['pages_per_s']} pages/s, "
+              f"{result['chunks_per_s']} chunks/s, peak {result['peak_rss_mb']} MiB")
+  emit_json(report, args.output)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,99 @@
+"""Benchmarks the MMR selection used by Retriever.mmr.
+Times mmr_select on random embeddings with clusters of near-duplicates (like
+repeated headers and overlapping chunks) against a straightforward version
+that recomputes pairwise similarities, and reports how much redundancy MMR
+removes compared with plain top-k.
+
+Run from the repository root:
+  python -m benchmarks.mmr_bench --candidates 20 100 500 --output mmr.json
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.common import bootstrap, latency_summary, environment, emit_json
+
+def clustered_embeddings(n: int, dim: int, duplicates: int, rng) -> np.ndarray:
+  """Candidates in groups of near-identical vectors."""
+  centers = rng.standard_normal((max(1, n // duplicates), dim)).astype(np.float32)
+  vectors = np.repeat(centers, duplicates, axis=0)[:n]
+  vectors += 0.05 * rng.standard_normal(vectors.shape).astype(np.float32)
+  return vectors
+
+def naive_mmr(query, embeddings, k: int, lambda_mult: float) -> list[int]:
+  """Reference MMR that scores every pair again at each step."""
+  cosine = lambda a, b: float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+  selected, candidates = [], list(range(len(embeddings)))
+  while candidates and len(selected) < k:
+    best, best_score = None, -np.inf
+    for i in candidates:
+      redundancy = max((cosine(embeddings[i], embeddings[j]) for j in selected), default=0.0)
+      score = lambda_mult * cosine(query, embeddings[i]) - (1 - lambda_mult) * redundancy
+      if score > best_score:
+        best, best_score = i, score
+    selected.append(best)
+    candidates.remove(best)
+  return selected
+
+def mean_pairwise_similarity(vectors: np.ndarray) -> float:
+  normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+  similarity = normalized @ normalized.T
+  n = len(vectors)
+  return float((similarity.sum() - n) / max(n * (n - 1), 1))
+
+def time_calls(function, repeats: int) -> list[float]:
+  durations = []
+  for _ in range(repeats):
+    start = time.perf_counter()
+    function()
+    durations.append(time.perf_counter() - start)
+  return durations
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--candidates", type=int, nargs="+", default=[20, 100, 500])
+  parser.add_argument("--k", type=int, default=5)
+  parser.add_argument("--dim", type=int, default=384, help="all-MiniLM-L6-v2 size")
+  parser.add_argument("--duplicates", type=int, default=4, help="near-duplicates per cluster")
+  parser.add_argument("--lambda-mult", type=float, default=0.5)
+  parser.add_argument("--repeats", type=int, default=1000)
+  parser.add_argument("--naive-repeats", type=int, default=20)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--output", help="JSON file, defaults to stdout")
+  args = parser.parse_args()
+
+  bootstrap()
+  from backend.utils.retrieval import mmr_select
+
+  rng = np.random.default_rng(args.seed)
+  report = {"benchmark": "mmr",
+            "environment": environment(),
+            "config": vars(args),
+            "results": []}
+  for n in args.candidates:
+    embeddings = clustered_embeddings(n, args.dim, args.duplicates, rng)
+    query = embeddings[0] + 0.5 * rng.standard_normal(args.dim).astype(np.float32)
+    select = lambda: mmr_select(query, embeddings, args.k, args.lambda_mult)
+    selected = select()
+    assert selected == naive_mmr(query, embeddings, args.k, args.lambda_mult)
+
+    relevance = embeddings @ query / np.linalg.norm(embeddings, axis=1)
+    top_k = np.argsort(-relevance)[:args.k]
+    result = {
+      "candidates": n,
+      "latency_ms": latency_summary(time_calls(select, args.repeats)),
+      "naive_latency_ms": latency_summary(
+        time_calls(lambda: naive_mmr(query, embeddings, args.k, args.lambda_mult),
+                   args.naive_repeats)),
+      "redundancy_top_k": round(mean_pairwise_similarity(embeddings[top_k]), 4),
+      "redundancy_mmr": round(mean_pairwise_similarity(embeddings[selected]), 4),
+    }
+    report["results"].append(result)
+    print(f"{n} candidates: p50={result['latency_ms']['p50']}ms "
+          f"(naive {result['naive_latency_ms']['p50']}ms), redundancy "
+          f"{result['redundancy_top_k']} -> {result['redundancy_mmr']}")
+  emit_json(report, args.output)
+
+if __name__ == "__main__":
+  main()
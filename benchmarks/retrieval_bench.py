@@ -0,0 +1,152 @@
+"""Benchmarks the Retriever strategies against each other.
+Builds a synthetic PDF corpus through each Splitter method into an in-process
+Chroma, replaces ChatOpenAI with a deterministic stub and reports latency,
+throughput per concurrency level, Chroma round-trips and memory per strategy.
+
+Run from the repository root:
+  python -m benchmarks.retrieval_bench --output retrieval.json
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import (bootstrap, latency_summary, rss_mb, environment,
+                               emit_json, CountingClient, StubLLM, StubReranker)
+from benchmarks.corpus import build_corpus, synthetic_queries
+
+SPLITTERS = ["equal_chunks", "unstructured_chunks", "simple_decision", "changing_decision"]
+
+STRATEGY_PARAMS = {
+  "top_k": {"k": 5},
+  "top_k_reranker": {"high_k": 20},
+  "top_k_cascade": {"k": 5, "high_k": 20},
+  "multi_query": {"n_results": 5, "n_queries": 3},
+  "multi_query_reranker": {"n_results": 5, "n_queries": 3},
+  "sentence_window_retrieval": {"n_main": 1, "n_around": 3},
+  "sentence_window_retriever_reranker": {"n_main": 3, "n_around": 4},
+  "hybrid": {"k": 5, "n_candidates": 20},
+  "hybrid_reranker": {"high_k": 8},
+  "mmr": {"k": 5, "fetch_k": 20, "lambda_mult": 0.5},
+  "adaptive": {"latency_budget_ms": 500},
+}
+
+def ingest(client, splitter, method: str, paths: list[str]) -> dict:
+  """Creates a fresh collection for a splitter method and loads the corpus."""
+  from backend.utils import chroma_functions as cf
+  name = f"bench_{method}"
+  try:
+    cf.delete_collection(client, name)
+  except Exception:
+    pass
+  collection = cf.create_collection(client, name)
+  start = time.perf_counter()
+  for path in paths:
+    documents = getattr(splitter, method)(path)
+    if documents:
+      cf.add_documents(collection, documents, os.path.basename(path))
+  return {"collection": name,
+          "chunks": collection.count(),
+          "ingest_seconds": round(time.perf_counter() - start, 3)}
+
+def run_strategy(retriever, counting: CountingClient, strategy: str,
+                 collection_name: str, queries: list[str],
+                 concurrency: list[int], memory_queries: int) -> dict:
+  """Measures one strategy over the query set."""
+  function = getattr(retriever, strategy)
+  params = STRATEGY_PARAMS[strategy]
+  call = lambda q: function(query=q, collection_name=collection_name, **params)
+  call(queries[0])  # warm-up: loads embedding/reranker models
+
+  counting.reset()
+  latencies = []
+  for query in queries:
+    start = time.perf_counter()
+    call(query)
+    latencies.append(time.perf_counter() - start)
+  round_trips = counting.total() / len(queries)
+
+  throughput = {}
+  for workers in concurrency:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+      list(pool.map(call, queries))
+    throughput[str(workers)] = round(len(queries) / (time.perf_counter() - start), 3)
+
+  rss_before = rss_mb()
+  tracemalloc.start()
+  for query in queries[:memory_queries]:
+    call(query)
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  return {
+    "strategy": strategy,
+    "parameters": params,
+    "latency_ms": latency_summary(latencies),
+    "throughput_qps": throughput,
+    "chroma_round_trips_per_query": round(round_trips, 2),
+    "chroma_calls": dict(counting.calls),
+    "memory_mb": {"python_peak": round(peak / 2**20, 3),
+                  "rss": round(rss_mb(), 1),
+                  "rss_delta": round(rss_mb() - rss_before, 1)},
+  }
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--splitters", nargs="+", default=SPLITTERS, choices=SPLITTERS)
+  parser.add_argument("--strategies", nargs="+", default=list(STRATEGY_PARAMS),
+                      choices=list(STRATEGY_PARAMS))
+  parser.add_argument("--docs", type=int, default=4, help="PDFs in the corpus")
+  parser.add_argument("--pages", type=int, default=10, help="pages per PDF")
+  parser.add_argument("--queries", type=int, default=30)
+  parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+  parser.add_argument("--memory-queries", type=int, default=5)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--max-tokens", type=int, default=0,
+                      help="context token budget applied to every result, 0 for none")
+  parser.add_argument("--compress", type=float, default=0.0,
+                      help="sentence similarity threshold for compression, 0 for none")
+  parser.add_argument("--stub-reranker", action="store_true",
+                      help="score with word overlap instead of loading BGE")
+  parser.add_argument("--output", help="JSON file, defaults to stdout")
+  args = parser.parse_args()
+
+  bootstrap()
+  import chromadb
+  from backend.utils.indexing import Splitter
+  from backend.utils.retrieval import Retriever
+  from backend.utils import metrics
+
+  client = chromadb.EphemeralClient()
+  splitter = Splitter()
+  counting = CountingClient(client)
+  retriever = Retriever(client=counting, llm=StubLLM(), max_tokens=args.max_tokens,
+                        compress_threshold=args.compress)
+  if args.stub_reranker:
+    retriever.re_ranker = StubReranker()
+
+  queries = synthetic_queries(args.queries, args.docs, args.pages, args.seed)
+  report = {"benchmark": "retrieval",
+            "environment": environment(),
+            "config": vars(args),
+            "results": []}
+  with tempfile.TemporaryDirectory() as corpus_dir:
+    paths = build_corpus(corpus_dir, args.docs, args.pages, args.seed)
+    for method in args.splitters:
+      collection = ingest(client, splitter, method, paths)
+      print(f"[{method}] {collection['chunks']} chunks in {collection['ingest_seconds']}s")
+      for strategy in args.strategies:
+        result = run_strategy(retriever, counting, strategy, collection["collection"],
+                              queries, args.concurrency, args.memory_queries)
+        result.update({"splitter": method, "chunks": collection["chunks"]})
+        report["results"].append(result)
+        print(f"  {strategy}: p50={result['latency_ms']['p50']}ms "
+              f"p95={result['latency_ms']['p95']}ms")
+  report["metrics"] = metrics.snapshot()
+  emit_json(report, args.output)
+
+if __name__ == "__main__":
+  main()
@@ -1,8 +1,11 @@
 import streamlit as st
 import backend.utils.chroma_functions as cf
 from backend.utils.indexing import Splitter
-from backend.utils.retrieval import Retriever
-import os
+from backend.utils.retrieval import Retriever, CASCADE_DEFAULTS
+from backend.utils import metrics
+from backend.utils import ingestion
+from backend.utils import sharding
+from backend.utils.hashing import file_sha256
 import inspect
 import nltk
 import backend.utils.sqlite_functions as sq
@@ -49,10 +52,16 @@ available_methods = [
 RETRIEVAL_METHOD_NAMES = {
   "top_k": "Top-K",
   "top_k_reranker": "Top-K (with Re-Ranker)",
+  "top_k_cascade": "Top-K (cascaded Re-Ranker)",
   "multi_query": "Multi-Query",
   "multi_query_reranker": "Multi-Query (with Re-Ranker)",
   "sentence_window_retrieval": "Sentence Window",
-  "sentence_window_retriever_reranker": "Sentence Window (with Re-Ranker)"
+  "sentence_window_retriever_reranker": "Sentence Window (with Re-Ranker)",
+  "hybrid": "Hybrid (Vector + BM25)",
+  "hybrid_reranker": "Hybrid (with Re-Ranker)",
+  "federated_search": "Federated (across collections)",
+  "mmr": "MMR (diverse Top-K)",
+  "adaptive": "Adaptive (latency budget)"
 }
 available_retrievers = [
   name for name, func in inspect.getmembers(retriever, predicate=inspect.ismethod)
@@ -100,6 +109,27 @@ else:
   elif technical_method == "unstructured_chunks":
     st.sidebar.text("No parameters for this method.")
 
+  shard_endpoints = st.sidebar.text_input(
+    "Shard endpoints (optional):",
+    help="Comma-separated Chroma host:port list to partition the collection across.")
+  shard_endpoints = [e.strip() for e in shard_endpoints.split(",") if e.strip()]
+  partition = "source"
+  if shard_endpoints:
+    partition = st.sidebar.radio("Partition chunks by:", options=["source", "hash"],
+                                 help="'source' keeps each document (and its sentence windows) "
+                                      "on one shard; 'hash' spreads the chunks evenly.")
+
+  hnsw = {}
+  with st.sidebar.expander("HNSW index (optional)"):
+    st.caption("0 keeps Chroma's default. ef_search can be tuned later with "
+               "python -m backend.utils.hnsw_tuning.")
+    for key, label in (("max_neighbors", "M (neighbors per node, default 16)"),
+                       ("ef_construction", "ef_construction (default 100)"),
+                       ("ef_search", "ef_search (default 100)")):
+      value = st.number_input(label, min_value=0, max_value=2048, value=0, step=1)
+      if value:
+        hnsw[key] = int(value)
+
   if st.sidebar.button("Create Collection"):
     if new_collection_name and new_collection_name not in collection_list:
       try:
@@ -109,6 +139,10 @@ else:
             index_method=technical_method,
             index_params=params
         )
+        if shard_endpoints:
+          sharding.configure_shards(new_collection_name, shard_endpoints, partition)
+        if hnsw:
+          sq.update_hnsw_sqlite(new_collection_name, hnsw)
         # Adding in Chroma
         cf.create_collection(
             client=client,
@@ -155,7 +189,8 @@ else:
 
     saved_method = collection_details.get("index_method")
     saved_params = collection_details.get("index_params", {}) 
-    pdf_names = collection_details.get("pdfs", [])
+    documents_info = sq.list_documents_sqlite(active_collection_name)
+    pdf_names = [d["name"] for d in documents_info]
 
     st.subheader("Collection Info")
     col1, col2 = st.columns(2)
@@ -167,10 +202,17 @@ else:
         st.json(saved_params)
       else:
         st.text("None")
+      saved_hnsw = sq.get_hnsw_sqlite(active_collection_name)
+      if saved_hnsw:
+        st.markdown(f"**HNSW Index:**")
+        st.json(saved_hnsw)
     with col2:
       st.markdown(f"**Documents in Collection ({len(pdf_names)}):**")
-      if pdf_names:
-        st.dataframe(pdf_names, use_container_width=True, hide_index=True, column_config={"value":"File Name"})
+      if documents_info:
+        st.dataframe(documents_info, use_container_width=True, hide_index=True,
+                     column_order=["name", "chunk_count", "ingested_at", "status"],
+                     column_config={"name": "File Name", "chunk_count": "Chunks",
+                                    "ingested_at": "Ingested At", "status": "Status"})
       else:
         st.text("No documents added yet.")
   except Exception as e:
@@ -189,44 +231,64 @@ else:
     if st.button("Process and Add to Collection", type="primary"):
       if uploaded_files and active_collection_name:
         try:
-          collection = cf.get_collection(client, active_collection_name)
-          progress_bar = st.progress(0, text="Starting process...")
-
-          for i, file in enumerate(uploaded_files):
-            progress = (i + 1) / len(uploaded_files)
-            progress_bar.progress(progress, text=f"Processing: {file.name}")
-            
-            if file.name in pdf_names:
-                st.warning(f"  > File '{file.name}' already exists in this collection's list. Skipped.")
+          for file in uploaded_files:
+            file_hash = file_sha256(file)
+            indexed_as = sq.find_document_by_hash_sqlite(active_collection_name, file_hash)
+            if indexed_as == file.name:
+                st.warning(f"  > File '{file.name}' is unchanged. Skipped.")
+                continue
+            if indexed_as is not None:
+                st.warning(f"  > File '{file.name}' is identical to '{indexed_as}'. Skipped.")
                 continue
 
-            temp_path = os.path.join("/tmp", file.name)
-            with open(temp_path, "wb") as f:
-              f.write(file.getbuffer())
-
-            processing_function = getattr(splitter, saved_method)
-            all_params = saved_params.copy()
-            all_params['file_path'] = temp_path
-            documents = processing_function(**all_params)
-
-            if documents:
-              cf.add_documents(collection, documents, file.name)
-              sq.add_pdf_to_collection_sqlite(active_collection_name, file.name)
-              st.write(f"  > File '{file.name}' processed and added successfully.")
-            else:
-              st.warning(f"No text extracted from '{file.name}'.")
-            os.remove(temp_path)
-
-          progress_bar.progress(1.0, text="Process complete!")
-          st.success("All files were processed!")
-          st.rerun()
+            file_path = ingestion.save_upload(file.name, file.getbuffer())
+            job_id = sq.enqueue_job_sqlite(active_collection_name, file.name, file_path)
+            st.write(f"  > File '{file.name}' queued (job {job_id}).")
+          st.success("Files queued! Processing continues in the background.")
 
         except Exception as e:
-          st.error(f"An error occurred during processing: {e}")
+          st.error(f"An error occurred while queuing: {e}")
           st.exception(e)
       elif not uploaded_files:
         st.warning("Please upload at least one file.")
 
+    @st.fragment(run_every="3s")
+    def show_jobs(collection_name: str):
+      """Polls the job queue so progress shows without blocking the page."""
+      jobs = sq.list_jobs_sqlite(collection_name, limit=20)
+      if jobs:
+        st.subheader("Ingestion Jobs")
+        st.dataframe(jobs, use_container_width=True, hide_index=True,
+                     column_order=["id", "file_name", "status", "progress", "attempts", "message", "updated_at"],
+                     column_config={"progress": st.column_config.ProgressColumn("Progress", min_value=0, max_value=1)})
+
+    show_jobs(active_collection_name)
+
+    st.header(f"➖ Remove a Document from '{active_collection_name}'")
+    if pdf_names:
+      document_to_remove = st.selectbox("Document to remove:", options=[""] + pdf_names)
+      compact_threshold = st.slider("Rebuild the index when deleted chunks exceed (%):", 5, 100, 20, 5)
+      if document_to_remove and st.button(f"Remove '{document_to_remove}'"):
+        try:
+          collection = cf.get_collection(client, active_collection_name)
+          removed = cf.delete_source(collection, document_to_remove)
+          sq.remove_document_sqlite(active_collection_name, document_to_remove, removed)
+          st.write(f"  > Removed {removed} chunks of '{document_to_remove}'.")
+
+          deleted = sq.get_deleted_chunks_sqlite(active_collection_name)
+          live = collection.count()
+          if deleted and deleted / (live + deleted) * 100 >= compact_threshold:
+            with st.spinner("Rebuilding the collection index..."):
+              cf.rebuild_collection(client, active_collection_name)
+            sq.reset_deleted_chunks_sqlite(active_collection_name)
+            st.write("  > Collection index rebuilt.")
+          st.rerun()
+        except Exception as e:
+          st.error(f"Removal failed: {e}")
+          st.exception(e)
+    else:
+      st.text("No documents to remove.")
+
   # Tab 2:
   with tab2:
     st.header(f"❓ Query '{active_collection_name}'")
@@ -261,6 +323,60 @@ else:
       retrieval_params['n_main'] = st.number_input("N Main (central docs)", min_value=1, max_value=10, value=3, step=1)
       retrieval_params['n_around'] = st.number_input("N Around (neighbor docs)", min_value=1, max_value=10, value=4, step=1)
 
+    elif technical_retrieval_method == "hybrid":
+      retrieval_params['k'] = st.number_input("K (documents to return)", min_value=1, max_value=50, value=5, step=1)
+      retrieval_params['n_candidates'] = st.number_input("Candidates per ranking", min_value=5, max_value=100, value=20, step=1)
+
+    elif technical_retrieval_method == "hybrid_reranker":
+      retrieval_params['high_k'] = st.number_input("High K (fused docs to rerank)", min_value=2, max_value=50, value=8, step=1)
+
+    elif technical_retrieval_method == "federated_search":
+      retrieval_params['collection_names'] = st.multiselect("Collections to search (all when empty)", options=collection_list, default=[active_collection_name] if active_collection_name in collection_list else [])
+      retrieval_params['k'] = st.number_input("K (documents to return)", min_value=1, max_value=50, value=5, step=1)
+      retrieval_params['rerank'] = st.checkbox("Merge with Re-Ranker", value=False)
+
+    elif technical_retrieval_method == "top_k_cascade":
+      retrieval_params['k'] = st.number_input("K (documents to return)", min_value=1, max_value=50, value=5, step=1)
+      retrieval_params['high_k'] = st.number_input("High K (candidates scored by vector similarity)", min_value=2, max_value=100, value=20, step=1)
+      search_params = {**CASCADE_DEFAULTS, **sq.get_search_params_sqlite(active_collection_name)}
+      with st.expander(f"Cascade thresholds for '{active_collection_name}'"):
+        margin = st.number_input("Skip the Re-Ranker when the top result leads by", min_value=0.0, max_value=1.0, value=float(search_params["cascade_margin"]), step=0.01)
+        band = st.number_input("Re-rank candidates within this similarity of the top result", min_value=0.0, max_value=1.0, value=float(search_params["cascade_band"]), step=0.01)
+        if st.button("Save thresholds"):
+          sq.update_search_params_sqlite(active_collection_name, {"cascade_margin": margin, "cascade_band": band})
+          st.success("Thresholds saved.")
+        st.caption(f"Re-Ranker skipped in {metrics.ratio('cascade_skipped', 'cascade_queries', collection=active_collection_name):.0%} of the queries since start.")
+
+    elif technical_retrieval_method == "adaptive":
+      retrieval_params['latency_budget_ms'] = st.number_input("Latency budget (ms)", min_value=50, max_value=30000, value=1500, step=50)
+
+    elif technical_retrieval_method == "mmr":
+      retrieval_params['k'] = st.number_input("K (documents to return)", min_value=1, max_value=50, value=5, step=1)
+      retrieval_params['fetch_k'] = st.number_input("Fetch K (candidates)", min_value=2, max_value=200, value=20, step=1)
+      retrieval_params['lambda_mult'] = st.slider("Lambda (0 = diverse, 1 = relevant)", min_value=0.0, max_value=1.0, value=0.5, step=0.05)
+
+    filters = []
+    where_document = None
+    with st.expander("Filters"):
+      filter_sources = st.multiselect("Only these documents (all when empty)", options=pdf_names)
+      filter_pages = st.text_input("Pages (e.g. 3-10, empty for all)")
+      filter_text = st.text_input("Chunks containing (exact text)")
+    if filter_sources:
+      filters.append({"source": {"$in": filter_sources}})
+    if filter_pages.strip():
+      first, _, last = filter_pages.partition("-")
+      try:
+        bounds = [{"page": {"$gte": int(first)}}, {"page": {"$lte": int(last or first)}}]
+        filters.extend(bounds)
+      except ValueError:
+        st.warning("Pages must look like '3' or '3-10'; the page filter is ignored.")
+    if filter_text.strip():
+      where_document = {"$contains": filter_text.strip()}
+    if filters:
+      retrieval_params['where'] = filters[0] if len(filters) == 1 else {"$and": filters}
+    if where_document:
+      retrieval_params['where_document'] = where_document
+
     query = st.text_input("Your question:", key="query_input")
 
     if st.button("Run Query", type="primary"):
@@ -270,7 +386,8 @@ else:
           
           all_retrieval_params = retrieval_params.copy()
           all_retrieval_params['query'] = query
-          all_retrieval_params['collection_name'] = active_collection_name
+          if technical_retrieval_method != "federated_search":
+            all_retrieval_params['collection_name'] = active_collection_name
           
           with st.spinner(f"Running '{selected_retrieval_friendly}'..."):
             result_prompt = retrieval_function(**all_retrieval_params)
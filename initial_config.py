@@ -1,6 +1,5 @@
 import sqlite3
-
-db_path = "config.db"
+from backend.utils.sqlite_functions import INGESTION_SCHEMA, db_path
 
 def create_tables(conn: sqlite3.Connection):
     cur = conn.cursor()
@@ -26,7 +25,11 @@ def create_tables(conn: sqlite3.Connection):
         name TEXT UNIQUE,
         index_method TEXT NOT NULL,
         index_params TEXT NOT NULL,
-        pdf_name TEXT
+        pdf_name TEXT,
+        deleted_chunks INTEGER DEFAULT 0,
+        search_params TEXT DEFAULT '{}',
+        shards TEXT,
+        hnsw TEXT DEFAULT '{}'
     );
 
     CREATE TABLE IF NOT EXISTS config (
@@ -36,16 +39,22 @@ def create_tables(conn: sqlite3.Connection):
         last_modification TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
     """)
+    cur.executescript(INGESTION_SCHEMA)
     conn.commit()
 
 def seed_config(conn: sqlite3.Connection):
     cur = conn.cursor()
+    new_install = cur.execute("SELECT COUNT(*) FROM config;").fetchone()[0] == 0
     entries = [
         ("openai_api_key", "teste"),
         ("openai_baseurl", ""),
         ("model", "qwen3:14b"),
         ("agent_name", "teste_local"),
-        ("retrieval_function", "sentence_window_retrieval")
+        ("retrieval_function", "sentence_window_retrieval"),
+        # Only new installs get a budget; existing ones keep whole results
+        ("context_token_budget", "4000" if new_install else "0"),
+        ("compression_threshold", "0"),
+        ("latency_budget_ms", "1500")
     ]
     cur.executemany(
         "INSERT OR IGNORE INTO config (name, value) VALUES (?, ?);",
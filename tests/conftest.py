@@ -0,0 +1,28 @@
+import os
+import sqlite3
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Before the backend is imported: a throwaway config.db and lexical index
+os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="tests_config_"), "config.db")
+os.environ["LEXICAL_INDEX_DIR"] = tempfile.mkdtemp(prefix="tests_lexical_")
+os.environ.pop("MODEL_SERVER_URL", None)
+
+import pytest
+import initial_config
+from backend.utils import lexical
+from backend.utils import sqlite_functions as sq
+
+@pytest.fixture(autouse=True)
+def config_db(tmp_path, monkeypatch):
+  """A fresh config.db and lexical index directory for every test."""
+  path = str(tmp_path / "config.db")
+  conn = sqlite3.connect(path)
+  initial_config.create_tables(conn)
+  conn.close()
+  monkeypatch.setattr(sq, "db_path", path)
+  monkeypatch.setattr(lexical, "INDEX_DIR", str(tmp_path / "lexical_index"))
+  monkeypatch.setattr(lexical, "_indexes", {})
+  return path
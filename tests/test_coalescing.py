@@ -0,0 +1,42 @@
+import threading
+from backend.utils import progress
+from backend.utils.coalescing import coalesced
+
+class Slow():
+  def __init__(self):
+    self.calls = 0
+    self.joined = threading.Event()
+
+  @coalesced
+  def search(self, query):
+    self.calls += 1
+    progress.report("started", query=query)
+    self.joined.wait(5)
+    progress.report("finished", query=query)
+    return [query]
+
+def test_every_coalesced_caller_gets_the_progress():
+  slow = Slow()
+  events = {"leader": [], "waiter": []}
+  started = {name: threading.Event() for name in events}
+  results = {}
+
+  def call(name):
+    def listener(stage, details):
+      events[name].append(stage)
+      started[name].set()
+    with progress.listening(listener):
+      results[name] = slow.search("fuse")
+
+  leader = threading.Thread(target=call, args=("leader",))
+  leader.start()
+  assert started["leader"].wait(5)
+  waiter = threading.Thread(target=call, args=("waiter",))
+  waiter.start()
+  assert started["waiter"].wait(5)  # replayed before the leader finishes
+  slow.joined.set()
+  leader.join()
+  waiter.join()
+  assert slow.calls == 1
+  assert results == {"leader": ["fuse"], "waiter": ["fuse"]}
+  assert events["leader"] == events["waiter"] == ["started", "finished"]
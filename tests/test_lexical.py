@@ -0,0 +1,45 @@
+from backend.utils import lexical
+
+class FakeCollection():
+  """The part of a Chroma collection that ensure_index reads."""
+  def __init__(self, name, n):
+    self.name = name
+    self.ids = [f"id{i}" for i in range(n)]
+    self.documents = [f"part PN-{100 + i % 50}-A{i % 7} text {i}" for i in range(n)]
+
+  def count(self):
+    return len(self.ids)
+
+  def get(self, include, limit, offset):
+    return {"ids": self.ids[offset:offset + limit],
+            "documents": self.documents[offset:offset + limit]}
+
+def test_first_add_indexes_the_whole_collection():
+  collection = FakeCollection("old", 30)
+  collection.ids.append("new")
+  collection.documents.append("brand new PN-999-Z9")
+  lexical.add_to_index(collection, ["new"], ["brand new PN-999-Z9"])
+  assert sorted(lexical.get_index("old").ids) == sorted(collection.ids)
+
+def test_add_never_creates_a_partial_index(tmp_path):
+  index = lexical.BM25Index(str(tmp_path / "missing"))
+  assert not index.add(["a"], ["some text"])
+  assert not index.exists()
+
+def test_small_adds_match_a_single_build():
+  reference = FakeCollection("reference", 1000)
+  built = lexical.ensure_index(reference)
+  incremental = lexical.ensure_index(FakeCollection("incremental", 0))
+  for start in range(0, 1000, 10):
+    incremental.add(reference.ids[start:start + 10], reference.documents[start:start + 10])
+  assert len(incremental.segments) < 10
+  for query in ["PN-105-A1", "text 17", "a3 pn-110"]:
+    expected, got = built.search(query, 1000), incremental.search(query, 1000)
+    assert sorted(expected) == sorted(got)
+
+def test_remove_and_reload():
+  index = lexical.ensure_index(FakeCollection("removed", 100))
+  index.remove([f"id{i}" for i in range(0, 100, 2)])
+  reader = lexical.BM25Index(index.path)
+  assert sorted(reader.ids) == sorted(f"id{i}" for i in range(1, 100, 2))
+  assert all(int(i[2:]) % 2 for i, _ in reader.search("text", 100))
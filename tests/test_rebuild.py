@@ -0,0 +1,52 @@
+import chromadb
+import numpy as np
+import pytest
+from backend.utils import chroma_functions as cf
+
+@pytest.fixture
+def client(tmp_path):
+  return chromadb.PersistentClient(path=str(tmp_path / "chroma"))
+
+def create(client, name, n=50, metadata=None):
+  collection = client.create_collection(name=name, embedding_function=None, metadata=metadata,
+                                        configuration={"hnsw": {"space": "cosine"}})
+  if n:
+    collection.add(ids=[f"{name}{i}" for i in range(n)], documents=[f"chunk {i}" for i in range(n)],
+                   embeddings=np.random.default_rng(0).normal(size=(n, 8)).astype(np.float32))
+  return collection
+
+def names(client):
+  return sorted(c.name for c in client.list_collections())
+
+def test_copy_refuses_an_existing_target(client):
+  source, target = create(client, "source"), create(client, "target", n=3)
+  with pytest.raises(ValueError):
+    cf.copy_collection(client, source, "target")
+  assert target.count() == 3
+
+def test_rebuild_swaps_in_the_copy(client):
+  collection = create(client, "manuals", metadata={"owner": "ops"})
+  collection.delete(ids=["manuals0", "manuals1"])
+  rebuilt = cf.rebuild_collection(client, "manuals", hnsw={"max_neighbors": 8})
+  assert names(client) == ["manuals"]
+  assert rebuilt.count() == 48
+  assert client.get_collection("manuals").metadata == {"owner": "ops"}
+  assert cf.hnsw_configuration(rebuilt)["max_neighbors"] == 8
+
+def test_rebuild_leaves_unrelated_collections_alone(client):
+  create(client, "manuals")
+  create(client, "manuals_rebuild", n=3)
+  with pytest.raises(ValueError):
+    cf.rebuild_collection(client, "manuals")
+  assert names(client) == ["manuals", "manuals_rebuild"]
+  assert client.get_collection("manuals_rebuild").count() == 3
+
+def test_rebuild_recovers_from_an_interrupted_swap(client):
+  marker = {cf.REBUILD_MARKER: "manuals"}
+  # Interrupted after setting the original aside, before renaming the copy
+  create(client, "manuals_replaced", metadata=marker)
+  create(client, "manuals_rebuild", n=10, metadata=marker)
+  rebuilt = cf.rebuild_collection(client, "manuals")
+  assert names(client) == ["manuals"]
+  assert rebuilt.count() == 50
+  assert client.get_collection("manuals").metadata is None
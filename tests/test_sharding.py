@@ -0,0 +1,148 @@
+import chromadb
+import numpy as np
+import pytest
+from chromadb.api.types import EmbeddingFunction
+from backend.utils import chroma_functions as cf
+from backend.utils import sharding
+from backend.utils import sqlite_functions as sq
+
+ENDPOINTS = ["node0:8000", "node1:8001", "node2:8002"]
+DIMENSION = 16
+
+class HashEmbedding(EmbeddingFunction):
+  """Deterministic embeddings, so the tests need no model."""
+  def __init__(self):
+    pass
+
+  def __call__(self, input):
+    return [np.random.default_rng(sum(map(ord, text))).normal(size=DIMENSION).astype(np.float32)
+            for text in input]
+
+  @staticmethod
+  def name() -> str:
+    return "hash_test"
+
+  @staticmethod
+  def build_from_config(config: dict) -> "HashEmbedding":
+    return HashEmbedding()
+
+  def get_config(self) -> dict:
+    return {}
+
+@pytest.fixture
+def nodes(tmp_path, monkeypatch):
+  """Three local Chroma stores standing in for three servers."""
+  clients = {e: chromadb.PersistentClient(path=str(tmp_path / e.replace(":", "_")))
+             for e in ENDPOINTS}
+  monkeypatch.setattr(sharding, "get_shard_client", clients.__getitem__)
+  sharding.invalidate_shard_map()
+  return clients
+
+@pytest.fixture
+def client(tmp_path, nodes):
+  return sharding.ShardedClient(chromadb.PersistentClient(path=str(tmp_path / "main")))
+
+def create(client, name, partition=None):
+  sq.create_collection_sqlite(name, "equal_chunks", {})
+  if partition:
+    sharding.configure_shards(name, ENDPOINTS, partition)
+  return client.create_collection(name=name, embedding_function=HashEmbedding(),
+                                  configuration={"hnsw": {"space": "cosine"}})
+
+def chunks(n_sources=12, per_source=10, seed=0):
+  rng = np.random.default_rng(seed)
+  ids, embeddings, metadatas, documents = [], [], [], []
+  for s in range(n_sources):
+    for c in range(per_source):
+      ids.append(f"doc{s}_{c}")
+      embeddings.append(rng.normal(size=DIMENSION).astype(np.float32))
+      metadatas.append({"source": f"doc{s}.pdf", "ordinal": c})
+      documents.append(f"document {s} chunk {c}")
+  return ids, np.asarray(embeddings), metadatas, documents
+
+def fill(collection, data):
+  ids, embeddings, metadatas, documents = data
+  collection.add(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+
+@pytest.mark.parametrize("partition", sharding.PARTITIONS)
+def test_query_merges_a_global_top_k(client, partition):
+  data = chunks()
+  sharded, plain = create(client, "sharded", partition), create(client, "plain")
+  fill(sharded, data)
+  fill(plain, data)
+  assert isinstance(sharded, sharding.ShardedCollection)
+  assert all(s.count() for s in sharded.shards)
+
+  queries = np.random.default_rng(1).normal(size=(5, DIMENSION)).astype(np.float32)
+  got = sharded.query(query_embeddings=queries, n_results=7)
+  expected = plain.query(query_embeddings=queries, n_results=7)
+  assert got["ids"] == expected["ids"]
+  assert np.allclose(got["distances"], expected["distances"])
+  assert got["metadatas"] == expected["metadatas"]
+
+  by_text = sharded.query(query_texts=["bomba"], n_results=3)
+  assert by_text["ids"] == plain.query(query_texts=["bomba"], n_results=3)["ids"]
+
+def test_source_partition_keeps_each_document_on_one_shard(client):
+  collection = create(client, "by_source", "source")
+  fill(collection, chunks())
+  for s in range(12):
+    home = sharding.shard_index(f"doc{s}.pdf", len(ENDPOINTS))
+    counts = [len(shard.get(where={"source": f"doc{s}.pdf"}, include=[])["ids"])
+              for shard in collection.shards]
+    assert counts == [10 if i == home else 0 for i in range(len(ENDPOINTS))]
+
+  home = sharding.shard_index("doc2.pdf", len(ENDPOINTS))
+  before = [shard.count() for shard in collection.shards]
+  collection.delete(where={"source": "doc2.pdf"})
+  after = [shard.count() for shard in collection.shards]
+  assert after == [n - 10 if i == home else n for i, n in enumerate(before)]
+
+def test_hash_partition_routes_writes_and_deletes_by_id(client):
+  collection = create(client, "by_hash", "hash")
+  ids = chunks()[0]
+  fill(collection, chunks())
+  for i, shard in enumerate(collection.shards):
+    stored = set(shard.get(include=[])["ids"])
+    assert stored == {c for c in ids if sharding.shard_index(c, len(ENDPOINTS)) == i}
+
+  removed = ids[::7]
+  collection.delete(ids=removed)
+  assert collection.count() == len(ids) - len(removed)
+  assert not collection.get(ids=removed, include=[])["ids"]
+
+  collection.update(ids=[ids[1]], metadatas=[{"source": "doc0.pdf", "ordinal": 99}])
+  home = collection.shards[sharding.shard_index(ids[1], len(ENDPOINTS))]
+  assert home.get(ids=[ids[1]])["metadatas"][0]["ordinal"] == 99
+
+def test_rebuild_sharded_collection(client):
+  collection = create(client, "rebuilt", "source")
+  fill(collection, chunks())
+  collection.delete(ids=["doc0_0", "doc3_5"])
+  queries = np.random.default_rng(2).normal(size=(4, DIMENSION)).astype(np.float32)
+  before = collection.query(query_embeddings=queries, n_results=5)["ids"]
+  counts = [shard.count() for shard in collection.shards]
+
+  rebuilt = cf.rebuild_collection(client, "rebuilt", hnsw={"max_neighbors": 8})
+  assert isinstance(rebuilt, sharding.ShardedCollection)
+  assert [shard.count() for shard in rebuilt.shards] == counts
+  assert all(cf.hnsw_configuration(shard)["max_neighbors"] == 8 for shard in rebuilt.shards)
+  assert rebuilt.query(query_embeddings=queries, n_results=5)["ids"] == before
+  assert all(not c.name.endswith("_rebuild") for node in rebuilt.clients
+             for c in node.list_collections())
+
+def test_shard_map_is_cached_until_shards_are_configured(client, monkeypatch):
+  create(client, "cached", "source")
+  reads = []
+  get_shards = sq.get_shards_sqlite
+  monkeypatch.setattr(sq, "get_shards_sqlite", lambda name: reads.append(name) or get_shards(name))
+
+  for _ in range(3):
+    assert isinstance(client.get_collection(name="cached", embedding_function=HashEmbedding()),
+                      sharding.ShardedCollection)
+  assert reads == []  # cached when the collection was created
+
+  sharding.configure_shards("cached", [])
+  assert not isinstance(client.create_collection(name="cached", embedding_function=HashEmbedding()),
+                        sharding.ShardedCollection)
+  assert reads == ["cached"]